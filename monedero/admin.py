@@ -1,5 +1,6 @@
 from datetime import timezone
 from django.contrib import admin
+from django.contrib.admin.helpers import ActionForm
 from django.contrib.auth.admin import UserAdmin
 import json
 from cryptography.fernet import Fernet, InvalidToken
@@ -12,7 +13,7 @@ from django.utils.html import format_html
 from django.db import transaction
 from django import forms
 
-from monedero.models import Agencia, Agente, AuditoriaAgente, AuditoriaMonedero, AuditoriaRecarga, AuditoriaRetencion, AuditoriaTransferencia, ConfiguracionSistema, DashboardAdmin, Monedero, Notificacion, Recarga, Reporte, Transaccion, TransaccionRetenida, Transferencia
+from monedero.models import Agencia, Agente, ArchivoAuditoria, AuditoriaAgente, AuditoriaMonedero, AuditoriaRecarga, AuditoriaRetencion, AuditoriaTransferencia, ConciliacionLibro, ConfiguracionSistema, DashboardAdmin, DiscrepanciaLibro, EventoMonedero, Monedero, MovimientoMonedero, Notificacion, Recarga, Reporte, Transaccion, TransaccionRetenida, Transferencia
 
 User = get_user_model()
 
@@ -56,6 +57,13 @@ class AgenteForm(forms.ModelForm):
         
         return cleaned_data
 
+class AjusteSaldoForm(ActionForm):
+    monto = forms.DecimalField(
+        label="Monto", max_digits=12, decimal_places=2, required=False,
+        help_text="Positivo abona, negativo descuenta"
+    )
+    motivo = forms.CharField(label="Motivo", max_length=100, required=False)
+
 # Configuración del sistema
 @admin.register(ConfiguracionSistema)
 class ConfiguracionSistemaAdmin(admin.ModelAdmin):
@@ -251,10 +259,16 @@ class AgenciaAdmin(admin.ModelAdmin):
 # Monederos
 @admin.register(Monedero)
 class MonederoAdmin(admin.ModelAdmin):
-    list_display = ('usuario', 'saldo', 'saldo_retenido', 'saldo_disponible', 'nivel_verificacion')
+    list_display = ('usuario', 'saldo', 'saldo_retenido', 'saldo_disponible', 'nivel_verificacion',
+                    'ultimo_movimiento', 'ultimo_concepto', 'ultimo_monto')
     list_filter = ('nivel_verificacion',)
+    list_select_related = ('usuario',)
     search_fields = ('usuario__username', 'usuario__first_name', 'usuario__last_name')
-    readonly_fields = ('saldo_disponible', 'estadisticas_dashboard')
+    # Los saldos solo cambian con asientos del libro mayor (acción ajustar_saldo)
+    readonly_fields = ('saldo', 'saldo_retenido', 'saldo_disponible', 'ultimo_movimiento', 'ultimo_concepto',
+                       'ultimo_monto', 'estadisticas_dashboard')
+    action_form = AjusteSaldoForm
+    actions = ['ajustar_saldo']
     fieldsets = (
         (None, {
             'fields': ('usuario', 'nivel_verificacion')
@@ -262,6 +276,9 @@ class MonederoAdmin(admin.ModelAdmin):
         ('Saldos', {
             'fields': ('saldo', 'saldo_retenido', 'saldo_disponible', 'limite_credito')
         }),
+        ('Último movimiento', {
+            'fields': ('ultimo_movimiento', 'ultimo_concepto', 'ultimo_monto')
+        }),
         ('Estadísticas', {
             'fields': ('estadisticas_dashboard',)
         }),
@@ -282,6 +299,40 @@ class MonederoAdmin(admin.ModelAdmin):
         )
     estadisticas_dashboard.short_description = 'Estadísticas'
 
+    @admin.action(description='Ajustar saldo (asiento AJUSTE)')
+    def ajustar_saldo(self, request, queryset):
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        if not form.is_valid() or not form.cleaned_data['monto'] or not form.cleaned_data['motivo']:
+            self.message_user(request, "Indique un monto distinto de cero y el motivo del ajuste", level='error')
+            return
+
+        monto, motivo = form.cleaned_data['monto'], form.cleaned_data['motivo']
+        for monedero in queryset.select_related('usuario'):
+            try:
+                monedero.actualizar_saldo(monto, motivo=motivo)
+                self.message_user(request, f"Saldo de {monedero.usuario} ajustado en {monto} XOF")
+            except Exception as e:
+                self.message_user(request, f"Error ajustando {monedero.usuario}: {str(e)}", level='error')
+
+@admin.register(MovimientoMonedero)
+class MovimientoMonederoAdmin(admin.ModelAdmin):
+    list_display = ('asiento', 'monedero', 'cuenta', 'tipo', 'monto', 'concepto', 'referencia', 'fecha')
+    list_filter = ('cuenta', 'tipo', 'concepto')
+    search_fields = ('asiento', 'referencia', 'monedero__usuario__username')
+    list_select_related = ('monedero__usuario',)
+    raw_id_fields = ('monedero',)
+
+    # El libro mayor es de solo inserción
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 # Transferencias
 class AuditoriaTransferenciaInline(admin.TabularInline):
     model = AuditoriaTransferencia
@@ -361,6 +412,8 @@ class AuditoriaMonederoAdmin(admin.ModelAdmin):
     list_display = ('monedero', 'accion', 'fecha')
     list_filter = ('accion', 'fecha')
     search_fields = ('monedero__usuario__username',)
+    list_select_related = ('monedero__usuario',)
+    show_full_result_count = False
     readonly_fields = ('monedero', 'accion', 'fecha', 'estado_anterior_display', 'estado_posterior_display', 'metadata_display')
 
     def estado_anterior_display(self, obj):
@@ -419,10 +472,10 @@ class DashboardAdminAdmin(admin.ModelAdmin):
 
 @admin.register(Reporte)
 class ReporteAdmin(admin.ModelAdmin):
-    list_display = ('tipo', 'creado_por', 'fecha_creacion', 'fecha_completado', 'descargar_reporte')
-    list_filter = ('tipo', 'fecha_creacion')
+    list_display = ('tipo', 'creado_por', 'estado', 'registros_procesados', 'fecha_creacion', 'fecha_completado', 'descargar_reporte')
+    list_filter = ('tipo', 'estado', 'fecha_creacion')
     search_fields = ('creado_por__username',)
-    readonly_fields = ('fecha_creacion', 'fecha_completado', 'parametros_display')
+    readonly_fields = ('fecha_creacion', 'fecha_completado', 'parametros_display', 'estado', 'registros_procesados', 'error')
 
     def descargar_reporte(self, obj):
         if obj.archivo:
@@ -518,8 +571,64 @@ class AuditoriaRetencionAdmin(admin.ModelAdmin):
     list_display = ('retencion', 'accion', 'fecha')
     list_filter = ('accion', 'fecha')
     search_fields = ('retencion__referencia', 'retencion__usuario__username')
+    list_select_related = ('retencion__usuario',)
+    show_full_result_count = False
     readonly_fields = ('detalles_display',)
     
     def detalles_display(self, obj):
         return format_html("<pre>{}</pre>", json.dumps(obj.detalles, indent=2))
-    detalles_display.short_description = 'Detalles'
\ No newline at end of file
+    detalles_display.short_description = 'Detalles'
+
+@admin.register(ArchivoAuditoria)
+class ArchivoAuditoriaAdmin(admin.ModelAdmin):
+    list_display = ('modelo', 'mes', 'registros', 'id_desde', 'id_hasta', 'fecha_creacion')
+    list_filter = ('modelo', 'mes')
+    exclude = ('datos',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class DiscrepanciaLibroInline(admin.TabularInline):
+    model = DiscrepanciaLibro
+    extra = 0
+    readonly_fields = ('monedero', 'saldo', 'saldo_libro', 'saldo_retenido', 'retenido_libro', 'retenido_retenciones')
+    can_delete = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('monedero__usuario')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ConciliacionLibro)
+class ConciliacionLibroAdmin(admin.ModelAdmin):
+    list_display = ('fecha_inicio', 'estado', 'rangos_completados', 'total_rangos', 'discrepancias', 'fecha_fin')
+    list_filter = ('estado',)
+    inlines = [DiscrepanciaLibroInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(EventoMonedero)
+class EventoMonederoAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'procesado', 'intentos', 'fecha_creacion', 'fecha_procesado')
+    list_filter = ('tipo', 'procesado')
+    readonly_fields = ('tipo', 'datos', 'fecha_creacion', 'procesado', 'fecha_procesado', 'intentos', 'error')
+    actions = ['reintentar']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Reintentar eventos descartados')
+    def reintentar(self, request, queryset):
+        reintentados = queryset.filter(procesado=False).update(intentos=0, error=None)
+        self.message_user(request, f"{reintentados} eventos volverán a despacharse")
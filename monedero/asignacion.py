@@ -0,0 +1,110 @@
+# monedero/asignacion.py
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "agentes_rotacion:version"
+TTL_ROTACION = 300
+MAX_ROTACION = 500
+
+
+class AsignadorAgentes:
+    """
+    Elige el agente que procesa una recarga asíncrona repartiendo la carga
+    entre los agentes activos, opcionalmente de una agencia o ciudad.
+
+    Estrategias (MONEDERO_ASIGNACION_AGENTES):
+        ROUND_ROBIN (por defecto): turno atómico en caché sobre una rotación
+            de ids cacheada, ordenada por ultima_actividad; no consulta la
+            tabla de agentes salvo para cargar el elegido.
+        LRU: el agente activo con ultima_actividad más antigua, reclamado
+            con SKIP LOCKED y marcado al momento para que dos workers no
+            elijan el mismo.
+
+    Uso:
+        agente = AsignadorAgentes().siguiente(ciudad='Malabo')
+    """
+    ROUND_ROBIN = 'ROUND_ROBIN'
+    LRU = 'LRU'
+
+    def __init__(self, estrategia=None):
+        self.estrategia = estrategia or getattr(settings, 'MONEDERO_ASIGNACION_AGENTES', self.ROUND_ROBIN)
+
+    def siguiente(self, agencia_id=None, ciudad=None):
+        """Devuelve el siguiente Agente activo del ámbito, o None si no hay"""
+        if self.estrategia == self.LRU:
+            return self._menos_reciente(agencia_id, ciudad)
+        return self._por_turno(agencia_id, ciudad)
+
+    @staticmethod
+    def invalidar():
+        """Descarta todas las rotaciones cacheadas (altas, bajas o cambios de activo)"""
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, timeout=None)
+
+    def _agentes(self, agencia_id, ciudad):
+        from .models import Agente
+
+        queryset = Agente.objects.filter(activo=True)
+        if agencia_id:
+            queryset = queryset.filter(agencia_id=agencia_id)
+        if ciudad:
+            queryset = queryset.filter(agencia__ciudad__iexact=ciudad)
+        return queryset
+
+    def _por_turno(self, agencia_id, ciudad):
+        ambito = f"{agencia_id or '*'}:{(ciudad or '*').lower()}"
+        version = cache.get_or_set(VERSION_KEY, 1, timeout=None)
+        clave = f"agentes_rotacion:{version}:{ambito}"
+
+        ids = cache.get(clave)
+        if ids is None:
+            ids = list(
+                self._agentes(agencia_id, ciudad)
+                .order_by(F('ultima_actividad').asc(nulls_first=True), 'pk')
+                .values_list('pk', flat=True)[:MAX_ROTACION]
+            )
+            cache.set(clave, ids, timeout=TTL_ROTACION)
+        if not ids:
+            return None
+
+        turno = self._turno(f"agentes_turno:{ambito}")
+        # Si el elegido dejó de estar activo se prueba el siguiente de la rotación
+        for desplazamiento in range(len(ids)):
+            agente = self._agentes(agencia_id, ciudad).select_related('usuario').filter(
+                pk=ids[(turno + desplazamiento) % len(ids)]
+            ).first()
+            if agente:
+                return agente
+            self.invalidar()
+        return None
+
+    @staticmethod
+    def _turno(clave):
+        try:
+            return cache.incr(clave)
+        except ValueError:
+            cache.add(clave, 0, timeout=None)
+            return cache.incr(clave)
+
+    def _menos_reciente(self, agencia_id, ciudad):
+        with transaction.atomic():
+            agente = (
+                self._agentes(agencia_id, ciudad)
+                .select_for_update(skip_locked=True, of=('self',))
+                .select_related('usuario')
+                .order_by(F('ultima_actividad').asc(nulls_first=True), 'pk')
+                .first()
+            )
+            if agente:
+                agente.ultima_actividad = timezone.now()
+                type(agente).objects.filter(pk=agente.pk).update(ultima_actividad=agente.ultima_actividad)
+        return agente
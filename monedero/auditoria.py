@@ -0,0 +1,106 @@
+# monedero/auditoria.py
+import logging
+import threading
+from collections import defaultdict
+from contextlib import ContextDecorator
+from datetime import datetime
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+_estado = threading.local()
+
+
+def _pila():
+    if not hasattr(_estado, 'pila'):
+        _estado.pila = []
+    return _estado.pila
+
+
+class RecolectorAuditoria(ContextDecorator):
+    """
+    Transacción que acumula los registros de auditoría creados dentro de
+    ella y los inserta con un bulk_create por modelo una vez confirmada,
+    fuera de la sección crítica que mantiene bloqueados los monederos.
+
+    Cada registro se añade al lote mediante transaction.on_commit, así que
+    los registros de un savepoint revertido se descartan con él. La fecha
+    se fija al registrar el evento, no al insertarlo. Con
+    MONEDERO_AUDITORIA_ASINCRONA = True el lote se envía a Celery en lugar
+    de insertarse en el proceso web.
+
+    Uso:
+        @RecolectorAuditoria()
+        def procesar(self): ...
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+
+    def __enter__(self):
+        atomic = transaction.atomic(using=self.using)
+        atomic.__enter__()
+        _pila().append((atomic, []))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        atomic, pendientes = _pila().pop()
+        if exc_type is None:
+            # Se registra después de los registros: on_commit respeta el orden
+            transaction.on_commit(partial(volcar, pendientes), using=self.using)
+        return atomic.__exit__(exc_type, exc_value, traceback)
+
+    @staticmethod
+    def agregar(instancia):
+        """
+        Encola la instancia en el recolector activo; sin recolector activo
+        se guarda inmediatamente como antes.
+        """
+        pila = _pila()
+        if not pila:
+            instancia.save()
+            return instancia
+
+        _, pendientes = pila[-1]
+        transaction.on_commit(partial(pendientes.append, instancia))
+        return instancia
+
+
+def volcar(pendientes):
+    """Inserta los registros pendientes con un bulk_create por modelo"""
+    por_modelo = defaultdict(list)
+    for instancia in pendientes:
+        por_modelo[type(instancia)].append(instancia)
+
+    asincrona = getattr(settings, 'MONEDERO_AUDITORIA_ASINCRONA', False)
+    for modelo, instancias in por_modelo.items():
+        if asincrona:
+            try:
+                from .tasks import guardar_auditorias
+                guardar_auditorias.delay(modelo._meta.label, [_a_dict(i) for i in instancias])
+                continue
+            except Exception as e:
+                logger.warning(f"Cola de auditoría no disponible, se inserta en línea: {str(e)}")
+
+        try:
+            modelo.objects.bulk_create(instancias, batch_size=500)
+        except Exception as e:
+            logger.error(
+                f"Error volcando {len(instancias)} registros de {modelo._meta.label}: {str(e)}",
+                exc_info=True
+            )
+
+
+def _a_dict(instancia):
+    # La fecha del evento viaja en ISO 8601 para que el worker no la
+    # sustituya por la hora de inserción
+    registro = {}
+    for campo in instancia._meta.concrete_fields:
+        if campo.primary_key:
+            continue
+        valor = campo.value_from_object(instancia)
+        registro[campo.attname] = valor.isoformat() if isinstance(valor, datetime) else valor
+    return registro
@@ -0,0 +1,143 @@
+# monedero/idempotencia.py
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+CABECERA = 'Idempotency-Key'
+# Tiempo que se conserva la respuesta de una clave (caché y tabla)
+VIGENCIA = timedelta(hours=24)
+# Una petición EN_CURSO más antigua se da por abandonada (proceso caído)
+PLAZO_EN_CURSO = timedelta(minutes=5)
+
+
+def idempotente(endpoint):
+    """
+    Decorador para acciones create de un ViewSet que atiende la cabecera
+    Idempotency-Key:
+
+    - Repetición de una petición terminada: devuelve la respuesta guardada
+      (caché y, si expiró de la caché, ClaveIdempotencia) sin ejecutar nada.
+    - Duplicado mientras la primera sigue en curso: 409 Conflict.
+    - Misma clave con otro contenido: 422.
+    - Errores 5xx o excepciones liberan la clave para poder reintentar.
+
+    Sin cabecera la acción se comporta como siempre.
+    """
+    def decorador(metodo):
+        @wraps(metodo)
+        def envoltura(vista, request, *args, **kwargs):
+            clave = request.headers.get(CABECERA)
+            if not clave or not request.user.is_authenticated:
+                return metodo(vista, request, *args, **kwargs)
+            if len(clave) > 255:
+                return Response(
+                    {'error': f'{CABECERA} no puede superar 255 caracteres'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            from .models import ClaveIdempotencia
+
+            huella = _huella(request)
+            clave_cache = "idempotencia:{}:{}:{}".format(
+                request.user.pk, endpoint, hashlib.sha256(clave.encode()).hexdigest()
+            )
+
+            guardada = cache.get(clave_cache)
+            if guardada:
+                return _repetir(guardada, huella)
+
+            filtro = {'usuario': request.user, 'endpoint': endpoint, 'clave': clave}
+            try:
+                with transaction.atomic():
+                    registro = ClaveIdempotencia.objects.create(huella=huella, **filtro)
+            except IntegrityError:
+                registro = ClaveIdempotencia.objects.filter(**filtro).first()
+                if registro and registro.estado == ClaveIdempotencia.Estados.COMPLETADA:
+                    guardada = _a_cache(registro)
+                    cache.set(clave_cache, guardada, timeout=int(VIGENCIA.total_seconds()))
+                    return _repetir(guardada, huella)
+                if not _retomar(registro, huella):
+                    return Response(
+                        {'error': f'Ya hay una petición en curso con esta {CABECERA}'},
+                        status=status.HTTP_409_CONFLICT,
+                        headers={'Retry-After': '1'}
+                    )
+
+            try:
+                respuesta = metodo(vista, request, *args, **kwargs)
+            except Exception:
+                ClaveIdempotencia.objects.filter(pk=registro.pk).delete()
+                raise
+
+            if respuesta.status_code >= 500:
+                ClaveIdempotencia.objects.filter(pk=registro.pk).delete()
+                return respuesta
+
+            guardada = {
+                'huella': huella,
+                'codigo': respuesta.status_code,
+                'respuesta': respuesta.data
+            }
+            ClaveIdempotencia.objects.filter(pk=registro.pk).update(
+                estado=ClaveIdempotencia.Estados.COMPLETADA,
+                codigo_respuesta=respuesta.status_code,
+                respuesta=respuesta.data
+            )
+            cache.set(clave_cache, guardada, timeout=int(VIGENCIA.total_seconds()))
+            return respuesta
+        return envoltura
+    return decorador
+
+
+def _huella(request):
+    """
+    Hash del contenido de la petición. Los archivos subidos (p. ej. el CSV
+    de un pago masivo) entran por su contenido, no solo por su nombre; se
+    leen por bloques y se rebobinan para la vista.
+    """
+    huella = hashlib.sha256(json.dumps(request.data, sort_keys=True, default=str).encode())
+    for campo, archivos in sorted(request.FILES.lists()):
+        for archivo in archivos:
+            huella.update(campo.encode())
+            for bloque in archivo.chunks():
+                huella.update(bloque)
+            archivo.seek(0)
+    return huella.hexdigest()
+
+
+def _retomar(registro, huella):
+    """Reclama una clave EN_CURSO abandonada; False si sigue viva"""
+    if registro is None or registro.fecha_creacion > timezone.now() - PLAZO_EN_CURSO:
+        return False
+    return bool(type(registro).objects.filter(
+        pk=registro.pk,
+        estado=registro.Estados.EN_CURSO,
+        fecha_creacion=registro.fecha_creacion
+    ).update(fecha_creacion=timezone.now(), huella=huella))
+
+
+def _a_cache(registro):
+    return {
+        'huella': registro.huella,
+        'codigo': registro.codigo_respuesta,
+        'respuesta': registro.respuesta
+    }
+
+
+def _repetir(guardada, huella):
+    if guardada['huella'] != huella:
+        return Response(
+            {'error': f'La {CABECERA} ya se usó con una petición distinta'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    return Response(guardada['respuesta'], status=guardada['codigo'], headers={'Idempotent-Replayed': 'true'})
@@ -0,0 +1,113 @@
+# monedero/management/commands/conciliar_libro.py
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Exists, OuterRef
+
+from monedero.models import ConciliacionLibro, DiscrepanciaLibro, MovimientoMonedero, RangoConciliacion
+
+# Asientos de apertura de los saldos anteriores al libro mayor; sin ellos
+# todo monedero antiguo con saldo aparecería como discrepancia
+MIGRACION_APERTURA = ('monedero', '0021_apertura_libro_mayor')
+
+
+def _inicializar_proceso():
+    # Con 'spawn'/'forkserver' el hijo arranca sin Django configurado; con
+    # 'fork' django.setup() no hace nada y solo se descartan las conexiones
+    # heredadas del padre
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def _conciliar_rango(pk):
+    return pk, RangoConciliacion(pk=pk).conciliar()
+
+
+class Command(BaseCommand):
+    help = (
+        "Concilia los saldos de Monedero con el libro mayor y las retenciones "
+        "activas, por rangos de ids en un pool de procesos. Por defecto "
+        "reanuda la última ejecución sin terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help='Procesos en paralelo (por defecto, uno por CPU)')
+        parser.add_argument('--tamano-rango', type=int, default=10000,
+                            help='Ids de Monedero por rango')
+        parser.add_argument('--nueva', action='store_true',
+                            help='Empieza una ejecución nueva aunque haya una sin terminar')
+        parser.add_argument('--salida', help='Escribe el informe de discrepancias en este CSV ("-" para la salida estándar)')
+
+    def handle(self, *args, **options):
+        if options['procesos'] < 1 or options['tamano_rango'] < 1:
+            raise CommandError('--procesos y --tamano-rango deben ser positivos')
+        if MIGRACION_APERTURA not in MigrationRecorder(connection).applied_migrations():
+            raise CommandError(
+                f"Falta aplicar la migración {'.'.join(MIGRACION_APERTURA)} con los asientos de apertura"
+            )
+
+        if options['nueva']:
+            conciliacion = ConciliacionLibro.iniciar(options['tamano_rango'])
+        else:
+            conciliacion = ConciliacionLibro.reanudar_o_iniciar(options['tamano_rango'])
+        pendientes = list(conciliacion.rangos_pendientes())
+        self.stdout.write(
+            f"Conciliación {conciliacion.pk}: {len(pendientes)} de {conciliacion.total_rangos} rangos pendientes"
+        )
+
+        if pendientes:
+            self._procesar(pendientes, options['procesos'])
+
+        conciliacion.refresh_from_db()
+        estilo = self.style.SUCCESS if not conciliacion.discrepancias else self.style.WARNING
+        self.stdout.write(estilo(
+            f"Conciliación {conciliacion.pk} {conciliacion.get_estado_display().lower()}: "
+            f"{conciliacion.discrepancias} discrepancias"
+        ))
+        sin_libro = conciliacion.detalle.filter(
+            ~Exists(MovimientoMonedero.objects.filter(monedero_id=OuterRef('monedero_id')))
+        ).count()
+        if sin_libro:
+            self.stdout.write(self.style.WARNING(
+                f"{sin_libro} de ellas son monederos con saldo y sin ningún movimiento en el libro mayor"
+            ))
+        if options['salida']:
+            self._informe(conciliacion, options['salida'])
+
+    def _procesar(self, pendientes, procesos):
+        if procesos == 1:
+            for pk in pendientes:
+                _conciliar_rango(pk)
+            return
+
+        # Los hijos no deben compartir el socket de la conexión del padre
+        connections.close_all()
+        terminados = 0
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_proceso) as pool:
+            futuros = [pool.submit(_conciliar_rango, pk) for pk in pendientes]
+            for futuro in as_completed(futuros):
+                pk, encontradas = futuro.result()
+                terminados += 1
+                if encontradas:
+                    self.stdout.write(self.style.WARNING(f"Rango {pk}: {encontradas} discrepancias"))
+                if terminados % 100 == 0:
+                    self.stdout.write(f"{terminados}/{len(pendientes)} rangos conciliados")
+
+    def _informe(self, conciliacion, ruta):
+        archivo = sys.stdout if ruta == '-' else open(ruta, 'w', newline='', encoding='utf-8')
+        try:
+            escritor = csv.writer(archivo)
+            escritor.writerow(DiscrepanciaLibro.COLUMNAS)
+            escritor.writerows(
+                conciliacion.detalle.order_by('monedero_id').values_list(*DiscrepanciaLibro.COLUMNAS).iterator(chunk_size=2000)
+            )
+        finally:
+            if archivo is not sys.stdout:
+                archivo.close()
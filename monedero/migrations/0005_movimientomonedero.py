@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-17 09:12
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0004_alter_auditoriamonedero_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoMonedero',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asiento', models.UUIDField(editable=False)),
+                ('cuenta', models.CharField(choices=[('DISPONIBLE', 'Saldo disponible'), ('RETENIDO', 'Saldo retenido'), ('COMISIONES', 'Comisiones del sistema'), ('RECARGAS', 'Fondos de recarga'), ('LIQUIDACIONES', 'Liquidación de retenciones'), ('AJUSTES', 'Ajustes manuales')], max_length=20)),
+                ('tipo', models.CharField(choices=[('DEBITO', 'Débito'), ('CREDITO', 'Crédito')], max_length=10)),
+                ('monto', models.DecimalField(decimal_places=2, max_digits=12, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))])),
+                ('concepto', models.CharField(max_length=50)),
+                ('referencia', models.CharField(blank=True, default='', max_length=100)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('monedero', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='monedero.monedero')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de Monedero',
+                'verbose_name_plural': 'Movimientos de Monedero',
+                'ordering': ['-fecha'],
+                'indexes': [models.Index(fields=['monedero', 'fecha'], name='idx_movimiento_monedero'), models.Index(fields=['asiento'], name='idx_movimiento_asiento'), models.Index(fields=['concepto', 'referencia'], name='idx_movimiento_referencia')],
+            },
+        ),
+    ]
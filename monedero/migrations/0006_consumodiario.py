@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-17 10:04
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0005_movimientomonedero'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('total_transferido', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('total_recargado', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('operaciones', models.PositiveIntegerField(default=0)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos_diarios', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Consumo Diario',
+                'verbose_name_plural': 'Consumos Diarios',
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'fecha'), name='unq_consumo_usuario_fecha')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.3 on 2026-10-17 11:20
+
+from django.db import migrations, models
+
+
+def programar_archivado(apps, schema_editor):
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    # Día 1 de cada mes a las 03:00
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute='0', hour='3', day_of_week='*', day_of_month='1', month_of_year='*'
+    )
+    PeriodicTask.objects.update_or_create(
+        name='monedero_archivar_auditorias',
+        defaults={'task': 'monedero.tasks.archivar_auditorias', 'crontab': schedule}
+    )
+
+
+def desprogramar_archivado(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name='monedero_archivar_auditorias').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0006_consumodiario'),
+        ('django_celery_beat', '__latest__'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditoriamonedero',
+            index=models.Index(fields=['fecha'], name='idx_auditoria_monedero_fecha'),
+        ),
+        migrations.CreateModel(
+            name='ArchivoAuditoria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(max_length=60)),
+                ('mes', models.DateField()),
+                ('id_desde', models.BigIntegerField()),
+                ('id_hasta', models.BigIntegerField()),
+                ('registros', models.PositiveIntegerField()),
+                ('datos', models.BinaryField()),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Archivo de Auditoría',
+                'verbose_name_plural': 'Archivos de Auditoría',
+                'ordering': ['-mes', 'modelo', 'id_desde'],
+                'indexes': [models.Index(fields=['modelo', 'mes'], name='idx_archivo_modelo_mes')],
+            },
+        ),
+        migrations.RunPython(programar_archivado, desprogramar_archivado),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.3 on 2026-10-17 12:02
+
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+TAMANO_LOTE = 10000
+
+SQL_POSTGRES = """
+    UPDATE monedero_auditoriamonedero SET
+        saldo_anterior = CASE WHEN jsonb_typeof(estado_anterior::jsonb -> 'saldo') = 'number'
+            THEN (estado_anterior::jsonb ->> 'saldo')::numeric(12, 2) END,
+        saldo_posterior = CASE WHEN jsonb_typeof(estado_posterior::jsonb -> 'saldo') = 'number'
+            THEN (estado_posterior::jsonb ->> 'saldo')::numeric(12, 2) END,
+        monto = CASE WHEN jsonb_typeof(metadata::jsonb -> 'monto') = 'number'
+            THEN (metadata::jsonb ->> 'monto')::numeric(12, 2) END
+    WHERE id >= %s AND id < %s AND saldo_posterior IS NULL
+"""
+
+
+def _decimal(valor):
+    try:
+        return Decimal(str(valor)).quantize(Decimal('0.00'))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+
+
+def rellenar_saldos(apps, schema_editor):
+    """Copia los saldos del JSON a las columnas tipadas por rangos de id"""
+    AuditoriaMonedero = apps.get_model('monedero', 'AuditoriaMonedero')
+    connection = schema_editor.connection
+    rango = AuditoriaMonedero.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+    if rango['min_id'] is None:
+        return
+
+    for inicio in range(rango['min_id'], rango['max_id'] + 1, TAMANO_LOTE):
+        fin = inicio + TAMANO_LOTE
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(SQL_POSTGRES, [inicio, fin])
+            continue
+
+        lote = list(AuditoriaMonedero.objects.filter(id__gte=inicio, id__lt=fin, saldo_posterior__isnull=True))
+        for registro in lote:
+            registro.saldo_anterior = _decimal((registro.estado_anterior or {}).get('saldo'))
+            registro.saldo_posterior = _decimal((registro.estado_posterior or {}).get('saldo'))
+            registro.monto = _decimal((registro.metadata or {}).get('monto'))
+        AuditoriaMonedero.objects.bulk_update(lote, ['saldo_anterior', 'saldo_posterior', 'monto'])
+
+
+class Migration(migrations.Migration):
+    # Cada lote del relleno se confirma por separado
+    atomic = False
+
+    dependencies = [
+        ('monedero', '0007_archivoauditoria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditoriamonedero',
+            name='saldo_anterior',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='auditoriamonedero',
+            name='saldo_posterior',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='auditoriamonedero',
+            name='monto',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.RemoveIndex(
+            model_name='auditoriamonedero',
+            name='idx_saldo_posterior',
+        ),
+        migrations.RemoveIndex(
+            model_name='auditoriamonedero',
+            name='idx_saldo_anterior',
+        ),
+        migrations.RunPython(rellenar_saldos, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='auditoriamonedero',
+            index=models.Index(fields=['monedero', 'saldo_posterior'], name='idx_auditoria_monedero_saldo'),
+        ),
+    ]
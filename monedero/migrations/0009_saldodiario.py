@@ -0,0 +1,54 @@
+# Generated by Django 5.2.3 on 2026-10-17 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def programar_consolidacion(apps, schema_editor):
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    # Todos los días a las 00:30, antes del archivado mensual de auditorías
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute='30', hour='0', day_of_week='*', day_of_month='*', month_of_year='*'
+    )
+    PeriodicTask.objects.update_or_create(
+        name='monedero_consolidar_saldos_diarios',
+        defaults={'task': 'monedero.tasks.consolidar_saldos_diarios', 'crontab': schedule}
+    )
+
+
+def desprogramar_consolidacion(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name='monedero_consolidar_saldos_diarios').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0008_auditoriamonedero_saldos_tipados'),
+        ('django_celery_beat', '__latest__'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('saldo_apertura', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('saldo_cierre', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('saldo_minimo', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('saldo_maximo', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('movimientos', models.PositiveIntegerField(default=0)),
+                ('monedero', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_diarios', to='monedero.monedero')),
+            ],
+            options={
+                'verbose_name': 'Saldo Diario',
+                'verbose_name_plural': 'Saldos Diarios',
+                'ordering': ['-fecha'],
+                'constraints': [models.UniqueConstraint(fields=('monedero', 'fecha'), name='unq_saldo_diario_monedero_fecha')],
+            },
+        ),
+        migrations.RunPython(programar_consolidacion, desprogramar_consolidacion),
+    ]
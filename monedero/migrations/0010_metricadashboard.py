@@ -0,0 +1,53 @@
+# Generated by Django 5.2.3 on 2026-10-17 15:10
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def programar_conciliacion(apps, schema_editor):
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    # Cada hora; la primera ejecución siembra los contadores
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute='15', hour='*', day_of_week='*', day_of_month='*', month_of_year='*'
+    )
+    PeriodicTask.objects.update_or_create(
+        name='monedero_conciliar_metricas_dashboard',
+        defaults={'task': 'monedero.tasks.conciliar_metricas_dashboard', 'crontab': schedule}
+    )
+
+
+def desprogramar_conciliacion(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name='monedero_conciliar_metricas_dashboard').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0009_saldodiario'),
+        ('django_celery_beat', '__latest__'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricaDashboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(choices=[('USUARIOS', 'Usuarios'), ('USUARIOS_ACTIVOS', 'Usuarios activos'), ('TRANSFERENCIAS', 'Transferencias'), ('RECARGAS', 'Recargas'), ('SALDO_TOTAL', 'Saldo total'), ('COMISIONES', 'Comisiones'), ('AGENTES_ACTIVOS', 'Agentes activos'), ('AGENCIAS_ACTIVAS', 'Agencias activas')], max_length=30)),
+                ('fecha', models.DateField(blank=True, null=True)),
+                ('fragmento', models.PositiveSmallIntegerField(default=0)),
+                ('valor', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+            ],
+            options={
+                'verbose_name': 'Métrica del Dashboard',
+                'verbose_name_plural': 'Métricas del Dashboard',
+                'constraints': [
+                    models.UniqueConstraint(condition=models.Q(('fecha__isnull', True)), fields=('clave', 'fragmento'), name='unq_metrica_acumulada'),
+                    models.UniqueConstraint(condition=models.Q(('fecha__isnull', False)), fields=('clave', 'fecha', 'fragmento'), name='unq_metrica_diaria'),
+                ],
+            },
+        ),
+        migrations.RunPython(programar_conciliacion, desprogramar_conciliacion),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-17 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0010_metricadashboard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transferencia',
+            index=models.Index(fields=['emisor', 'fecha_creacion', 'id'], name='idx_transf_emisor_cursor'),
+        ),
+        migrations.AddIndex(
+            model_name='transferencia',
+            index=models.Index(fields=['receptor', 'fecha_creacion', 'id'], name='idx_transf_receptor_cursor'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['usuario', 'fecha', 'id'], name='idx_notificacion_cursor'),
+        ),
+        migrations.AddIndex(
+            model_name='transaccion',
+            index=models.Index(fields=['usuario', 'creado_en', 'id'], name='idx_transaccion_cursor'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-17 17:05
+
+from django.db import migrations, models
+
+
+def programar_despachador(apps, schema_editor):
+    IntervalSchedule = apps.get_model('django_celery_beat', 'IntervalSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    Transferencia = apps.get_model('monedero', 'Transferencia')
+
+    # Las tareas de una sola transferencia dejan de existir: el despachador
+    # recoge esas transferencias, que siguen en estado PROGRAMADA
+    PeriodicTask.objects.filter(
+        name__startswith='transferencia_',
+        task__endswith='tasks.ejecutar_transferencia_programada'
+    ).delete()
+    Transferencia.objects.filter(tarea_programada__isnull=False).update(tarea_programada=None)
+
+    schedule, _ = IntervalSchedule.objects.get_or_create(every=15, period='seconds')
+    PeriodicTask.objects.update_or_create(
+        name='monedero_despachar_transferencias_programadas',
+        defaults={'task': 'monedero.tasks.despachar_transferencias_programadas', 'interval': schedule}
+    )
+
+
+def desprogramar_despachador(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name='monedero_despachar_transferencias_programadas').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0011_indices_cursor'),
+        ('django_celery_beat', '__latest__'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transferencia',
+            index=models.Index(condition=models.Q(('estado__in', ['PROGRAMADA', 'PENDIENTE']), ('fecha_programada__isnull', False)), fields=['fecha_programada'], name='idx_transf_despacho'),
+        ),
+        migrations.RunPython(programar_despachador, desprogramar_despachador),
+    ]
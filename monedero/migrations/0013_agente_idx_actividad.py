@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-17 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0012_despacho_transferencias_programadas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agente',
+            index=models.Index(fields=['activo', 'ultima_actividad'], name='idx_agente_actividad'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.3 on 2026-10-17 18:15
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def programar_purga(apps, schema_editor):
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute='45', hour='*', day_of_week='*', day_of_month='*', month_of_year='*'
+    )
+    PeriodicTask.objects.update_or_create(
+        name='monedero_purgar_claves_idempotencia',
+        defaults={'task': 'monedero.tasks.purgar_claves_idempotencia', 'crontab': schedule}
+    )
+
+
+def desprogramar_purga(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name='monedero_purgar_claves_idempotencia').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0013_agente_idx_actividad'),
+        ('django_celery_beat', '__latest__'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaveIdempotencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=50)),
+                ('clave', models.CharField(max_length=255)),
+                ('huella', models.CharField(max_length=64)),
+                ('estado', models.CharField(choices=[('EN_CURSO', 'En curso'), ('COMPLETADA', 'Completada')], default='EN_CURSO', max_length=20)),
+                ('codigo_respuesta', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('respuesta', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='claves_idempotencia', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Clave de Idempotencia',
+                'verbose_name_plural': 'Claves de Idempotencia',
+                'indexes': [models.Index(fields=['fecha_creacion'], name='idx_idempotencia_fecha')],
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'endpoint', 'clave'), name='unq_idempotencia_usuario_clave')],
+            },
+        ),
+        migrations.RunPython(programar_purga, desprogramar_purga),
+    ]
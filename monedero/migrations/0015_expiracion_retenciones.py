@@ -0,0 +1,35 @@
+# Generated by Django 5.2.3 on 2026-10-17 18:50
+
+from django.db import migrations, models
+
+
+def programar_expiracion(apps, schema_editor):
+    IntervalSchedule = apps.get_model('django_celery_beat', 'IntervalSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    schedule, _ = IntervalSchedule.objects.get_or_create(every=60, period='seconds')
+    PeriodicTask.objects.update_or_create(
+        name='monedero_expirar_retenciones',
+        defaults={'task': 'monedero.tasks.expirar_retenciones', 'interval': schedule}
+    )
+
+
+def desprogramar_expiracion(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name='monedero_expirar_retenciones').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0014_claveidempotencia'),
+        ('django_celery_beat', '__latest__'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaccionretenida',
+            index=models.Index(condition=models.Q(('estado', 'ACTIVA')), fields=['fecha_expiracion'], name='idx_retencion_activa_expira'),
+        ),
+        migrations.RunPython(programar_expiracion, desprogramar_expiracion),
+    ]
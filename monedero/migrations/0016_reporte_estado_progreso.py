@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-17 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0015_expiracion_retenciones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reporte',
+            name='estado',
+            field=models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En proceso'), ('COMPLETADO', 'Completado'), ('FALLIDO', 'Fallido')], default='PENDIENTE', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='reporte',
+            name='registros_procesados',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='reporte',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
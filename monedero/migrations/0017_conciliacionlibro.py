@@ -0,0 +1,89 @@
+# Generated by Django 5.2.3 on 2026-10-17 19:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def programar_conciliacion(apps, schema_editor):
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    # Todos los días a las 02:00, después de la consolidación de saldos
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute='0', hour='2', day_of_week='*', day_of_month='*', month_of_year='*'
+    )
+    PeriodicTask.objects.update_or_create(
+        name='monedero_conciliar_libro_mayor',
+        defaults={'task': 'monedero.tasks.conciliar_libro_mayor', 'crontab': schedule}
+    )
+
+
+def desprogramar_conciliacion(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name='monedero_conciliar_libro_mayor').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0016_reporte_estado_progreso'),
+        ('django_celery_beat', '__latest__'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConciliacionLibro',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('EN_CURSO', 'En curso'), ('COMPLETADA', 'Completada')], default='EN_CURSO', max_length=20)),
+                ('tamano_rango', models.PositiveIntegerField()),
+                ('total_rangos', models.PositiveIntegerField(default=0)),
+                ('rangos_completados', models.PositiveIntegerField(default=0)),
+                ('discrepancias', models.PositiveIntegerField(default=0)),
+                ('fecha_inicio', models.DateTimeField(auto_now_add=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Conciliación del Libro Mayor',
+                'verbose_name_plural': 'Conciliaciones del Libro Mayor',
+                'ordering': ['-fecha_inicio'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RangoConciliacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('desde', models.BigIntegerField()),
+                ('hasta', models.BigIntegerField()),
+                ('completado', models.BooleanField(default=False)),
+                ('monederos', models.PositiveIntegerField(default=0)),
+                ('fecha_completado', models.DateTimeField(blank=True, null=True)),
+                ('conciliacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rangos', to='monedero.conciliacionlibro')),
+            ],
+            options={
+                'verbose_name': 'Rango de Conciliación',
+                'verbose_name_plural': 'Rangos de Conciliación',
+                'indexes': [models.Index(fields=['conciliacion', 'completado'], name='idx_rango_conciliacion')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DiscrepanciaLibro',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('saldo_libro', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('saldo_retenido', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('retenido_libro', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('retenido_retenciones', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('conciliacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='detalle', to='monedero.conciliacionlibro')),
+                ('monedero', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discrepancias', to='monedero.monedero')),
+            ],
+            options={
+                'verbose_name': 'Discrepancia del Libro Mayor',
+                'verbose_name_plural': 'Discrepancias del Libro Mayor',
+                'ordering': ['monedero'],
+            },
+        ),
+        migrations.RunPython(programar_conciliacion, desprogramar_conciliacion),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.3 on 2026-10-17 20:10
+
+from django.db import migrations, models
+from django.db.models import Max, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+TAMANO_LOTE = 10000
+
+
+def rellenar_ultimo_movimiento(apps, schema_editor):
+    """Copia el último movimiento del libro mayor de cada monedero por rangos de id"""
+    Monedero = apps.get_model('monedero', 'Monedero')
+    MovimientoMonedero = apps.get_model('monedero', 'MovimientoMonedero')
+    AuditoriaMonedero = apps.get_model('monedero', 'AuditoriaMonedero')
+    rango = Monedero.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+    if rango['min_id'] is None:
+        return
+
+    ultimo = MovimientoMonedero.objects.filter(monedero=OuterRef('pk')).order_by('-fecha', '-id')
+    ultima_auditoria = AuditoriaMonedero.objects.filter(
+        monedero=OuterRef('pk'), monto__isnull=False
+    ).order_by('-fecha', '-id')
+
+    for inicio in range(rango['min_id'], rango['max_id'] + 1, TAMANO_LOTE):
+        Monedero.objects.filter(
+            id__gte=inicio, id__lt=inicio + TAMANO_LOTE, ultimo_movimiento__isnull=True
+        ).update(
+            ultimo_movimiento=Subquery(ultimo.values('fecha')[:1]),
+            ultimo_concepto=Coalesce(Subquery(ultimo.values('concepto')[:1]), Value('')),
+            ultimo_monto=Subquery(ultima_auditoria.values('monto')[:1])
+        )
+
+
+class Migration(migrations.Migration):
+    # Cada lote del relleno se confirma por separado
+    atomic = False
+
+    dependencies = [
+        ('monedero', '0017_conciliacionlibro'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monedero',
+            name='ultimo_movimiento',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='monedero',
+            name='ultimo_concepto',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='monedero',
+            name='ultimo_monto',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.RunPython(rellenar_ultimo_movimiento, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.3 on 2026-10-17 20:45
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+def programar_relay(apps, schema_editor):
+    IntervalSchedule = apps.get_model('django_celery_beat', 'IntervalSchedule')
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    intervalo, _ = IntervalSchedule.objects.get_or_create(every=5, period='seconds')
+    PeriodicTask.objects.update_or_create(
+        name='monedero_despachar_eventos',
+        defaults={'task': 'monedero.tasks.despachar_eventos_monedero', 'interval': intervalo}
+    )
+
+    # Todos los días a las 03:30
+    diario, _ = CrontabSchedule.objects.get_or_create(
+        minute='30', hour='3', day_of_week='*', day_of_month='*', month_of_year='*'
+    )
+    PeriodicTask.objects.update_or_create(
+        name='monedero_purgar_eventos',
+        defaults={'task': 'monedero.tasks.purgar_eventos_monedero', 'crontab': diario}
+    )
+
+
+def desprogramar_relay(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name__in=['monedero_despachar_eventos', 'monedero_purgar_eventos']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0018_monedero_ultimo_movimiento'),
+        ('django_celery_beat', '__latest__'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoMonedero',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('TRANSFERENCIA_COMPLETADA', 'Transferencia completada'), ('RECARGA_COMPLETADA', 'Recarga completada'), ('RETENCION_LIBERADA', 'Retención liberada')], max_length=30)),
+                ('datos', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('procesado', models.BooleanField(default=False)),
+                ('fecha_procesado', models.DateTimeField(blank=True, null=True)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Evento de Monedero',
+                'verbose_name_plural': 'Eventos de Monedero',
+                'indexes': [models.Index(condition=models.Q(('procesado', False)), fields=['id'], name='idx_evento_pendiente'), models.Index(condition=models.Q(('procesado', True)), fields=['fecha_procesado'], name='idx_evento_procesado')],
+            },
+        ),
+        migrations.RunPython(programar_relay, desprogramar_relay),
+    ]
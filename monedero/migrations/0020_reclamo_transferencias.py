@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+def marcar_reclamadas(apps, schema_editor):
+    Transferencia = apps.get_model('monedero', 'Transferencia')
+
+    # Las ya reclamadas por el despachador anterior cuentan como un intento
+    # reclamado al vencer, para que un reintento pendiente no se pierda
+    Transferencia.objects.filter(
+        estado='PENDIENTE',
+        fecha_programada__isnull=False,
+        fecha_procesamiento__isnull=True
+    ).update(fecha_reclamo=models.F('fecha_programada'), intentos_despacho=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0019_eventomonedero'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transferencia',
+            name='fecha_reclamo',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='transferencia',
+            name='intentos_despacho',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(marcar_reclamadas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.3 on 2026-10-17 21:30
+
+import uuid
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+
+CONCEPTO = 'APERTURA'
+TAMANO_LOTE = 2000
+
+
+def _neto(condicion=None):
+    monto = Case(When(tipo='CREDITO', then=F('monto')), default=-F('monto'), output_field=DecimalField())
+    if condicion is not None:
+        monto = Case(When(condicion, then=monto), default=Value(Decimal('0.00')), output_field=DecimalField())
+    return Sum(monto)
+
+
+def abrir_libro(apps, schema_editor):
+    """
+    Asiento de apertura por monedero con la parte de saldo y saldo_retenido
+    que el libro mayor no explica (todo el saldo anterior a 0005), contra
+    la cuenta AJUSTES, para que los saldos se deriven del libro desde el
+    principio.
+    """
+    Monedero = apps.get_model('monedero', 'Monedero')
+    MovimientoMonedero = apps.get_model('monedero', 'MovimientoMonedero')
+
+    ultimo = 0
+    while True:
+        monederos = list(
+            Monedero.objects.filter(pk__gt=ultimo).order_by('pk').values_list('pk', 'saldo', 'saldo_retenido')[:TAMANO_LOTE]
+        )
+        if not monederos:
+            break
+        ultimo = monederos[-1][0]
+
+        libro = {
+            fila['monedero_id']: fila
+            for fila in MovimientoMonedero.objects.filter(monedero_id__in=[pk for pk, _, _ in monederos])
+            .values('monedero_id')
+            .annotate(saldo=_neto(), retenido=_neto(Q(cuenta='RETENIDO')))
+        }
+
+        movimientos = []
+        for pk, saldo, retenido in monederos:
+            fila = libro.get(pk, {})
+            delta_retenido = retenido - (fila.get('retenido') or 0)
+            delta_disponible = (saldo - retenido) - ((fila.get('saldo') or 0) - (fila.get('retenido') or 0))
+            partidas = [
+                (cuenta, delta, pk)
+                for cuenta, delta in (('DISPONIBLE', delta_disponible), ('RETENIDO', delta_retenido))
+                if delta
+            ]
+            if not partidas:
+                continue
+            contrapartida = -(delta_disponible + delta_retenido)
+            if contrapartida:
+                partidas.append(('AJUSTES', contrapartida, None))
+
+            asiento = uuid.uuid4()
+            movimientos.extend(
+                MovimientoMonedero(
+                    asiento=asiento,
+                    monedero_id=monedero_id,
+                    cuenta=cuenta,
+                    tipo='CREDITO' if delta > 0 else 'DEBITO',
+                    monto=abs(delta),
+                    concepto=CONCEPTO,
+                    referencia=str(pk)
+                )
+                for cuenta, delta, monedero_id in partidas
+            )
+        MovimientoMonedero.objects.bulk_create(movimientos, batch_size=1000)
+
+
+def cerrar_libro(apps, schema_editor):
+    MovimientoMonedero = apps.get_model('monedero', 'MovimientoMonedero')
+    MovimientoMonedero.objects.filter(concepto=CONCEPTO).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0020_reclamo_transferencias'),
+    ]
+
+    operations = [
+        migrations.RunPython(abrir_libro, cerrar_libro),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-17 22:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0022_fecha_evento_auditorias'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaccionretenida',
+            name='reintentar_expiracion',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
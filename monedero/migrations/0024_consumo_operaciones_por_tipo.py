@@ -0,0 +1,47 @@
+# Generated by Django 5.2.3 on 2026-10-18 09:10
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def separar_operaciones(apps, schema_editor):
+    """
+    Hasta ahora 'operaciones' sumaba transferencias y recargas. Solo las
+    filas de hoy (y ayer, por la diferencia entre fecha UTC y local) se
+    usan para los límites, así que basta con separar esas.
+    """
+    ConsumoDiario = apps.get_model('monedero', 'ConsumoDiario')
+    Recarga = apps.get_model('monedero', 'Recarga')
+
+    for consumo in ConsumoDiario.objects.filter(fecha__gte=timezone.localdate() - timedelta(days=1)):
+        recargas = Recarga.objects.filter(
+            usuario_id=consumo.usuario_id,
+            estado='COMPLETADA',
+            fecha_creacion__date=consumo.fecha
+        ).count()
+        consumo.recargas = recargas
+        consumo.transferencias = max(consumo.transferencias - recargas, 0)
+        consumo.save(update_fields=['recargas', 'transferencias'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monedero', '0023_aplazar_expiracion_retenciones'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='consumodiario',
+            old_name='operaciones',
+            new_name='transferencias',
+        ),
+        migrations.AddField(
+            model_name='consumodiario',
+            name='recargas',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(separar_operaciones, migrations.RunPython.noop),
+    ]
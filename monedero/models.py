@@ -1,4 +1,9 @@
 from decimal import Decimal
+import csv
+import io
+import random
+import tempfile
+import time
 import uuid
 from django.db.models import JSONField  # ✅ Correcto
 import logging
@@ -6,34 +11,39 @@ from django.db import models
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.exceptions import ValidationError
 
-from django.db import models
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-import logging
-from django.db.models.functions import Cast
-from django.db.models import FloatField
-from django.db.models import Max, F
+from collections import namedtuple
+from django.db.models import Max, OuterRef, Subquery
 from django.db.models import Sum, F, Q
 from cryptography.fernet import Fernet
-from datetime import timedelta
+from datetime import datetime, timedelta
 from django.db import connection
 from django.core.cache import cache
 from django_celery_results.models import TaskResult
-from django_celery_beat.models import PeriodicTask, IntervalSchedule
+import gzip
 import json
 from django.urls import reverse
+from django.utils.dateparse import parse_date
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from .auditoria import RecolectorAuditoria
+from .exceptions import LimiteDiarioExcedidoError, SaldoInsuficienteError
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+# Copia en memoria de ConfiguracionSistema por proceso: (versión, objeto, última verificación)
+_configuracion_local = {}
+
 ## ----------------------------
 ## 1. MODELOS DE CONFIGURACIÓN
 ## ----------------------------
@@ -64,13 +74,51 @@ class ConfiguracionSistema(models.Model):
     )
     reintentos_fallidos = models.PositiveIntegerField(default=3)
 
+    # Clave compartida (Redis) con la versión vigente de la configuración
+    CACHE_VERSION_KEY = "configuracion_sistema:version"
+    # Segundos que un proceso confía en su copia sin consultar la versión
+    INTERVALO_VERIFICACION = 5
+
     class Meta:
         verbose_name = "Configuración del Sistema"
         verbose_name_plural = "Configuraciones del Sistema"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        transaction.on_commit(self.publicar_cambio)
+
     @classmethod
-    def cargar(cls):
-        obj, created = cls.objects.get_or_create(pk=1)
+    def publicar_cambio(cls):
+        """Invalida la copia local de todos los procesos (gunicorn y Celery)"""
+        cache.set(cls.CACHE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        _configuracion_local.clear()
+
+    @classmethod
+    def cargar(cls, usar_cache=True):
+        """
+        Devuelve la configuración desde la copia en memoria del proceso.
+        La versión compartida se consulta como mucho cada
+        INTERVALO_VERIFICACION segundos y solo se vuelve a la base de datos
+        cuando cambia. Con usar_cache=False se lee siempre de la base de
+        datos (p. ej. antes de modificarla).
+        """
+        if not usar_cache:
+            obj, created = cls.objects.get_or_create(pk=1)
+            return obj
+
+        ahora = time.monotonic()
+        version, obj, verificado = _configuracion_local.get('estado', (None, None, 0))
+        if obj is not None and ahora - verificado < cls.INTERVALO_VERIFICACION:
+            return obj
+
+        vigente = cache.get(cls.CACHE_VERSION_KEY)
+        if vigente is None:
+            cache.add(cls.CACHE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+            vigente = cache.get(cls.CACHE_VERSION_KEY)
+
+        if obj is None or version != vigente:
+            obj, created = cls.objects.get_or_create(pk=1)
+        _configuracion_local['estado'] = (vigente, obj, ahora)
         return obj
 
     def __str__(self):
@@ -82,6 +130,43 @@ class ConfiguracionSistema(models.Model):
 
 
  # Asegúrate de ajustar esto si hay import circular
+def estadisticas_en_cache(prefijo, instancias, calcular, timeout=86400):
+    """
+    Devuelve {pk: estadísticas} para las instancias leyendo la caché con un
+    solo get_many y calculando las que falten con una sola llamada a
+    calcular(pks). Las claves incluyen el día, de modo que los contadores
+    "de hoy" no sobreviven a la medianoche; el resto se invalida con
+    invalidar_estadisticas al crear o modificar recargas y agentes.
+    """
+    hoy = timezone.localdate()
+    claves = {instancia.pk: f"{prefijo}:{instancia.pk}:{hoy}" for instancia in instancias}
+    en_cache = cache.get_many(claves.values())
+    stats = {pk: en_cache[clave] for pk, clave in claves.items() if clave in en_cache}
+
+    faltan = [pk for pk in claves if pk not in stats]
+    if faltan:
+        calculadas = calcular(faltan)
+        cache.set_many({claves[pk]: valor for pk, valor in calculadas.items()}, timeout=timeout)
+        stats.update(calculadas)
+
+    for instancia in instancias:
+        instancia._estadisticas = stats[instancia.pk]
+    return stats
+
+
+def invalidar_estadisticas(agentes=(), agencias=(), monederos=()):
+    hoy = timezone.localdate()
+    cache.delete_many(
+        [f"agente_stats:{pk}:{hoy}" for pk in agentes if pk]
+        + [f"agencia_stats:{pk}:{hoy}" for pk in agencias if pk]
+        + [f"monedero_stats:{pk}:{hoy}" for pk in monederos if pk]
+    )
+
+
+def _inicio_dia(fecha):
+    return timezone.make_aware(datetime.combine(fecha, datetime.min.time()))
+
+
 class Agencia(models.Model):
     """
     Modelo para agencias físicas o virtuales que gestionan agentes
@@ -121,23 +206,44 @@ class Agencia(models.Model):
 
     @property
     def estadisticas(self):
-        cache_key = f"agencia_stats:{self.pk}"
-        stats = cache.get(cache_key)
-
-        if not stats:
-            stats = {
-                'total_agentes': self.agentes_asociados.count(),
-                'agentes_activos': self.agentes_asociados.filter(activo=True).count(),
-                'total_recargas': Recarga.objects.filter(agente__agencia=self).count(),
-                'recargas_mes': Recarga.objects.filter(
-                    agente__agencia=self,
-                    fecha_creacion__month=timezone.now().month
-                ).count(),
-                'comision_total': Recarga.objects.filter(
-                    agente__agencia=self
-                ).aggregate(total=Sum('comision_agente'))['total'] or 0
+        if '_estadisticas' not in self.__dict__:
+            self.estadisticas_lote([self])
+        return self._estadisticas
+
+    @classmethod
+    def estadisticas_lote(cls, agencias):
+        """Estadísticas de varias agencias con un GROUP BY por tabla"""
+        return estadisticas_en_cache('agencia_stats', agencias, cls._calcular_estadisticas)
+
+    @staticmethod
+    def _calcular_estadisticas(pks):
+        desde_mes = _inicio_dia(inicio_mes(timezone.localdate()))
+        stats = {
+            pk: {
+                'total_agentes': 0,
+                'agentes_activos': 0,
+                'total_recargas': 0,
+                'recargas_mes': 0,
+                'comision_total': 0
             }
-            cache.set(cache_key, stats, timeout=300)
+            for pk in pks
+        }
+
+        agentes = Agente.objects.filter(agencia__in=pks).values('agencia').annotate(
+            total_agentes=models.Count('id'),
+            agentes_activos=models.Count('id', filter=Q(activo=True))
+        ).order_by()
+        for fila in agentes:
+            stats[fila.pop('agencia')].update(fila)
+
+        recargas = Recarga.objects.filter(agente__agencia__in=pks).values('agente__agencia').annotate(
+            total_recargas=models.Count('id'),
+            recargas_mes=models.Count('id', filter=Q(fecha_creacion__gte=desde_mes)),
+            comision_total=Sum('comision_agente')
+        ).order_by()
+        for fila in recargas:
+            fila['comision_total'] = fila['comision_total'] or 0
+            stats[fila.pop('agente__agencia')].update(fila)
 
         return stats
 
@@ -162,6 +268,10 @@ class Agente(models.Model):
             ("procesar_recargas", "Puede procesar recargas de saldo"),
             ("view_dashboard_agente", "Puede ver el dashboard de agente"),
         ]
+        indexes = [
+            # Asignación de recargas al agente activo menos reciente
+            models.Index(fields=['activo', 'ultima_actividad'], name='idx_agente_actividad'),
+        ]
 
     def __str__(self):
         return f"{self.usuario.get_full_name()} ({self.codigo_agente})"
@@ -185,36 +295,59 @@ class Agente(models.Model):
             return False
 
     def actualizar_comision(self, monto):
-        """Actualiza la comisión acumulada del agente"""
-        self.comision_acumulada += Decimal(monto)
+        """
+        Suma la comisión con un UPDATE atómico: varias recargas del mismo
+        agente pueden confirmarse a la vez sin perder actualizaciones
+        """
         self.ultima_actividad = timezone.now()
-        self.save()
+        Agente.objects.filter(pk=self.pk).update(
+            comision_acumulada=F('comision_acumulada') + Decimal(monto),
+            ultima_actividad=self.ultima_actividad
+        )
+        self.comision_acumulada += Decimal(monto)
 
     def get_absolute_url(self):
         return reverse('agente_dashboard', kwargs={'pk': self.pk})
 
     @property
     def estadisticas(self):
-        cache_key = f"agente_stats:{self.pk}"
-        stats = cache.get(cache_key)
-        
-        if not stats:
-            hoy = timezone.now().date()
-            stats = {
-                'total_recargas': self.recargas_procesadas.count(),
-                'recargas_hoy': self.recargas_procesadas.filter(
-                    fecha_creacion__date=hoy
-                ).count(),
-                'comision_hoy': self.recargas_procesadas.filter(
-                    fecha_creacion__date=hoy
-                ).aggregate(total=Sum('comision_agente'))['total'] or 0,
-                'comision_mes': self.recargas_procesadas.filter(
-                    fecha_creacion__month=hoy.month
-                ).aggregate(total=Sum('comision_agente'))['total'] or 0,
-                'clientes_unicos': self.recargas_procesadas.values('usuario').distinct().count()
+        if '_estadisticas' not in self.__dict__:
+            self.estadisticas_lote([self])
+        return self._estadisticas
+
+    @classmethod
+    def estadisticas_lote(cls, agentes):
+        """Estadísticas de varios agentes con un único GROUP BY sobre Recarga"""
+        return estadisticas_en_cache('agente_stats', agentes, cls._calcular_estadisticas)
+
+    @staticmethod
+    def _calcular_estadisticas(pks):
+        hoy = timezone.localdate()
+        desde_hoy = _inicio_dia(hoy)
+        desde_mes = _inicio_dia(inicio_mes(hoy))
+        stats = {
+            pk: {
+                'total_recargas': 0,
+                'recargas_hoy': 0,
+                'comision_hoy': 0,
+                'comision_mes': 0,
+                'clientes_unicos': 0
             }
-            cache.set(cache_key, stats, timeout=300)  # Cache por 5 minutos
-        
+            for pk in pks
+        }
+
+        filas = Recarga.objects.filter(agente__in=pks).values('agente').annotate(
+            total_recargas=models.Count('id'),
+            recargas_hoy=models.Count('id', filter=Q(fecha_creacion__gte=desde_hoy)),
+            comision_hoy=Sum('comision_agente', filter=Q(fecha_creacion__gte=desde_hoy)),
+            comision_mes=Sum('comision_agente', filter=Q(fecha_creacion__gte=desde_mes)),
+            clientes_unicos=models.Count('usuario', distinct=True)
+        ).order_by()
+        for fila in filas:
+            fila['comision_hoy'] = fila['comision_hoy'] or 0
+            fila['comision_mes'] = fila['comision_mes'] or 0
+            stats[fila.pop('agente')].update(fila)
+
         return stats
 
 ## ----------------------------
@@ -231,6 +364,10 @@ class Monedero(models.Model):
     fecha_actualizacion = models.DateTimeField(auto_now=True)
     limite_credito = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
     nivel_verificacion = models.PositiveSmallIntegerField(default=1)
+    # Último asiento que afectó al monedero, mantenido por MovimientoMonedero.contabilizar
+    ultimo_movimiento = models.DateTimeField(null=True, blank=True)
+    ultimo_concepto = models.CharField(max_length=50, blank=True, default='')
+    ultimo_monto = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
 
     class Meta:
         verbose_name = "Monedero"
@@ -247,71 +384,412 @@ class Monedero(models.Model):
     def saldo_disponible(self):
         return (self.saldo - self.saldo_retenido).quantize(Decimal('0.00'))
 
-    @transaction.atomic
+    @classmethod
+    def bloquear(cls, usuarios):
+        """
+        Bloquea los monederos de los usuarios indicados con un único
+        SELECT ... FOR UPDATE ordenado por pk, de modo que dos operaciones
+        cruzadas (A→B y B→A) siempre adquieren los bloqueos en el mismo orden.
+        Debe llamarse dentro de una transacción.
+
+        Returns:
+            Diccionario {usuario_id: Monedero bloqueado}
+        """
+        monederos = cls.objects.select_for_update().filter(usuario_id__in=set(usuarios)).order_by('pk')
+        return {monedero.usuario_id: monedero for monedero in monederos}
+
     def actualizar_saldo(self, monto, motivo=None, retener=False):
         """
-        Actualiza el saldo de forma segura con transacción atómica
+        Ajusta el saldo mediante un asiento en el libro mayor.
+        Con retener=True el monto se mueve entre saldo disponible y retenido
+        (positivo retiene, negativo libera).
         """
         monto = Decimal(monto).quantize(Decimal('0.00'))
-        
-        with transaction.atomic():
-            monedero = Monedero.objects.select_for_update().get(pk=self.pk)
-            
-            if retener:
-                monedero.saldo_retenido += monto
-            else:
-                monedero.saldo += monto
-                
-            monedero.save()
-            
+        if not monto:
+            return self.saldo
+
+        if retener:
+            origen, destino = MovimientoMonedero.Cuentas.DISPONIBLE, MovimientoMonedero.Cuentas.RETENIDO
+        else:
+            origen, destino = MovimientoMonedero.Cuentas.AJUSTES, MovimientoMonedero.Cuentas.DISPONIBLE
+        if monto < 0:
+            origen, destino, monto = destino, origen, -monto
+
+        MovimientoMonedero.contabilizar(
+            concepto='AJUSTE',
+            referencia=motivo or '',
+            partidas=[
+                Partida(origen, MovimientoMonedero.Tipos.DEBITO, monto,
+                        self if origen in MovimientoMonedero.CUENTAS_MONEDERO else None),
+                Partida(destino, MovimientoMonedero.Tipos.CREDITO, monto,
+                        self if destino in MovimientoMonedero.CUENTAS_MONEDERO else None),
+            ]
+        )
+        return self.saldo
+
+    @property
+    def estadisticas(self):
+        if '_estadisticas' not in self.__dict__:
+            self.estadisticas_lote([self])
+        return self._estadisticas
+
+    @classmethod
+    def estadisticas_lote(cls, monederos):
+        """
+        Estadísticas de varios monederos con consultas agrupadas (pensado
+        para páginas de listados); se guardan en caché 5 minutos
+        """
+        return estadisticas_en_cache('monedero_stats', monederos, cls._calcular_estadisticas, timeout=300)
+
+    @staticmethod
+    def _calcular_estadisticas(pks):
+        hoy = timezone.localdate()
+        desde_mes = _inicio_dia(inicio_mes(hoy))
+        usuarios = dict(Monedero.objects.filter(pk__in=pks).values_list('usuario_id', 'pk'))
+        stats = {
+            pk: {
+                'total_transferencias': 0,
+                'transferencias_mes': 0,
+                'total_recargas': 0,
+                'recargas_mes': 0,
+                'saldo_maximo': 0.0
+            }
+            for pk in pks
+        }
+
+        def sumar(filas, campo_usuario, total, mes):
+            for fila in filas:
+                entrada = stats[usuarios[fila[campo_usuario]]]
+                entrada[total] += fila['total']
+                entrada[mes] += fila['mes']
+
+        conteo = {'total': models.Count('id'), 'mes': models.Count('id', filter=Q(fecha_creacion__gte=desde_mes))}
+        # Emitidas y recibidas por separado: cada GROUP BY usa su índice en lugar de un OR
+        for campo in ('emisor', 'receptor'):
+            sumar(
+                Transferencia.objects.filter(**{f'{campo}__in': usuarios}).values(campo).annotate(**conteo).order_by(),
+                campo, 'total_transferencias', 'transferencias_mes'
+            )
+        sumar(
+            Recarga.objects.filter(usuario__in=usuarios).values('usuario').annotate(**conteo).order_by(),
+            'usuario', 'total_recargas', 'recargas_mes'
+        )
+
+        # Máximo histórico de las fotos diarias más el del día en curso
+        maximos = [
+            SaldoDiario.objects.filter(monedero__in=pks).values('monedero').annotate(
+                maximo=Max('saldo_maximo')
+            ).order_by(),
+            AuditoriaMonedero.objects.filter(
+                monedero__in=pks, fecha__gte=_inicio_dia(hoy)
+            ).values('monedero').annotate(maximo=Max('saldo_posterior')).order_by(),
+        ]
+        for filas in maximos:
+            for fila in filas:
+                if fila['maximo'] is not None:
+                    entrada = stats[fila['monedero']]
+                    entrada['saldo_maximo'] = max(entrada['saldo_maximo'], float(fila['maximo']))
+
+        return stats
+
+
+# Línea de un asiento: cuenta, tipo (DEBITO/CREDITO), monto positivo y, para
+# las cuentas de monedero, el monedero afectado.
+Partida = namedtuple('Partida', ['cuenta', 'tipo', 'monto', 'monedero'], defaults=[None])
+
+
+class MovimientoMonedero(models.Model):
+    """
+    Libro mayor de solo inserción con asientos de partida doble.
+    Cada operación (transferencia, recarga, retención) genera un asiento
+    cuyas partidas cuadran; los saldos de Monedero se actualizan en la
+    misma transacción con un UPDATE atómico sobre columnas F().
+    """
+    class Cuentas(models.TextChoices):
+        DISPONIBLE = "DISPONIBLE", _("Saldo disponible")
+        RETENIDO = "RETENIDO", _("Saldo retenido")
+        COMISIONES = "COMISIONES", _("Comisiones del sistema")
+        RECARGAS = "RECARGAS", _("Fondos de recarga")
+        LIQUIDACIONES = "LIQUIDACIONES", _("Liquidación de retenciones")
+        AJUSTES = "AJUSTES", _("Ajustes manuales")
+
+    class Tipos(models.TextChoices):
+        DEBITO = "DEBITO", _("Débito")
+        CREDITO = "CREDITO", _("Crédito")
+
+    CUENTAS_MONEDERO = (Cuentas.DISPONIBLE, Cuentas.RETENIDO)
+
+    asiento = models.UUIDField(editable=False)
+    monedero = models.ForeignKey(
+        Monedero,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='movimientos'
+    )
+    cuenta = models.CharField(max_length=20, choices=Cuentas.choices)
+    tipo = models.CharField(max_length=10, choices=Tipos.choices)
+    monto = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
+    concepto = models.CharField(max_length=50)
+    referencia = models.CharField(max_length=100, blank=True, default='')
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Movimiento de Monedero'
+        verbose_name_plural = 'Movimientos de Monedero'
+        ordering = ['-fecha']
+        indexes = [
+            models.Index(fields=['monedero', 'fecha'], name='idx_movimiento_monedero'),
+            models.Index(fields=['asiento'], name='idx_movimiento_asiento'),
+            models.Index(fields=['concepto', 'referencia'], name='idx_movimiento_referencia'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.monto} en {self.cuenta} ({self.concepto})"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError("Los movimientos del libro mayor son inmutables")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError("Los movimientos del libro mayor son inmutables")
+
+    @classmethod
+    @transaction.atomic
+    def contabilizar(cls, concepto, partidas, referencia='', metadata=None, bloqueados=False):
+        """
+        Registra un asiento y aplica su efecto neto sobre cada monedero.
+
+        Args:
+            concepto: Tipo de operación (TRANSFERENCIA, RECARGA, RETENCION...)
+            partidas: Lista de Partida; débitos y créditos deben cuadrar
+            referencia: Referencia de la operación que origina el asiento
+            metadata: Datos adicionales para la auditoría del monedero
+            bloqueados: True si los monederos de las partidas ya vienen
+                bloqueados (Monedero.bloquear); el saldo se valida sobre
+                esas instancias y no se vuelve a leer de la base de datos
+
+        Returns:
+            Lista de MovimientoMonedero creados
+
+        Raises:
+            SaldoInsuficienteError si algún monedero no cubre su débito
+        """
+        partidas = [p._replace(monto=Decimal(p.monto).quantize(Decimal('0.00'))) for p in partidas]
+
+        for p in partidas:
+            if p.monto <= 0:
+                raise ValidationError("Los montos del asiento deben ser positivos")
+            if (p.cuenta in cls.CUENTAS_MONEDERO) != (p.monedero is not None):
+                raise ValidationError(f"Partida inválida para la cuenta {p.cuenta}")
+
+        debitos = sum(p.monto for p in partidas if p.tipo == cls.Tipos.DEBITO)
+        creditos = sum(p.monto for p in partidas if p.tipo == cls.Tipos.CREDITO)
+        if debitos != creditos:
+            raise ValidationError(f"Asiento descuadrado: débitos {debitos} != créditos {creditos}")
+
+        # Efecto neto por monedero: (instancia, delta saldo, delta retenido)
+        efectos = {}
+        for p in partidas:
+            if p.monedero is None:
+                continue
+            signo = 1 if p.tipo == cls.Tipos.CREDITO else -1
+            efecto = efectos.setdefault(p.monedero.pk, [p.monedero, Decimal('0.00'), Decimal('0.00')])
+            efecto[1] += signo * p.monto
+            if p.cuenta == cls.Cuentas.RETENIDO:
+                efecto[2] += signo * p.monto
+
+        ahora = timezone.now()
+        # Orden fijo por pk para que dos asientos cruzados no se interbloqueen
+        for pk in sorted(efectos):
+            _, delta_saldo, delta_retenido = efectos[pk]
+            delta_disponible = delta_saldo - delta_retenido
+            condicion = Q(pk=pk)
+            if bloqueados:
+                monedero = efectos[pk][0]
+                if (monedero.saldo_disponible + delta_disponible < 0
+                        or monedero.saldo_retenido + delta_retenido < 0):
+                    raise SaldoInsuficienteError(SaldoInsuficienteError.default_detail)
+            elif delta_disponible < 0:
+                condicion &= Q(saldo__gte=F('saldo_retenido') - delta_disponible)
+            if delta_retenido < 0 and not bloqueados:
+                condicion &= Q(saldo_retenido__gte=-delta_retenido)
+
+            actualizados = Monedero.objects.filter(condicion).update(
+                saldo=F('saldo') + delta_saldo,
+                saldo_retenido=F('saldo_retenido') + delta_retenido,
+                fecha_actualizacion=ahora,
+                ultimo_movimiento=ahora,
+                ultimo_concepto=concepto,
+                ultimo_monto=delta_saldo or delta_retenido
+            )
+            if not actualizados:
+                raise SaldoInsuficienteError(SaldoInsuficienteError.default_detail)
+
+        asiento = uuid.uuid4()
+        movimientos = cls.objects.bulk_create([
+            cls(
+                asiento=asiento,
+                monedero=p.monedero,
+                cuenta=p.cuenta,
+                tipo=p.tipo,
+                monto=p.monto,
+                concepto=concepto,
+                referencia=str(referencia)
+            )
+            for p in partidas
+        ])
+
+        if bloqueados:
+            saldos = {
+                pk: (monedero.saldo + delta_saldo, monedero.saldo_retenido + delta_retenido)
+                for pk, (monedero, delta_saldo, delta_retenido) in efectos.items()
+            }
+        else:
+            saldos = {
+                pk: (saldo, retenido)
+                for pk, saldo, retenido in Monedero.objects.filter(pk__in=efectos).values_list(
+                    'pk', 'saldo', 'saldo_retenido'
+                )
+            }
+        for pk, (monedero, delta_saldo, delta_retenido) in efectos.items():
+            monedero.saldo, monedero.saldo_retenido = saldos[pk]
+            monedero.ultimo_movimiento = ahora
+            monedero.ultimo_concepto = concepto
+            monedero.ultimo_monto = delta_saldo or delta_retenido
             AuditoriaMonedero.registrar(
                 monedero=monedero,
-                accion='RETENCION' if retener else 'ACTUALIZACION',
-                estado_anterior={'saldo': float(monedero.saldo - monto)},
-                estado_posterior={'saldo': float(monedero.saldo)},
-                metadata={'motivo': motivo, 'monto': float(monto)}
+                accion='ACTUALIZACION' if delta_saldo else 'RETENCION',
+                saldo_anterior=monedero.saldo - delta_saldo,
+                saldo_posterior=monedero.saldo,
+                monto=delta_saldo or delta_retenido,
+                estado_anterior={
+                    'saldo': float(monedero.saldo - delta_saldo),
+                    'saldo_retenido': float(monedero.saldo_retenido - delta_retenido)
+                },
+                estado_posterior={
+                    'saldo': float(monedero.saldo),
+                    'saldo_retenido': float(monedero.saldo_retenido)
+                },
+                metadata={
+                    'motivo': f"{concepto} {referencia}".strip(),
+                    'monto': float(delta_saldo or delta_retenido),
+                    'asiento': str(asiento),
+                    **(metadata or {})
+                }
             )
-            
-            return monedero.saldo
 
+        return movimientos
 
 
-    @property
-    def estadisticas(self):
-        cache_key = f"monedero_stats:{self.pk}"
-        stats = cache.get(cache_key)
-        
-        if not stats:
-            hoy = timezone.now().date()
-
-            # Obtener el saldo máximo desde estado_posterior['saldo'] como float
-            max_saldo = AuditoriaMonedero.objects.filter(
-                monedero=self,
-                accion='ACTUALIZACION'
-            ).annotate(
-                saldo_extraido=Cast(F("estado_posterior__saldo"), FloatField())
-            ).aggregate(
-                max_saldo=Max("saldo_extraido")
-            )['max_saldo'] or 0
-
-            stats = {
-                'total_transferencias': Transferencia.objects.filter(
-                    Q(emisor=self.usuario) | Q(receptor=self.usuario)
-                ).count(),
-                'transferencias_mes': Transferencia.objects.filter(
-                    Q(emisor=self.usuario) | Q(receptor=self.usuario),
-                    fecha_creacion__month=hoy.month
-                ).count(),
-                'total_recargas': Recarga.objects.filter(usuario=self.usuario).count(),
-                'recargas_mes': Recarga.objects.filter(
-                    usuario=self.usuario,
-                    fecha_creacion__month=hoy.month
-                ).count(),
-                'saldo_maximo': max_saldo
+class ConsumoDiario(models.Model):
+    """
+    Acumulado por usuario y día (fecha local) de lo transferido, lo
+    recargado y el número de operaciones de cada tipo. Se actualiza en la
+    misma transacción que el movimiento, así que verificar los límites
+    diarios es una sola fila y no un SUM sobre el histórico del usuario.
+
+    max_operaciones_diarias se aplica por separado a transferencias y a
+    recargas: las recargas no consumen operaciones de transferencia.
+    """
+    class Operaciones(models.TextChoices):
+        TRANSFERENCIA = "TRANSFERENCIA", _("Transferencia")
+        RECARGA = "RECARGA", _("Recarga")
+
+    # Campos de monto y de número de operaciones de cada tipo
+    CAMPOS = {
+        Operaciones.TRANSFERENCIA: ('total_transferido', 'transferencias'),
+        Operaciones.RECARGA: ('total_recargado', 'recargas'),
+    }
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='consumos_diarios')
+    fecha = models.DateField()
+    total_transferido = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    total_recargado = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    transferencias = models.PositiveIntegerField(default=0)
+    recargas = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Consumo Diario'
+        verbose_name_plural = 'Consumos Diarios'
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'fecha'], name='unq_consumo_usuario_fecha'),
+        ]
+
+    def __str__(self):
+        return f"Consumo de {self.usuario_id} el {self.fecha}"
+
+    @classmethod
+    def consumir(cls, usuario_id, operacion, monto, limite_monto, limite_operaciones):
+        """
+        Suma monto al acumulado del día con un UPDATE condicional que solo
+        afecta a la fila si no se superan los límites.
+
+        Raises:
+            LimiteDiarioExcedidoError si la operación excede algún límite
+        """
+        campo, contador = cls.CAMPOS[operacion]
+        hoy = timezone.localdate()
+        monto = Decimal(monto)
+        filtro = {
+            'usuario_id': usuario_id,
+            'fecha': hoy,
+            f'{contador}__lt': limite_operaciones,
+            f'{campo}__lte': limite_monto - monto,
+        }
+        cambios = {campo: F(campo) + monto, contador: F(contador) + 1}
+
+        if cls.objects.filter(**filtro).update(**cambios):
+            return
+
+        # Primera operación del día o límite superado
+        if not cls.objects.filter(usuario_id=usuario_id, fecha=hoy).exists():
+            cls._crear_del_dia(usuario_id, hoy)
+            if cls.objects.filter(**filtro).update(**cambios):
+                return
+
+        consumo = cls.objects.get(usuario_id=usuario_id, fecha=hoy)
+        if getattr(consumo, contador) >= limite_operaciones:
+            raise LimiteDiarioExcedidoError("Número máximo de operaciones diarias excedido")
+        if operacion == cls.Operaciones.TRANSFERENCIA:
+            raise LimiteDiarioExcedidoError("Límite diario de transferencias excedido")
+        raise LimiteDiarioExcedidoError("Límite diario de recargas excedido")
+
+    @classmethod
+    def bloquear_del_dia(cls, usuario_id):
+        """Devuelve la fila del día bloqueada (SELECT ... FOR UPDATE), creándola si no existe"""
+        hoy = timezone.localdate()
+        consumo = cls.objects.select_for_update().filter(usuario_id=usuario_id, fecha=hoy).first()
+        if consumo is None:
+            cls._crear_del_dia(usuario_id, hoy)
+            consumo = cls.objects.select_for_update().get(usuario_id=usuario_id, fecha=hoy)
+        return consumo
+
+    @classmethod
+    def _crear_del_dia(cls, usuario_id, fecha):
+        """Crea la fila del día partiendo de lo ya completado hoy (p. ej. tras un despliegue)"""
+        transferencias = Transferencia.objects.filter(
+            emisor_id=usuario_id,
+            estado=Transferencia.Estados.COMPLETADA,
+            fecha_creacion__date=fecha
+        ).aggregate(total=Sum('cantidad'), cantidad=models.Count('id'))
+        recargas = Recarga.objects.filter(
+            usuario_id=usuario_id,
+            estado=Recarga.Estados.COMPLETADA,
+            fecha_creacion__date=fecha
+        ).aggregate(total=Sum('monto'), cantidad=models.Count('id'))
+
+        cls.objects.get_or_create(
+            usuario_id=usuario_id,
+            fecha=fecha,
+            defaults={
+                'total_transferido': transferencias['total'] or Decimal('0.00'),
+                'total_recargado': recargas['total'] or Decimal('0.00'),
+                'transferencias': transferencias['cantidad'],
+                'recargas': recargas['cantidad'],
             }
-            cache.set(cache_key, stats, timeout=300)
-        
-        return stats
+        )
 
 
 ## ----------------------------
@@ -330,6 +808,13 @@ class Transferencia(models.Model):
         EN_VERIFICACION = "EN_VERIFICACION", _("En Verificación")
         PROGRAMADA = "PROGRAMADA", _("Programada")
 
+    # Máximo de transferencias aceptadas en un pago masivo
+    MAX_LOTE = 1000
+    # Estados que recorre el despachador de programadas (ver índice parcial)
+    ESTADOS_DESPACHO = (Estados.PROGRAMADA, Estados.PENDIENTE)
+    # Veces que el despachador reclama una programada antes de darla por fallida
+    MAX_INTENTOS_DESPACHO = 3
+
     referencia = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     emisor = models.ForeignKey(User, on_delete=models.PROTECT, related_name="transferencias_enviadas")
     receptor = models.ForeignKey(User, on_delete=models.PROTECT, related_name="transferencias_recibidas")
@@ -342,6 +827,8 @@ class Transferencia(models.Model):
     codigo_verificacion = models.CharField(max_length=6, null=True, blank=True)
     metadata = models.JSONField(default=dict)
     tarea_programada = models.CharField(max_length=100, null=True, blank=True)
+    fecha_reclamo = models.DateTimeField(null=True, blank=True, editable=False)
+    intentos_despacho = models.PositiveSmallIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name = "Transferencia"
@@ -352,6 +839,14 @@ class Transferencia(models.Model):
             models.Index(fields=['receptor', 'estado']),
             models.Index(fields=['fecha_creacion']),
             models.Index(fields=['fecha_programada']),
+            models.Index(
+                fields=['fecha_programada'],
+                condition=Q(estado__in=['PROGRAMADA', 'PENDIENTE'], fecha_programada__isnull=False),
+                name='idx_transf_despacho'
+            ),
+            # Paginación por cursor del historial de cada participante
+            models.Index(fields=['emisor', 'fecha_creacion', 'id'], name='idx_transf_emisor_cursor'),
+            models.Index(fields=['receptor', 'fecha_creacion', 'id'], name='idx_transf_receptor_cursor'),
         ]
 
     def __str__(self):
@@ -372,7 +867,7 @@ class Transferencia(models.Model):
             config.comision_transferencia_minima
         ).quantize(Decimal('0.00'))
 
-    @transaction.atomic
+    @RecolectorAuditoria()
     def procesar(self):
         """
         Procesa la transferencia de forma segura:
@@ -380,7 +875,7 @@ class Transferencia(models.Model):
         2. Debita al emisor (monto + comisión)
         3. Acredita al receptor (monto)
         4. Actualiza estados
-        5. Notifica a los usuarios implicados
+        5. Publica el evento que notificará a los usuarios implicados
         """
         config = ConfiguracionSistema.cargar()
         
@@ -389,29 +884,42 @@ class Transferencia(models.Model):
         
         try:
             with transaction.atomic():
-                # Bloquear registros para evitar condiciones de carrera
-                emisor_monedero = Monedero.objects.select_for_update().get(usuario=self.emisor)
-                receptor_monedero = Monedero.objects.select_for_update().get(usuario=self.receptor)
-                
-                # Verificar límites diarios
-                hoy = timezone.now().date()
-                total_transferido_hoy = Transferencia.objects.filter(
-                    emisor=self.emisor,
-                    estado=self.Estados.COMPLETADA,
-                    fecha_creacion__date=hoy
-                ).aggregate(total=Sum('cantidad'))['total'] or 0
+                # Verificar y consumir límites diarios (una sola fila, antes
+                # de tomar los bloqueos de los monederos)
+                ConsumoDiario.consumir(
+                    self.emisor_id,
+                    ConsumoDiario.Operaciones.TRANSFERENCIA,
+                    self.cantidad,
+                    config.limite_transferencia_diaria,
+                    config.max_operaciones_diarias
+                )
                 
-                if (total_transferido_hoy + self.cantidad) > config.limite_transferencia_diaria:
-                    raise ValidationError("Límite diario de transferencias excedido")
+                # Bloquear ambos monederos en orden fijo y en una sola consulta
+                monederos = Monedero.bloquear([self.emisor_id, self.receptor_id])
+                emisor_monedero = monederos[self.emisor_id]
+                receptor_monedero = monederos[self.receptor_id]
                 
                 # Verificar saldo suficiente
                 total_debito = self.cantidad + self.comision
                 if emisor_monedero.saldo_disponible < total_debito:
                     raise ValidationError("Saldo insuficiente para completar la transferencia")
                 
-                # Ejecutar movimientos
-                emisor_monedero.actualizar_saldo(-total_debito, motivo=f"Transferencia {self.referencia}")
-                receptor_monedero.actualizar_saldo(self.cantidad, motivo=f"Transferencia {self.referencia}")
+                # Ejecutar movimientos en un único asiento
+                partidas = [
+                    Partida(MovimientoMonedero.Cuentas.DISPONIBLE, MovimientoMonedero.Tipos.DEBITO,
+                            total_debito, emisor_monedero),
+                    Partida(MovimientoMonedero.Cuentas.DISPONIBLE, MovimientoMonedero.Tipos.CREDITO,
+                            self.cantidad, receptor_monedero),
+                ]
+                if self.comision:
+                    partidas.append(Partida(MovimientoMonedero.Cuentas.COMISIONES,
+                                            MovimientoMonedero.Tipos.CREDITO, self.comision))
+                MovimientoMonedero.contabilizar(
+                    concepto='TRANSFERENCIA',
+                    referencia=self.referencia,
+                    partidas=partidas,
+                    bloqueados=True
+                )
                 
                 # Actualizar estado
                 self.estado = self.Estados.COMPLETADA
@@ -428,17 +936,12 @@ class Transferencia(models.Model):
                     }
                 )
                 
-                # Notificar a los usuarios implicados
-                Notificacion.notificar_transferencia(self)
-                
-                # Si era programada, eliminar la tarea periódica
-                if self.tarea_programada:
-                    try:
-                        PeriodicTask.objects.filter(name=self.tarea_programada).delete()
-                        self.tarea_programada = None
-                        self.save()
-                    except Exception as e:
-                        logger.error(f"Error eliminando tarea programada {self.tarea_programada}: {str(e)}")
+                # Las notificaciones salen de la bandeja de eventos
+                EventoMonedero.publicar(
+                    EventoMonedero.Tipos.TRANSFERENCIA_COMPLETADA,
+                    transferencia=self.pk,
+                    monederos=[emisor_monedero.pk, receptor_monedero.pk]
+                )
                 
                 return True
                 
@@ -454,49 +957,229 @@ class Transferencia(models.Model):
             )
             
             # Notificar al emisor sobre la falla
-            Notificacion.objects.create(
-                usuario=self.emisor,
-                tipo=Notificacion.Tipos.TRANSFERENCIA,
-                titulo="Transferencia fallida",
-                mensaje=f"La transferencia de {self.cantidad} XOF no pudo completarse: {str(e)}",
-                metadata={
-                    "referencia": str(self.referencia),
-                    "error": str(e)
-                },
-                importante=True
+            Notificacion.notificar_fallo(
+                self.emisor_id,
+                Notificacion.Tipos.TRANSFERENCIA,
+                "Transferencia fallida",
+                f"La transferencia de {self.cantidad} XOF no pudo completarse: {str(e)}",
+                self.referencia,
+                e
             )
             
             raise ValidationError(f"Error al procesar transferencia: {str(e)}")
 
+    @classmethod
+    @RecolectorAuditoria()
+    def procesar_lote(cls, emisor, items):
+        """
+        Procesa un pago masivo del mismo emisor en una sola transacción:
+        1. Valida todas las transferencias antes de tocar saldos
+        2. Bloquea una vez el consumo diario y los monederos (orden por pk)
+        3. Acepta o rechaza cada transferencia contra saldo y límites
+        4. Registra un único asiento y crea transferencias y eventos con
+           bulk_create (las auditorías se vuelcan al confirmar)
+
+        Args:
+            emisor: Usuario que paga
+            items: Lista de diccionarios con 'receptor' (username) y 'cantidad'
+
+        Returns:
+            (lote, resultados) con el UUID del lote y el estado de cada item
+        """
+        config = ConfiguracionSistema.cargar()
+        lote = uuid.uuid4()
+        receptores = {
+            usuario.username: usuario
+            for usuario in User.objects.filter(username__in={item['receptor'] for item in items})
+        }
+
+        resultados = []
+        validas = []
+        for indice, item in enumerate(items):
+            cantidad = Decimal(item['cantidad']).quantize(Decimal('0.00'))
+            receptor = receptores.get(item['receptor'])
+            resultado = {'indice': indice, 'receptor': item['receptor'], 'cantidad': cantidad}
+            resultados.append(resultado)
+
+            if receptor is None:
+                error = "Usuario receptor no encontrado"
+            elif receptor.pk == emisor.pk:
+                error = "No puedes transferirte a ti mismo"
+            elif cantidad < config.minimo_transferencia:
+                error = f"El monto mínimo es {config.minimo_transferencia} XOF"
+            else:
+                error = None
+
+            if error:
+                resultado.update(estado='RECHAZADA', error=error)
+                continue
+
+            comision = max(
+                cantidad * config.comision_transferencia_porcentaje / 100,
+                config.comision_transferencia_minima
+            ).quantize(Decimal('0.00'))
+            validas.append((resultado, cls(
+                emisor=emisor,
+                receptor=receptor,
+                cantidad=cantidad,
+                comision=comision,
+                metadata={'lote': str(lote)}
+            )))
+
+        if not validas:
+            return lote, resultados
+
+        consumo = ConsumoDiario.bloquear_del_dia(emisor.pk)
+        monederos = Monedero.bloquear([emisor.pk] + [t.receptor_id for _, t in validas])
+        emisor_monedero = monederos.get(emisor.pk)
+        disponible = emisor_monedero.saldo_disponible if emisor_monedero else Decimal('0.00')
+        transferido = consumo.total_transferido
+        operaciones = consumo.transferencias
+        ahora = timezone.now()
+
+        completadas = []
+        for resultado, transferencia in validas:
+            debito = transferencia.cantidad + transferencia.comision
+            if transferencia.receptor_id not in monederos:
+                error = "Monedero receptor no encontrado"
+            elif operaciones >= config.max_operaciones_diarias:
+                error = "Número máximo de operaciones diarias excedido"
+            elif transferido + transferencia.cantidad > config.limite_transferencia_diaria:
+                error = "Límite diario de transferencias excedido"
+            elif disponible < debito:
+                error = "Saldo insuficiente para completar la transferencia"
+            else:
+                error = None
+
+            if error:
+                transferencia.estado = cls.Estados.FALLIDA
+                transferencia.metadata['error'] = error
+            else:
+                transferencia.estado = cls.Estados.COMPLETADA
+                transferencia.fecha_procesamiento = ahora
+                disponible -= debito
+                transferido += transferencia.cantidad
+                operaciones += 1
+                completadas.append(transferencia)
+
+            resultado.update(
+                estado=transferencia.estado,
+                referencia=str(transferencia.referencia),
+                error=error
+            )
+
+        transferencias = cls.objects.bulk_create([t for _, t in validas])
+        # bulk_create no emite post_save
+        MetricaDashboard.incrementar(MetricaDashboard.Claves.TRANSFERENCIAS, len(transferencias), diaria=True)
+
+        if completadas:
+            # La fila está bloqueada: se escriben directamente los nuevos totales
+            ConsumoDiario.objects.filter(pk=consumo.pk).update(
+                total_transferido=transferido,
+                transferencias=operaciones
+            )
+
+            partidas = [
+                Partida(MovimientoMonedero.Cuentas.DISPONIBLE, MovimientoMonedero.Tipos.DEBITO,
+                        sum(t.cantidad + t.comision for t in completadas), emisor_monedero),
+            ]
+            partidas.extend(
+                Partida(MovimientoMonedero.Cuentas.DISPONIBLE, MovimientoMonedero.Tipos.CREDITO,
+                        t.cantidad, monederos[t.receptor_id])
+                for t in completadas
+            )
+            comisiones = sum(t.comision for t in completadas)
+            if comisiones:
+                partidas.append(Partida(MovimientoMonedero.Cuentas.COMISIONES,
+                                        MovimientoMonedero.Tipos.CREDITO, comisiones))
+            MovimientoMonedero.contabilizar(
+                concepto='TRANSFERENCIA_LOTE',
+                referencia=lote,
+                partidas=partidas,
+                metadata={'transferencias': len(completadas)},
+                bloqueados=True
+            )
+
+            EventoMonedero.publicar_lote(EventoMonedero.Tipos.TRANSFERENCIA_COMPLETADA, [
+                {
+                    'transferencia': transferencia.pk,
+                    'monederos': [emisor_monedero.pk, monederos[transferencia.receptor_id].pk]
+                }
+                for transferencia in completadas
+            ])
+
+        for transferencia in transferencias:
+            AuditoriaTransferencia.registrar(
+                transferencia=transferencia,
+                accion=('TRANSFERENCIA_COMPLETADA'
+                        if transferencia.estado == cls.Estados.COMPLETADA
+                        else 'TRANSFERENCIA_FALLIDA'),
+                detalles={
+                    'lote': str(lote),
+                    'monto_transferido': float(transferencia.cantidad),
+                    'comision': float(transferencia.comision)
+                },
+                error=transferencia.metadata.get('error')
+            )
+
+        return lote, resultados
+
     def programar(self, fecha_ejecucion):
-        """Programa una transferencia para ejecutarse en el futuro"""
-        from .tasks import ejecutar_transferencia_programada
-        
+        """
+        Programa una transferencia para ejecutarse en el futuro. No crea
+        ninguna tarea: despachar_transferencias_programadas la recoge
+        cuando vence fecha_programada.
+        """
         self.estado = self.Estados.PROGRAMADA
         self.fecha_programada = fecha_ejecucion
         self.save()
-        
-        # Crear tarea periódica
-        schedule, _ = IntervalSchedule.objects.get_or_create(
-            every=1,
-            period=IntervalSchedule.SECONDS,
+        return self
+
+    @classmethod
+    def reclamar_vencidas(cls, tamano_lote=500, margen_reintento=timedelta(minutes=10)):
+        """
+        Reclama un lote de transferencias programadas ya vencidas con
+        SELECT ... FOR UPDATE SKIP LOCKED y las pasa a PENDIENTE, de modo
+        que varios despachadores pueden ejecutarse a la vez sin repartirse
+        la misma fila. También recoge las reclamadas hace más de
+        margen_reintento (contado desde fecha_reclamo) que siguen
+        pendientes porque su tarea se perdió; tras MAX_INTENTOS_DESPACHO
+        reclamos se marcan FALLIDA en lugar de reintentarse.
+        Debe llamarse dentro de una transacción.
+
+        Returns:
+            Lista de pks reclamados
+        """
+        ahora = timezone.now()
+        perdidas = Q(
+            estado=cls.Estados.PENDIENTE,
+            fecha_reclamo__lte=ahora - margen_reintento,
+            fecha_procesamiento__isnull=True
         )
-        
-        nombre_tarea = f"transferencia_{self.referencia}"
-        
-        task = PeriodicTask.objects.create(
-            interval=schedule,
-            name=nombre_tarea,
-            task='finanzas.tasks.ejecutar_transferencia_programada',
-            args=json.dumps([str(self.pk)]),
-            start_time=fecha_ejecucion,
-            one_off=True
+        agotadas = cls.objects.filter(
+            perdidas,
+            fecha_programada__isnull=False,
+            intentos_despacho__gte=cls.MAX_INTENTOS_DESPACHO
+        ).update(estado=cls.Estados.FALLIDA)
+        if agotadas:
+            logger.warning(f"{agotadas} transferencias programadas agotaron sus reintentos de despacho")
+
+        vencidas = Q(estado=cls.Estados.PROGRAMADA, fecha_programada__lte=ahora) | (
+            perdidas & Q(intentos_despacho__lt=cls.MAX_INTENTOS_DESPACHO)
         )
-        
-        self.tarea_programada = nombre_tarea
-        self.save()
-        
-        return task
+        pks = list(
+            cls.objects.select_for_update(skip_locked=True)
+            .filter(vencidas, estado__in=cls.ESTADOS_DESPACHO, fecha_programada__isnull=False)
+            .order_by('fecha_programada')
+            .values_list('pk', flat=True)[:tamano_lote]
+        )
+        if pks:
+            cls.objects.filter(pk__in=pks).update(
+                estado=cls.Estados.PENDIENTE,
+                fecha_reclamo=ahora,
+                intentos_despacho=F('intentos_despacho') + 1
+            )
+        return pks
 
 class Recarga(models.Model):
     """
@@ -538,12 +1221,12 @@ class Recarga(models.Model):
         # Calcular comisión (1%) y monto neto
         if not self.pk:
             config = ConfiguracionSistema.cargar()
-            self.comision_agente = self.monto * config.comision_recarga_agente / 100
+            self.comision_agente = (self.monto * config.comision_recarga_agente / 100).quantize(Decimal('0.00'))
             self.monto_neto = self.monto - self.comision_agente
         
         super().save(*args, **kwargs)
 
-    @transaction.atomic
+    @RecolectorAuditoria()
     def procesar(self, agente):
         """Procesa la recarga y actualiza los saldos"""
         if self.estado != self.Estados.PENDIENTE:
@@ -553,28 +1236,39 @@ class Recarga(models.Model):
         
         try:
             with transaction.atomic():
-                # Verificar límites diarios
-                hoy = timezone.now().date()
-                total_recargado_hoy = Recarga.objects.filter(
-                    usuario=self.usuario,
-                    estado=self.Estados.COMPLETADA,
-                    fecha_creacion__date=hoy
-                ).aggregate(total=Sum('monto'))['total'] or 0
-                
-                if (total_recargado_hoy + self.monto) > config.limite_recarga_diaria:
-                    raise ValidationError("Límite diario de recargas excedido")
-                
-                # Bloquear registros
-                monedero_usuario = Monedero.objects.select_for_update().get(usuario=self.usuario)
-                monedero_agente = Monedero.objects.select_for_update().get(usuario=agente.usuario)
+                # Verificar y consumir límites diarios
+                ConsumoDiario.consumir(
+                    self.usuario_id,
+                    ConsumoDiario.Operaciones.RECARGA,
+                    self.monto,
+                    config.limite_recarga_diaria,
+                    config.max_operaciones_diarias
+                )
                 
-                # Acreditar monto neto al usuario
-                monedero_usuario.actualizar_saldo(self.monto_neto, motivo=f"Recarga {self.referencia}")
+                # Los abonos no pueden dejar saldo negativo: no hace falta
+                # bloquear los monederos, el asiento los actualiza con F()
+                monederos = {
+                    m.usuario_id: m for m in Monedero.objects.filter(
+                        usuario_id__in=[self.usuario_id, agente.usuario_id]
+                    )
+                }
+                monedero_usuario = monederos[self.usuario_id]
+                monedero_agente = monederos[agente.usuario_id]
                 
-                # Acreditar comisión al agente
-                monedero_agente.actualizar_saldo(
-                    self.comision_agente,
-                    motivo=f"Comisión por recarga {self.referencia}"
+                # Acreditar monto neto al usuario y comisión al agente
+                partidas = [
+                    Partida(MovimientoMonedero.Cuentas.RECARGAS, MovimientoMonedero.Tipos.DEBITO, self.monto),
+                    Partida(MovimientoMonedero.Cuentas.DISPONIBLE, MovimientoMonedero.Tipos.CREDITO,
+                            self.monto_neto, monedero_usuario),
+                ]
+                if self.comision_agente:
+                    partidas.append(Partida(MovimientoMonedero.Cuentas.DISPONIBLE,
+                                            MovimientoMonedero.Tipos.CREDITO,
+                                            self.comision_agente, monedero_agente))
+                MovimientoMonedero.contabilizar(
+                    concepto='RECARGA',
+                    referencia=self.referencia,
+                    partidas=partidas
                 )
                 agente.actualizar_comision(self.comision_agente)
                 
@@ -589,21 +1283,12 @@ class Recarga(models.Model):
                     accion='RECARGA_COMPLETADA'
                 )
                 
-                # Notificar al usuario sobre la recarga exitosa
-                Notificacion.notificar_recarga(self)
-                
-                # Notificar al agente sobre la comisión obtenida
-                Notificacion.objects.create(
-                    usuario=agente.usuario,
-                    tipo=Notificacion.Tipos.RECARGA,
-                    titulo="Comisión por recarga",
-                    mensaje=f"Has recibido {self.comision_agente} XOF de comisión por la recarga {self.referencia}",
-                    metadata={
-                        "referencia": str(self.referencia),
-                        "monto_recarga": float(self.monto),
-                        "comision": float(self.comision_agente),
-                        "usuario": self.usuario.username
-                    }
+                # Notificaciones al usuario y al agente y contador de
+                # comisiones salen de la bandeja de eventos
+                EventoMonedero.publicar(
+                    EventoMonedero.Tipos.RECARGA_COMPLETADA,
+                    recarga=self.pk,
+                    monederos=[monedero_usuario.pk, monedero_agente.pk]
                 )
                 
                 return True
@@ -620,16 +1305,13 @@ class Recarga(models.Model):
             )
             
             # Notificar al usuario sobre la recarga fallida
-            Notificacion.objects.create(
-                usuario=self.usuario,
-                tipo=Notificacion.Tipos.RECARGA,
-                titulo="Recarga fallida",
-                mensaje=f"La recarga de {self.monto} XOF no pudo completarse: {str(e)}",
-                metadata={
-                    "referencia": str(self.referencia),
-                    "error": str(e)
-                },
-                importante=True
+            Notificacion.notificar_fallo(
+                self.usuario_id,
+                Notificacion.Tipos.RECARGA,
+                "Recarga fallida",
+                f"La recarga de {self.monto} XOF no pudo completarse: {str(e)}",
+                self.referencia,
+                e
             )
             
             raise ValidationError(f"Error al procesar recarga: {str(e)}")
@@ -650,18 +1332,72 @@ class Recarga(models.Model):
         
         return task.id
 
+class ClaveIdempotencia(models.Model):
+    """
+    Respuesta guardada de una petición de creación con cabecera
+    Idempotency-Key, para devolverla tal cual si el cliente la reintenta.
+    La fila se crea EN_CURSO antes de ejecutar la operación, de modo que un
+    duplicado concurrente choca con la restricción única y se rechaza.
+    Ver monedero.idempotencia.
+    """
+    class Estados(models.TextChoices):
+        EN_CURSO = "EN_CURSO", _("En curso")
+        COMPLETADA = "COMPLETADA", _("Completada")
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='claves_idempotencia')
+    endpoint = models.CharField(max_length=50)
+    clave = models.CharField(max_length=255)
+    huella = models.CharField(max_length=64)
+    estado = models.CharField(max_length=20, choices=Estados.choices, default=Estados.EN_CURSO)
+    codigo_respuesta = models.PositiveSmallIntegerField(null=True, blank=True)
+    respuesta = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Clave de Idempotencia"
+        verbose_name_plural = "Claves de Idempotencia"
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'endpoint', 'clave'], name='unq_idempotencia_usuario_clave'),
+        ]
+        indexes = [
+            models.Index(fields=['fecha_creacion'], name='idx_idempotencia_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.clave} ({self.estado})"
+
+
 ## ----------------------------
 ## 5. MODELOS DE AUDITORÍA
 ## ----------------------------
 
+def inicio_mes(fecha, desplazamiento=0):
+    """Primer día del mes de fecha, desplazado el número de meses indicado"""
+    total = fecha.year * 12 + fecha.month - 1 + desplazamiento
+    return fecha.replace(year=total // 12, month=total % 12 + 1, day=1)
+
+
+class AuditoriaQuerySet(models.QuerySet):
+    def en_periodo(self, desde=None, hasta=None):
+        """Registros en [desde, hasta); usa el índice por fecha de la tabla activa"""
+        queryset = self
+        if desde is not None:
+            queryset = queryset.filter(fecha__gte=desde)
+        if hasta is not None:
+            queryset = queryset.filter(fecha__lt=hasta)
+        return queryset
+
+
 class AuditoriaTransferencia(models.Model):
     transferencia = models.ForeignKey(Transferencia, on_delete=models.CASCADE, related_name='auditorias')
     accion = models.CharField(max_length=50)
-    fecha = models.DateTimeField(auto_now_add=True)
+    fecha = models.DateTimeField(default=timezone.now, editable=False)
     detalles = models.JSONField(default=dict)
     error = models.TextField(null=True, blank=True)
     tarea_celery = models.CharField(max_length=100, null=True, blank=True)
 
+    objects = AuditoriaQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Auditoría de Transferencia'
         verbose_name_plural = 'Auditorías de Transferencias'
@@ -673,22 +1409,24 @@ class AuditoriaTransferencia(models.Model):
 
     @classmethod
     def registrar(cls, transferencia, accion, detalles=None, error=None, tarea=None):
-        return cls.objects.create(
+        return RecolectorAuditoria.agregar(cls(
             transferencia=transferencia,
             accion=accion,
             detalles=detalles or {},
             error=error,
             tarea_celery=tarea
-        )
+        ))
 
 class AuditoriaRecarga(models.Model):
     recarga = models.ForeignKey(Recarga, on_delete=models.CASCADE, related_name='auditorias')
     accion = models.CharField(max_length=50)
-    fecha = models.DateTimeField(auto_now_add=True)
+    fecha = models.DateTimeField(default=timezone.now, editable=False)
     detalles = models.JSONField(default=dict)
     error = models.TextField(null=True, blank=True)
     tarea_celery = models.CharField(max_length=100, null=True, blank=True)
 
+    objects = AuditoriaQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Auditoría de Recarga'
         verbose_name_plural = 'Auditorías de Recargas'
@@ -700,13 +1438,13 @@ class AuditoriaRecarga(models.Model):
 
     @classmethod
     def registrar(cls, recarga, accion, detalles=None, error=None, tarea=None):
-        return cls.objects.create(
+        return RecolectorAuditoria.agregar(cls(
             recarga=recarga,
             accion=accion,
             detalles=detalles or {},
             error=error,
             tarea_celery=tarea
-        )
+        ))
 
 
 
@@ -717,7 +1455,7 @@ class AuditoriaMonedero(models.Model):
         related_name='auditorias'
     )
     accion = models.CharField(max_length=50)
-    fecha = models.DateTimeField(auto_now_add=True)
+    fecha = models.DateTimeField(default=timezone.now, editable=False)
     estado_anterior = models.JSONField(
         encoder=DjangoJSONEncoder,
         default=dict
@@ -730,59 +1468,612 @@ class AuditoriaMonedero(models.Model):
         encoder=DjangoJSONEncoder,
         default=dict
     )
+    # Columnas tipadas del saldo para agregados en SQL sin extraer del JSON
+    saldo_anterior = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    saldo_posterior = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    monto = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
     tarea_celery = models.CharField(
         max_length=100, 
         null=True, 
         blank=True
     )
 
+    objects = AuditoriaQuerySet.as_manager()
+
     class Meta:
         ordering = ['-fecha']  # Orden por defecto
         indexes = [
             models.Index(fields=['monedero', 'fecha']),
-            models.Index(
-                fields=['estado_posterior'],
-                condition=models.Q(estado_posterior__has_key='saldo'),
-                name='idx_saldo_posterior'
-            ),
-            models.Index(
-                fields=['estado_anterior'],
-                condition=models.Q(estado_anterior__has_key='saldo'),
-                name='idx_saldo_anterior'
-            )
+            models.Index(fields=['fecha'], name='idx_auditoria_monedero_fecha'),
+            models.Index(fields=['monedero', 'saldo_posterior'], name='idx_auditoria_monedero_saldo'),
         ]
 
     def __str__(self):
         return f"Auditoría {self.id} - {self.accion}"
-class AuditoriaAgente(models.Model):
-    agente = models.ForeignKey(Agente, on_delete=models.CASCADE, related_name='auditorias')
-    accion = models.CharField(max_length=50)
-    fecha = models.DateTimeField(auto_now_add=True)
-    detalles = models.JSONField(default=dict)
-    tarea_celery = models.CharField(max_length=100, null=True, blank=True)
+
+    @classmethod
+    def registrar(cls, monedero, accion, estado_anterior=None, estado_posterior=None, metadata=None,
+                  tarea=None, saldo_anterior=None, saldo_posterior=None, monto=None):
+        return RecolectorAuditoria.agregar(cls(
+            monedero=monedero,
+            accion=accion,
+            estado_anterior=estado_anterior or {},
+            estado_posterior=estado_posterior or {},
+            metadata=metadata or {},
+            saldo_anterior=saldo_anterior,
+            saldo_posterior=saldo_posterior,
+            monto=monto,
+            tarea_celery=tarea
+        ))
+
+class SaldoDiario(models.Model):
+    """
+    Foto diaria del saldo de cada monedero (apertura, cierre, mínimo,
+    máximo y número de movimientos). La tarea consolidar_saldos_diarios la
+    genera cada noche a partir de AuditoriaMonedero, de modo que las
+    estadísticas de cualquier rango no dependen del histórico de auditoría.
+    """
+    monedero = models.ForeignKey(Monedero, on_delete=models.CASCADE, related_name='saldos_diarios')
+    fecha = models.DateField()
+    saldo_apertura = models.DecimalField(max_digits=12, decimal_places=2)
+    saldo_cierre = models.DecimalField(max_digits=12, decimal_places=2)
+    saldo_minimo = models.DecimalField(max_digits=12, decimal_places=2)
+    saldo_maximo = models.DecimalField(max_digits=12, decimal_places=2)
+    movimientos = models.PositiveIntegerField(default=0)
 
     class Meta:
-        verbose_name = 'Auditoría de Agente'
-        verbose_name_plural = 'Auditorías de Agentes'
+        verbose_name = 'Saldo Diario'
+        verbose_name_plural = 'Saldos Diarios'
         ordering = ['-fecha']
-        indexes = [
-            models.Index(fields=['agente', 'accion']),
-            models.Index(fields=['fecha']),
+        constraints = [
+            models.UniqueConstraint(fields=['monedero', 'fecha'], name='unq_saldo_diario_monedero_fecha'),
         ]
 
-    @classmethod
+    def __str__(self):
+        return f"Saldo de {self.monedero_id} el {self.fecha}: {self.saldo_cierre}"
+
+    @classmethod
+    def resumir(cls, dia, monederos=None):
+        """
+        Calcula (sin guardar) la foto del día por monedero con un único
+        GROUP BY sobre las auditorías del día.
+        """
+        desde = timezone.make_aware(datetime.combine(dia, datetime.min.time()))
+        registros = AuditoriaMonedero.objects.en_periodo(desde, desde + timedelta(days=1)).filter(
+            saldo_posterior__isnull=False
+        )
+        if monederos is not None:
+            registros = registros.filter(monedero__in=monederos)
+
+        mismos = registros.filter(monedero=OuterRef('monedero'))
+        resumen = registros.order_by().values('monedero').annotate(
+            minimo=models.Min('saldo_posterior'),
+            maximo=Max('saldo_posterior'),
+            total=models.Count('id'),
+            apertura=Subquery(mismos.order_by('fecha', 'id').values('saldo_anterior')[:1]),
+            primero=Subquery(mismos.order_by('fecha', 'id').values('saldo_posterior')[:1]),
+            cierre=Subquery(mismos.order_by('-fecha', '-id').values('saldo_posterior')[:1]),
+        )
+
+        for fila in resumen.iterator():
+            apertura = fila['apertura'] if fila['apertura'] is not None else fila['primero']
+            yield cls(
+                monedero_id=fila['monedero'],
+                fecha=dia,
+                saldo_apertura=apertura,
+                saldo_cierre=fila['cierre'],
+                saldo_minimo=min(fila['minimo'], apertura),
+                saldo_maximo=max(fila['maximo'], apertura),
+                movimientos=fila['total']
+            )
+
+    @classmethod
+    def serie(cls, monedero, desde=None, hasta=None):
+        """
+        Saldo de cada día de [desde, hasta] (por defecto, desde el primer día
+        con datos hasta hoy). Combina las fotos consolidadas con los días
+        posteriores a la última foto, que aún no ha consolidado la tarea
+        nocturna (incluido hoy) y se resumen al vuelo de las auditorías. Los
+        días sin movimientos arrastran el cierre anterior, así que la serie
+        tiene un elemento por día del rango.
+
+        Returns:
+            Lista de (fecha, cierre, minimo, maximo, movimientos)
+        """
+        hoy = timezone.localdate()
+        hasta = min(hasta or hoy, hoy)
+        fotos = cls.objects.filter(monedero=monedero, fecha__lt=hoy)
+        ultima = fotos.order_by('-fecha').values_list('fecha', flat=True).first()
+
+        # Días sin consolidar: los que tienen auditorías después de la última foto
+        registros = AuditoriaMonedero.objects.filter(monedero=monedero, saldo_posterior__isnull=False)
+        if ultima:
+            registros = registros.en_periodo(desde=_inicio_dia(ultima + timedelta(days=1)))
+        cola = sorted(registros.dates('fecha', 'day'))
+
+        def leer(dias):
+            return {
+                foto.fecha: foto
+                for dia in dias
+                for foto in cls.resumir(dia, monederos=[monedero.pk])
+            }
+
+        en_rango = fotos.filter(fecha__lte=hasta)
+        if desde:
+            en_rango = en_rango.filter(fecha__gte=desde)
+        conocidos = {foto.fecha: foto for foto in en_rango}
+        conocidos.update(leer(dia for dia in cola if (desde is None or dia >= desde) and dia <= hasta))
+
+        if desde is None:
+            if not conocidos:
+                return []
+            desde = min(conocidos)
+        if desde > hasta:
+            return []
+
+        # Saldo con el que empieza el rango: cierre del último día anterior
+        # con datos, o apertura del primero dentro o después del rango
+        saldo = None
+        previos = [dia for dia in cola if dia < desde]
+        if previos:
+            saldo = leer(previos[-1:])[previos[-1]].saldo_cierre
+        else:
+            saldo = fotos.filter(fecha__lt=desde).order_by('-fecha').values_list('saldo_cierre', flat=True).first()
+        if saldo is None and conocidos:
+            saldo = conocidos[min(conocidos)].saldo_apertura
+        if saldo is None:
+            saldo = fotos.filter(fecha__gt=hasta).order_by('fecha').values_list('saldo_apertura', flat=True).first()
+        if saldo is None:
+            posteriores = [dia for dia in cola if dia > hasta]
+            saldo = leer(posteriores[:1])[posteriores[0]].saldo_apertura if posteriores else monedero.saldo
+
+        serie = []
+        for desplazamiento in range((hasta - desde).days + 1):
+            dia = desde + timedelta(days=desplazamiento)
+            foto = conocidos.get(dia)
+            if foto:
+                saldo = foto.saldo_cierre
+                serie.append((dia, foto.saldo_cierre, foto.saldo_minimo, foto.saldo_maximo, foto.movimientos))
+            else:
+                serie.append((dia, saldo, saldo, saldo, 0))
+        return serie
+
+    @classmethod
+    def consolidar(cls, dia, tamano_lote=2000):
+        """Guarda (o recalcula) las fotos del día; es idempotente"""
+        total = 0
+        lote = []
+        for saldo in cls.resumir(dia):
+            lote.append(saldo)
+            if len(lote) >= tamano_lote:
+                total += cls._guardar(lote)
+                lote = []
+        if lote:
+            total += cls._guardar(lote)
+        return total
+
+    @classmethod
+    def _guardar(cls, lote):
+        cls.objects.bulk_create(
+            lote,
+            update_conflicts=True,
+            unique_fields=['monedero', 'fecha'],
+            update_fields=['saldo_apertura', 'saldo_cierre', 'saldo_minimo', 'saldo_maximo', 'movimientos']
+        )
+        return len(lote)
+
+class AuditoriaAgente(models.Model):
+    agente = models.ForeignKey(Agente, on_delete=models.CASCADE, related_name='auditorias')
+    accion = models.CharField(max_length=50)
+    fecha = models.DateTimeField(default=timezone.now, editable=False)
+    detalles = models.JSONField(default=dict)
+    tarea_celery = models.CharField(max_length=100, null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Auditoría de Agente'
+        verbose_name_plural = 'Auditorías de Agentes'
+        ordering = ['-fecha']
+        indexes = [
+            models.Index(fields=['agente', 'accion']),
+            models.Index(fields=['fecha']),
+        ]
+
+    @classmethod
     def registrar(cls, agente, accion, detalles=None, tarea=None):
-        return cls.objects.create(
+        return RecolectorAuditoria.agregar(cls(
             agente=agente,
             accion=accion,
             detalles=detalles or {},
             tarea_celery=tarea
+        ))
+
+class ArchivoAuditoria(models.Model):
+    """
+    Bloque comprimido (NDJSON + gzip) de registros de auditoría de un mes
+    cerrado. Las tablas de auditoría solo conservan los meses recientes;
+    la tarea archivar_auditorias mueve aquí el resto por bloques.
+
+    Los meses archivados ya no aparecen en el admin de auditorías ni en la
+    API (AuditoriaBaseViewSet): solo se consultan descomprimiendo el bloque
+    con leer().
+    """
+    MODELOS = (
+        'monedero.AuditoriaMonedero',
+        'monedero.AuditoriaTransferencia',
+        'monedero.AuditoriaRecarga',
+        'monedero.AuditoriaRetencion',
+    )
+
+    modelo = models.CharField(max_length=60)
+    mes = models.DateField()
+    id_desde = models.BigIntegerField()
+    id_hasta = models.BigIntegerField()
+    registros = models.PositiveIntegerField()
+    datos = models.BinaryField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Archivo de Auditoría'
+        verbose_name_plural = 'Archivos de Auditoría'
+        ordering = ['-mes', 'modelo', 'id_desde']
+        indexes = [
+            models.Index(fields=['modelo', 'mes'], name='idx_archivo_modelo_mes'),
+        ]
+
+    def __str__(self):
+        return f"{self.modelo} {self.mes:%Y-%m} ({self.registros} registros)"
+
+    @classmethod
+    def archivar(cls, modelo, mes, filas):
+        """Crea un bloque con las filas (diccionarios de .values()) de un mes"""
+        contenido = "\n".join(json.dumps(fila, cls=DjangoJSONEncoder) for fila in filas)
+        return cls.objects.create(
+            modelo=modelo,
+            mes=mes,
+            id_desde=filas[0]['id'],
+            id_hasta=filas[-1]['id'],
+            registros=len(filas),
+            datos=gzip.compress(contenido.encode('utf-8'))
         )
 
+    def leer(self):
+        """Itera los registros del bloque"""
+        for linea in gzip.decompress(bytes(self.datos)).decode('utf-8').splitlines():
+            yield json.loads(linea)
+
+
+class ConciliacionLibro(models.Model):
+    """
+    Ejecución de la conciliación de saldos contra el libro mayor. El espacio
+    de ids de Monedero se reparte en RangoConciliacion, que se procesan en
+    paralelo y en cualquier orden; cada rango terminado queda marcado, así
+    que una ejecución interrumpida se reanuda sin repetir trabajo.
+    """
+    class Estados(models.TextChoices):
+        EN_CURSO = "EN_CURSO", _("En curso")
+        COMPLETADA = "COMPLETADA", _("Completada")
+
+    estado = models.CharField(max_length=20, choices=Estados.choices, default=Estados.EN_CURSO)
+    tamano_rango = models.PositiveIntegerField()
+    total_rangos = models.PositiveIntegerField(default=0)
+    rangos_completados = models.PositiveIntegerField(default=0)
+    discrepancias = models.PositiveIntegerField(default=0)
+    fecha_inicio = models.DateTimeField(auto_now_add=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Conciliación del Libro Mayor'
+        verbose_name_plural = 'Conciliaciones del Libro Mayor'
+        ordering = ['-fecha_inicio']
+
+    def __str__(self):
+        return f"Conciliación {self.fecha_inicio:%Y-%m-%d %H:%M} ({self.get_estado_display()})"
+
+    @classmethod
+    def iniciar(cls, tamano_rango=10000):
+        """
+        Crea una ejecución con sus rangos [desde, hasta] de tamano_rango ids
+        entre el menor y el mayor id de Monedero
+        """
+        extremos = Monedero.objects.aggregate(minimo=models.Min('pk'), maximo=Max('pk'))
+        with transaction.atomic():
+            conciliacion = cls.objects.create(tamano_rango=tamano_rango)
+            if extremos['minimo'] is not None:
+                RangoConciliacion.objects.bulk_create([
+                    RangoConciliacion(conciliacion=conciliacion, desde=desde, hasta=desde + tamano_rango - 1)
+                    for desde in range(extremos['minimo'], extremos['maximo'] + 1, tamano_rango)
+                ], batch_size=2000)
+            conciliacion.total_rangos = conciliacion.rangos.count()
+            if not conciliacion.total_rangos:
+                conciliacion.estado = cls.Estados.COMPLETADA
+                conciliacion.fecha_fin = timezone.now()
+            conciliacion.save(update_fields=['total_rangos', 'estado', 'fecha_fin'])
+        return conciliacion
+
+    @classmethod
+    def reanudar_o_iniciar(cls, tamano_rango=10000):
+        """Devuelve la última ejecución sin terminar o empieza una nueva"""
+        pendiente = cls.objects.filter(estado=cls.Estados.EN_CURSO).order_by('-fecha_inicio').first()
+        return pendiente or cls.iniciar(tamano_rango)
+
+    def rangos_pendientes(self):
+        return self.rangos.filter(completado=False).order_by('desde').values_list('pk', flat=True)
+
+
+class RangoConciliacion(models.Model):
+    """
+    Rango de ids de Monedero de una conciliación; es la unidad de trabajo
+    de cada proceso y el punto de control para reanudar
+    """
+    conciliacion = models.ForeignKey(ConciliacionLibro, on_delete=models.CASCADE, related_name='rangos')
+    desde = models.BigIntegerField()
+    hasta = models.BigIntegerField()
+    completado = models.BooleanField(default=False)
+    monederos = models.PositiveIntegerField(default=0)
+    fecha_completado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Rango de Conciliación'
+        verbose_name_plural = 'Rangos de Conciliación'
+        indexes = [
+            models.Index(fields=['conciliacion', 'completado'], name='idx_rango_conciliacion'),
+        ]
+
+    def __str__(self):
+        return f"Monederos {self.desde}-{self.hasta}"
+
+    def conciliar(self):
+        """
+        Compara los saldos del rango con una sola consulta agregada: el saldo
+        contra el neto del libro mayor en DISPONIBLE + RETENIDO, y el saldo
+        retenido contra el neto de RETENIDO y contra la suma de retenciones
+        ACTIVA. Al ser una única sentencia todo se lee de la misma instantánea,
+        así que las operaciones concurrentes no producen falsos positivos.
+
+        Guarda las discrepancias y marca el rango en la misma transacción;
+        si otro proceso ya lo tiene o lo terminó, no hace nada.
+
+        Returns:
+            Número de discrepancias encontradas, o None si se omitió
+        """
+        with transaction.atomic():
+            rango = RangoConciliacion.objects.select_for_update(skip_locked=True).filter(
+                pk=self.pk, completado=False
+            ).first()
+            if rango is None:
+                return None
+
+            with connection.cursor() as cursor:
+                cursor.execute(self._consulta(), {
+                    'credito': MovimientoMonedero.Tipos.CREDITO,
+                    'retenido': MovimientoMonedero.Cuentas.RETENIDO,
+                    'activa': TransaccionRetenida.Estados.ACTIVA,
+                    'desde': rango.desde,
+                    'hasta': rango.hasta,
+                })
+                discrepancias = [
+                    DiscrepanciaLibro(conciliacion_id=rango.conciliacion_id, **dict(zip(DiscrepanciaLibro.COLUMNAS, fila)))
+                    for fila in cursor.fetchall()
+                ]
+            DiscrepanciaLibro.objects.bulk_create(discrepancias, batch_size=1000)
+
+            rango.completado = True
+            rango.monederos = Monedero.objects.filter(pk__range=(rango.desde, rango.hasta)).count()
+            rango.fecha_completado = timezone.now()
+            rango.save(update_fields=['completado', 'monederos', 'fecha_completado'])
+
+            ConciliacionLibro.objects.filter(pk=rango.conciliacion_id).update(
+                rangos_completados=F('rangos_completados') + 1,
+                discrepancias=F('discrepancias') + len(discrepancias)
+            )
+            # El último rango en terminar cierra la ejecución
+            ConciliacionLibro.objects.filter(
+                pk=rango.conciliacion_id,
+                estado=ConciliacionLibro.Estados.EN_CURSO,
+                rangos_completados__gte=F('total_rangos')
+            ).update(estado=ConciliacionLibro.Estados.COMPLETADA, fecha_fin=timezone.now())
+
+        return len(discrepancias)
+
+    @staticmethod
+    def _consulta():
+        """
+        Agregados del libro mayor y de las retenciones por monedero, unidos
+        a los monederos del rango; solo devuelve los que no cuadran. Los tres
+        filtros por rango permiten usar idx_movimiento_monedero y la clave
+        primaria de Monedero.
+        """
+        q = connection.ops.quote_name
+        monedero = q(Monedero._meta.db_table)
+        movimiento = q(MovimientoMonedero._meta.db_table)
+        retencion = q(TransaccionRetenida._meta.db_table)
+        return f"""
+            SELECT m.id, m.saldo, COALESCE(l.saldo, 0), m.saldo_retenido,
+                   COALESCE(l.retenido, 0), COALESCE(r.retenido, 0)
+            FROM {monedero} m
+            LEFT JOIN (
+                SELECT monedero_id,
+                       SUM(CASE WHEN tipo = %(credito)s THEN monto ELSE -monto END) AS saldo,
+                       SUM(CASE WHEN cuenta <> %(retenido)s THEN 0
+                                WHEN tipo = %(credito)s THEN monto ELSE -monto END) AS retenido
+                FROM {movimiento}
+                WHERE monedero_id BETWEEN %(desde)s AND %(hasta)s
+                GROUP BY monedero_id
+            ) l ON l.monedero_id = m.id
+            LEFT JOIN (
+                SELECT mr.id AS monedero_id, SUM(t.monto) AS retenido
+                FROM {retencion} t
+                JOIN {monedero} mr ON mr.usuario_id = t.usuario_id
+                WHERE t.estado = %(activa)s AND mr.id BETWEEN %(desde)s AND %(hasta)s
+                GROUP BY mr.id
+            ) r ON r.monedero_id = m.id
+            WHERE m.id BETWEEN %(desde)s AND %(hasta)s
+              AND (m.saldo <> COALESCE(l.saldo, 0)
+                   OR m.saldo_retenido <> COALESCE(l.retenido, 0)
+                   OR m.saldo_retenido <> COALESCE(r.retenido, 0))
+            ORDER BY m.id
+        """
+
+
+class DiscrepanciaLibro(models.Model):
+    """Monedero cuyo saldo no cuadra con el libro mayor o con sus retenciones"""
+    conciliacion = models.ForeignKey(ConciliacionLibro, on_delete=models.CASCADE, related_name='detalle')
+    monedero = models.ForeignKey(Monedero, on_delete=models.CASCADE, related_name='discrepancias')
+    saldo = models.DecimalField(max_digits=12, decimal_places=2)
+    saldo_libro = models.DecimalField(max_digits=14, decimal_places=2)
+    saldo_retenido = models.DecimalField(max_digits=12, decimal_places=2)
+    retenido_libro = models.DecimalField(max_digits=14, decimal_places=2)
+    retenido_retenciones = models.DecimalField(max_digits=14, decimal_places=2)
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    # Orden de las columnas de RangoConciliacion._consulta y del informe CSV
+    COLUMNAS = ('monedero_id', 'saldo', 'saldo_libro', 'saldo_retenido', 'retenido_libro', 'retenido_retenciones')
+
+    class Meta:
+        verbose_name = 'Discrepancia del Libro Mayor'
+        verbose_name_plural = 'Discrepancias del Libro Mayor'
+        ordering = ['monedero']
+
+    def __str__(self):
+        return f"Monedero {self.monedero_id}: saldo {self.saldo} / libro {self.saldo_libro}"
+
+    @property
+    def diferencia(self):
+        return self.saldo - self.saldo_libro
+
+
 ## ----------------------------
 ## 6. MODELOS DE DASHBOARD Y REPORTES
 ## ----------------------------
 
+class MetricaDashboard(models.Model):
+    """
+    Contadores del dashboard mantenidos al vuelo por señales y por la
+    bandeja de eventos. Cada contador se reparte en FRAGMENTOS filas para que las
+    escrituras concurrentes no compitan por la misma fila; su valor es la
+    suma de sus fragmentos. Los contadores diarios llevan fecha, los
+    acumulados no. La tarea conciliar_metricas_dashboard corrige la deriva
+    y fija las DERIVADAS, que no se actualizan al vuelo.
+    """
+    FRAGMENTOS = 16
+
+    class Claves(models.TextChoices):
+        USUARIOS = "USUARIOS", _("Usuarios")
+        USUARIOS_ACTIVOS = "USUARIOS_ACTIVOS", _("Usuarios activos")
+        TRANSFERENCIAS = "TRANSFERENCIAS", _("Transferencias")
+        RECARGAS = "RECARGAS", _("Recargas")
+        SALDO_TOTAL = "SALDO_TOTAL", _("Saldo total")
+        # Solo comisiones de agente de recargas completadas
+        COMISIONES = "COMISIONES", _("Comisiones")
+        AGENTES_ACTIVOS = "AGENTES_ACTIVOS", _("Agentes activos")
+        AGENCIAS_ACTIVAS = "AGENCIAS_ACTIVAS", _("Agencias activas")
+
+    # Contadores que además se llevan por día
+    DIARIAS = (Claves.USUARIOS, Claves.TRANSFERENCIAS, Claves.RECARGAS)
+    # Contadores que solo recalcula conciliar: el saldo total cambiaría con
+    # cada asiento del libro mayor (el camino crítico) y seguir is_active
+    # exigiría una señal en cada carga de User
+    DERIVADAS = (Claves.SALDO_TOTAL, Claves.USUARIOS_ACTIVOS)
+
+    clave = models.CharField(max_length=30, choices=Claves.choices)
+    fecha = models.DateField(null=True, blank=True)
+    fragmento = models.PositiveSmallIntegerField(default=0)
+    valor = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = "Métrica del Dashboard"
+        verbose_name_plural = "Métricas del Dashboard"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['clave', 'fragmento'],
+                condition=Q(fecha__isnull=True),
+                name='unq_metrica_acumulada'
+            ),
+            models.UniqueConstraint(
+                fields=['clave', 'fecha', 'fragmento'],
+                condition=Q(fecha__isnull=False),
+                name='unq_metrica_diaria'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.clave} {self.fecha or ''} [{self.fragmento}]: {self.valor}"
+
+    @classmethod
+    def incrementar(cls, clave, valor=1, diaria=False, fragmento=None):
+        """
+        Suma valor al contador (y al del día si diaria=True) dentro de la
+        transacción en curso, de modo que se revierte con ella.
+        """
+        if not valor:
+            return
+        fragmento = random.randrange(cls.FRAGMENTOS) if fragmento is None else fragmento
+        fechas = [None, timezone.localdate()] if diaria else [None]
+        for fecha in fechas:
+            filtro = {'clave': clave, 'fecha': fecha, 'fragmento': fragmento}
+            if cls.objects.filter(**filtro).update(valor=F('valor') + valor):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(valor=valor, **filtro)
+            except IntegrityError:
+                cls.objects.filter(**filtro).update(valor=F('valor') + valor)
+
+    @classmethod
+    def valores(cls, fecha=None):
+        """
+        Devuelve {(clave, fecha): valor} de los acumulados y de los
+        contadores del día indicado (hoy por defecto) en una sola consulta
+        """
+        fecha = fecha or timezone.localdate()
+        filas = cls.objects.filter(
+            Q(fecha__isnull=True) | Q(fecha=fecha)
+        ).values('clave', 'fecha').annotate(total=Sum('valor')).order_by()
+        return {(fila['clave'], fila['fecha']): fila['total'] for fila in filas}
+
+    @classmethod
+    def valores_reales(cls, fecha=None):
+        """Recalcula desde las tablas de origen lo que deberían valer los contadores"""
+        fecha = fecha or timezone.localdate()
+        return {
+            (cls.Claves.USUARIOS, None): User.objects.count(),
+            (cls.Claves.USUARIOS_ACTIVOS, None): User.objects.filter(is_active=True).count(),
+            (cls.Claves.USUARIOS, fecha): User.objects.filter(date_joined__date=fecha).count(),
+            (cls.Claves.TRANSFERENCIAS, None): Transferencia.objects.count(),
+            (cls.Claves.TRANSFERENCIAS, fecha): Transferencia.objects.filter(fecha_creacion__date=fecha).count(),
+            (cls.Claves.RECARGAS, None): Recarga.objects.count(),
+            (cls.Claves.RECARGAS, fecha): Recarga.objects.filter(fecha_creacion__date=fecha).count(),
+            (cls.Claves.SALDO_TOTAL, None): Monedero.objects.aggregate(total=Sum('saldo'))['total'] or 0,
+            (cls.Claves.COMISIONES, None): Recarga.objects.filter(
+                estado=Recarga.Estados.COMPLETADA
+            ).aggregate(total=Sum('comision_agente'))['total'] or 0,
+            (cls.Claves.AGENTES_ACTIVOS, None): Agente.objects.filter(activo=True).count(),
+            (cls.Claves.AGENCIAS_ACTIVAS, None): Agencia.objects.filter(activa=True).count(),
+        }
+
+    @classmethod
+    def conciliar(cls, fecha=None):
+        """
+        Compara los contadores con las tablas de origen y asienta la
+        diferencia en el fragmento 0. Devuelve {(clave, fecha): deriva}
+        sin las DERIVADAS, cuya diferencia es la esperada.
+        """
+        reales = cls.valores_reales(fecha)
+        actuales = cls.valores(fecha)
+        derivas = {}
+        for (clave, dia), real in reales.items():
+            deriva = Decimal(real) - (actuales.get((clave, dia)) or 0)
+            if not deriva:
+                continue
+            if clave not in cls.DERIVADAS:
+                derivas[(clave, dia)] = deriva
+            filtro = {'clave': clave, 'fecha': dia, 'fragmento': 0}
+            with transaction.atomic():
+                if not cls.objects.filter(**filtro).update(valor=F('valor') + deriva):
+                    cls.objects.create(valor=deriva, **filtro)
+        return derivas
+
+
 class DashboardAdmin(models.Model):
     """
     Modelo para almacenar configuraciones del dashboard de administración
@@ -798,29 +2089,41 @@ class DashboardAdmin(models.Model):
     def __str__(self):
         return self.nombre
 
+    @classmethod
+    def obtener_actual(cls):
+        """Dashboard principal; se crea la primera vez que se consulta"""
+        dashboard = cls.objects.order_by('pk').first()
+        return dashboard or cls.objects.create()
+
     @classmethod
     def obtener_estadisticas(cls):
-        cache_key = "dashboard_admin_stats"
-        stats = cache.get(cache_key)
-        
-        if not stats:
-            hoy = timezone.now().date()
-            stats = {
-                'total_usuarios': User.objects.count(),
-                'usuarios_activos': User.objects.filter(is_active=True).count(),
-                'nuevos_usuarios_hoy': User.objects.filter(date_joined__date=hoy).count(),
-                'total_transferencias': Transferencia.objects.count(),
-                'transferencias_hoy': Transferencia.objects.filter(fecha_creacion__date=hoy).count(),
-                'total_recargas': Recarga.objects.count(),
-                'recargas_hoy': Recarga.objects.filter(fecha_creacion__date=hoy).count(),
-                'saldo_total': Monedero.objects.aggregate(total=Sum('saldo'))['total'] or 0,
-                'comisiones_total': Recarga.objects.aggregate(total=Sum('comision_agente'))['total'] or 0,
-                'agentes_activos': Agente.objects.filter(activo=True).count(),
-                'agencias_activas': Agencia.objects.filter(activa=True).count()
-            }
-            cache.set(cache_key, stats, timeout=3600)  # Cache por 1 hora
-        
-        return stats
+        """
+        Lee los contadores de MetricaDashboard en una consulta. saldo_total
+        y usuarios_activos son los de la última conciliación (DERIVADAS);
+        comisiones_total son las comisiones de agente de las recargas
+        completadas, las de transferencias quedan en la cuenta COMISIONES
+        del libro mayor.
+        """
+        hoy = timezone.localdate()
+        valores = MetricaDashboard.valores(hoy)
+        Claves = MetricaDashboard.Claves
+
+        def valor(clave, fecha=None):
+            return valores.get((clave, fecha)) or Decimal('0.00')
+
+        return {
+            'total_usuarios': int(valor(Claves.USUARIOS)),
+            'usuarios_activos': int(valor(Claves.USUARIOS_ACTIVOS)),
+            'nuevos_usuarios_hoy': int(valor(Claves.USUARIOS, hoy)),
+            'total_transferencias': int(valor(Claves.TRANSFERENCIAS)),
+            'transferencias_hoy': int(valor(Claves.TRANSFERENCIAS, hoy)),
+            'total_recargas': int(valor(Claves.RECARGAS)),
+            'recargas_hoy': int(valor(Claves.RECARGAS, hoy)),
+            'saldo_total': valor(Claves.SALDO_TOTAL),
+            'comisiones_total': valor(Claves.COMISIONES),
+            'agentes_activos': int(valor(Claves.AGENTES_ACTIVOS)),
+            'agencias_activas': int(valor(Claves.AGENCIAS_ACTIVAS))
+        }
 
 class Reporte(models.Model):
     """
@@ -832,6 +2135,39 @@ class Reporte(models.Model):
         AGENTES = "AGENTES", _("Reporte de Agentes")
         USUARIOS = "USUARIOS", _("Reporte de Usuarios")
 
+    class Estados(models.TextChoices):
+        PENDIENTE = "PENDIENTE", _("Pendiente")
+        EN_PROCESO = "EN_PROCESO", _("En proceso")
+        COMPLETADO = "COMPLETADO", _("Completado")
+        FALLIDO = "FALLIDO", _("Fallido")
+
+    class Formatos(models.TextChoices):
+        CSV = "csv", _("CSV")
+        NDJSON = "ndjson", _("NDJSON comprimido (gzip)")
+
+    # Por tipo: (modelo, campo de fecha para desde/hasta, columnas exportadas)
+    EXPORTACIONES = {
+        TiposReporte.TRANSFERENCIAS: ('monedero.Transferencia', 'fecha_creacion', (
+            'id', 'referencia', 'emisor__username', 'receptor__username', 'cantidad', 'comision',
+            'estado', 'fecha_creacion', 'fecha_procesamiento', 'fecha_programada',
+        )),
+        TiposReporte.RECARGAS: ('monedero.Recarga', 'fecha_creacion', (
+            'id', 'referencia', 'usuario__username', 'agente__codigo_agente', 'monto', 'comision_agente',
+            'monto_neto', 'estado', 'metodo_pago', 'fecha_creacion', 'fecha_procesamiento',
+        )),
+        TiposReporte.AGENTES: ('monedero.Agente', 'fecha_registro', (
+            'id', 'codigo_agente', 'usuario__username', 'agencia__codigo', 'agencia__nombre',
+            'agencia__ciudad', 'comision_acumulada', 'activo', 'fecha_registro', 'ultima_actividad',
+        )),
+        TiposReporte.USUARIOS: (settings.AUTH_USER_MODEL, 'date_joined', (
+            'id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'date_joined',
+            'monedero__saldo', 'monedero__saldo_retenido',
+        )),
+    }
+    TAMANO_BLOQUE = 2000
+    # Cada cuántas filas se guarda el progreso
+    INTERVALO_PROGRESO = 20000
+
     tipo = models.CharField(max_length=20, choices=TiposReporte.choices)
     parametros = models.JSONField(default=dict)
     archivo = models.FileField(upload_to='reportes/', null=True, blank=True)
@@ -839,6 +2175,9 @@ class Reporte(models.Model):
     fecha_completado = models.DateTimeField(null=True, blank=True)
     creado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     tarea_celery = models.CharField(max_length=100, null=True, blank=True)
+    estado = models.CharField(max_length=20, choices=Estados.choices, default=Estados.PENDIENTE)
+    registros_procesados = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
 
     class Meta:
         verbose_name = "Reporte"
@@ -854,10 +2193,87 @@ class Reporte(models.Model):
         
         task = generar_reporte_async.delay(self.pk)
         self.tarea_celery = task.id
-        self.save()
+        self.save(update_fields=['tarea_celery'])
         
         return task.id
 
+    def consulta(self):
+        """Filas del reporte como tuplas (values_list), filtradas por parametros desde/hasta"""
+        modelo, campo_fecha, columnas = self.EXPORTACIONES[self.tipo]
+        queryset = apps.get_model(modelo).objects.all()
+
+        for parametro, operador, dias in (('desde', 'gte', 0), ('hasta', 'lt', 1)):
+            valor = self.parametros.get(parametro)
+            if not valor:
+                continue
+            fecha = parse_date(str(valor))
+            if fecha is None:
+                raise ValidationError(f"Parámetro '{parametro}' no es una fecha AAAA-MM-DD válida")
+            limite = timezone.make_aware(datetime.combine(fecha + timedelta(days=dias), datetime.min.time()))
+            queryset = queryset.filter(**{f'{campo_fecha}__{operador}': limite})
+
+        return columnas, queryset.order_by('pk').values_list(*columnas)
+
+    def generar(self, progreso=None):
+        """
+        Genera el archivo recorriendo la consulta con un cursor de servidor
+        (iterator) y escribiéndola fila a fila en un temporal, de modo que la
+        memoria no depende del tamaño del reporte. Formato según
+        parametros['formato']: csv (por defecto) o ndjson (gzip).
+
+        Args:
+            progreso: callable opcional que recibe el número de filas escritas
+        """
+        formato = self.parametros.get('formato', self.Formatos.CSV)
+        if formato not in self.Formatos.values:
+            raise ValidationError(f"Formato de reporte no soportado: {formato}")
+
+        Reporte.objects.filter(pk=self.pk).update(estado=self.Estados.EN_PROCESO, registros_procesados=0, error=None)
+        try:
+            columnas, filas = self.consulta()
+            filas_escritas = 0
+            with tempfile.TemporaryFile() as temporal:
+                if formato == self.Formatos.CSV:
+                    salida = io.TextIOWrapper(temporal, encoding='utf-8', newline='')
+                    escritor = csv.writer(salida)
+                    escribir = escritor.writerow
+                    escritor.writerow(columnas)
+                else:
+                    salida = io.TextIOWrapper(gzip.GzipFile(fileobj=temporal, mode='wb'), encoding='utf-8')
+                    escribir = lambda fila: salida.write(
+                        json.dumps(dict(zip(columnas, fila)), cls=DjangoJSONEncoder) + '\n'
+                    )
+
+                for fila in filas.iterator(chunk_size=self.TAMANO_BLOQUE):
+                    escribir(fila)
+                    filas_escritas += 1
+                    if filas_escritas % self.INTERVALO_PROGRESO == 0:
+                        Reporte.objects.filter(pk=self.pk).update(registros_procesados=filas_escritas)
+                        if progreso:
+                            progreso(filas_escritas)
+
+                # detach() vacía el texto pendiente sin cerrar el temporal; el
+                # gzip se cierra aparte para escribir su cola
+                binario = salida.detach()
+                if formato == self.Formatos.NDJSON:
+                    binario.close()
+                temporal.seek(0)
+
+                extension = 'csv' if formato == self.Formatos.CSV else 'ndjson.gz'
+                nombre = f"{self.tipo.lower()}_{self.pk}_{timezone.now():%Y%m%d%H%M%S}.{extension}"
+                self.archivo.save(nombre, File(temporal), save=False)
+
+            self.estado = self.Estados.COMPLETADO
+            self.registros_procesados = filas_escritas
+            self.fecha_completado = timezone.now()
+            self.save(update_fields=['archivo', 'estado', 'registros_procesados', 'fecha_completado'])
+            if progreso:
+                progreso(filas_escritas)
+            return self.archivo
+        except Exception as e:
+            Reporte.objects.filter(pk=self.pk).update(estado=self.Estados.FALLIDO, error=str(e))
+            raise
+
 ## ----------------------------
 ## 7. MODELOS DE NOTIFICACIONES
 ## ----------------------------
@@ -871,6 +2287,11 @@ class Notificacion(models.Model):
         SISTEMA = "SISTEMA", _("Mensaje del sistema")
         REPORTE = "REPORTE", _("Reporte generado")
 
+    # Segundos que vive el contador de no leídas en caché; acota la deriva
+    VIGENCIA_CONTADOR = 86400
+    # Por encima de este número de usuarios los contadores se descartan en vez de incrementarse
+    MAX_INCREMENTOS = 100
+
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notificaciones_monedero")
     tipo = models.CharField(max_length=20, choices=Tipos.choices)
     titulo = models.CharField(max_length=100)
@@ -888,6 +2309,7 @@ class Notificacion(models.Model):
         indexes = [
             models.Index(fields=["usuario", "leida"]),
             models.Index(fields=["tipo", "fecha"]),
+            models.Index(fields=["usuario", "fecha", "id"], name="idx_notificacion_cursor"),
         ]
 
     def __str__(self):
@@ -896,48 +2318,253 @@ class Notificacion(models.Model):
     @classmethod
     def notificar_transferencia(cls, transferencia):
         """Notifica a ambos participantes de una transferencia"""
-        # Notificación al emisor
-        cls.objects.create(
-            usuario=transferencia.emisor,
-            tipo=cls.Tipos.TRANSFERENCIA,
-            titulo="Transferencia enviada",
-            mensaje=f"Has enviado {transferencia.cantidad} XOF a {transferencia.receptor.username}",
-            metadata={
-                "referencia": str(transferencia.referencia),
-                "monto": float(transferencia.cantidad),
-                "comision": float(transferencia.comision)
-            }
-        )
+        cls.notificar_transferencias([transferencia])
 
-        # Notificación al receptor (si no es el mismo usuario)
-        if transferencia.emisor != transferencia.receptor:
-            cls.objects.create(
-                usuario=transferencia.receptor,
+    @classmethod
+    def notificar_transferencias(cls, transferencias):
+        """Notifica a los participantes de varias transferencias con un solo INSERT"""
+        cls.guardar_lote(cls.construir_notificaciones_transferencias(transferencias))
+
+    @classmethod
+    def construir_notificaciones_transferencia(cls, transferencia):
+        """Construye (sin guardar) las notificaciones de emisor y receptor"""
+        return cls.construir_notificaciones_transferencias([transferencia])
+
+    @classmethod
+    def construir_notificaciones_transferencias(cls, transferencias):
+        """
+        Construye (sin guardar) las notificaciones de emisor y receptor de
+        cada transferencia. Los nombres salen de las relaciones ya cargadas;
+        las que no lo estén se leen juntas en una sola consulta.
+        """
+        nombres = cls._nombres_usuarios(transferencias, 'emisor', 'receptor')
+        notificaciones = []
+
+        for transferencia in transferencias:
+            # Notificación al emisor
+            notificaciones.append(cls(
+                usuario_id=transferencia.emisor_id,
                 tipo=cls.Tipos.TRANSFERENCIA,
-                titulo="Transferencia recibida",
-                mensaje=f"Has recibido {transferencia.cantidad} XOF de {transferencia.emisor.username}",
+                titulo="Transferencia enviada",
+                mensaje=f"Has enviado {transferencia.cantidad} XOF a {nombres[transferencia.receptor_id]}",
                 metadata={
                     "referencia": str(transferencia.referencia),
-                    "monto": float(transferencia.cantidad)
+                    "monto": float(transferencia.cantidad),
+                    "comision": float(transferencia.comision)
                 }
-            )
+            ))
+
+            # Notificación al receptor (si no es el mismo usuario)
+            if transferencia.emisor_id != transferencia.receptor_id:
+                notificaciones.append(cls(
+                    usuario_id=transferencia.receptor_id,
+                    tipo=cls.Tipos.TRANSFERENCIA,
+                    titulo="Transferencia recibida",
+                    mensaje=f"Has recibido {transferencia.cantidad} XOF de {nombres[transferencia.emisor_id]}",
+                    metadata={
+                        "referencia": str(transferencia.referencia),
+                        "monto": float(transferencia.cantidad)
+                    }
+                ))
+
+        return notificaciones
 
     @classmethod
     def notificar_recarga(cls, recarga):
-        """Notifica al usuario sobre su recarga"""
-        cls.objects.create(
-            usuario=recarga.usuario,
-            tipo=cls.Tipos.RECARGA,
-            titulo="Recarga completada",
-            mensaje=f"Se ha acreditado {recarga.monto_neto} XOF a tu monedero",
+        """Notifica al usuario sobre su recarga y al agente sobre su comisión"""
+        cls.notificar_recargas([recarga])
+
+    @classmethod
+    def notificar_recargas(cls, recargas):
+        """Notifica varias recargas con un solo INSERT"""
+        cls.guardar_lote(cls.construir_notificaciones_recargas(recargas))
+
+    @classmethod
+    def construir_notificaciones_recargas(cls, recargas):
+        """
+        Construye (sin guardar) las notificaciones de usuario y agente de
+        cada recarga; los agentes y nombres que no vengan cargados se leen
+        en una consulta por modelo
+        """
+        nombres = cls._nombres_usuarios(recargas, 'usuario')
+        agentes = {
+            recarga.agente_id: (recarga.agente.codigo_agente, recarga.agente.usuario_id)
+            for recarga in recargas
+            if recarga.agente_id and Recarga.agente.is_cached(recarga)
+        }
+        faltan = {recarga.agente_id for recarga in recargas if recarga.agente_id} - agentes.keys()
+        if faltan:
+            agentes.update(
+                (pk, (codigo, usuario_id))
+                for pk, codigo, usuario_id in Agente.objects.filter(pk__in=faltan).values_list(
+                    'pk', 'codigo_agente', 'usuario_id'
+                )
+            )
+
+        notificaciones = []
+        for recarga in recargas:
+            codigo_agente, usuario_agente = agentes.get(recarga.agente_id, ("Sistema", None))
+            notificaciones.append(cls(
+                usuario_id=recarga.usuario_id,
+                tipo=cls.Tipos.RECARGA,
+                titulo="Recarga completada",
+                mensaje=f"Se ha acreditado {recarga.monto_neto} XOF a tu monedero",
+                metadata={
+                    "referencia": str(recarga.referencia),
+                    "monto_bruto": float(recarga.monto),
+                    "comision": float(recarga.comision_agente),
+                    "agente": codigo_agente
+                }
+            ))
+
+            if usuario_agente and recarga.comision_agente:
+                notificaciones.append(cls(
+                    usuario_id=usuario_agente,
+                    tipo=cls.Tipos.RECARGA,
+                    titulo="Comisión por recarga",
+                    mensaje=f"Has recibido {recarga.comision_agente} XOF de comisión por la recarga {recarga.referencia}",
+                    metadata={
+                        "referencia": str(recarga.referencia),
+                        "monto_recarga": float(recarga.monto),
+                        "comision": float(recarga.comision_agente),
+                        "usuario": nombres[recarga.usuario_id]
+                    }
+                ))
+
+        return notificaciones
+
+    @classmethod
+    def notificar_fallo(cls, usuario_id, tipo, titulo, mensaje, referencia, error):
+        """Aviso importante de una operación que no pudo completarse"""
+        return cls.objects.create(
+            usuario_id=usuario_id,
+            tipo=tipo,
+            titulo=titulo,
+            mensaje=mensaje,
             metadata={
-                "referencia": str(recarga.referencia),
-                "monto_bruto": float(recarga.monto),
-                "comision": float(recarga.comision_agente),
-                "agente": recarga.agente.codigo_agente if recarga.agente else "Sistema"
-            }
+                "referencia": str(referencia),
+                "error": str(error)
+            },
+            importante=True
         )
 
+    @classmethod
+    def notificar_masivo(cls, titulo, mensaje, tipo=Tipos.SISTEMA, importante=False, metadata=None, solo_activos=True):
+        """
+        Encola un aviso del sistema para todos los usuarios (solo los activos
+        por defecto). La tarea inserta por bloques de ids en transacciones
+        independientes; devuelve el id de la tarea.
+        """
+        from .tasks import notificar_masivo_async
+
+        tarea = notificar_masivo_async.delay(titulo, mensaje, tipo, importante, metadata or {}, solo_activos)
+        return tarea.id
+
+    @classmethod
+    def insertar_bloque(cls, usuario_ids, **campos):
+        """Crea la misma notificación para cada usuario con un solo INSERT"""
+        return cls.guardar_lote([cls(usuario_id=pk, **campos) for pk in usuario_ids], publicar=False)
+
+    @classmethod
+    def guardar_lote(cls, notificaciones, publicar=True):
+        """
+        bulk_create de notificaciones que además, al confirmar, actualiza
+        los contadores de no leídas (bulk_create no emite post_save) y las
+        publica en el canal en tiempo real de cada usuario. Los avisos
+        masivos no se publican uno a uno (ver notificar_masivo_async).
+        """
+        from .tiempo_real import publicar_notificaciones
+
+        creadas = cls.objects.bulk_create(notificaciones, batch_size=1000)
+        deltas = {}
+        for notificacion in creadas:
+            if not notificacion.leida:
+                deltas[notificacion.usuario_id] = deltas.get(notificacion.usuario_id, 0) + 1
+        if deltas:
+            transaction.on_commit(lambda: cls.ajustar_no_leidas(deltas))
+        if publicar and creadas:
+            transaction.on_commit(lambda: publicar_notificaciones(creadas))
+        return creadas
+
+    ## Contador de no leídas en caché
+
+    @staticmethod
+    def _clave_no_leidas(usuario_id):
+        return f"notificaciones_no_leidas:{usuario_id}"
+
+    @classmethod
+    def contar_no_leidas(cls, usuario_id):
+        """
+        Número de notificaciones sin leer del usuario. Se lee de la caché;
+        solo si no está se cuenta en la tabla (índice usuario, leida).
+        """
+        clave = cls._clave_no_leidas(usuario_id)
+        conteo = cache.get(clave)
+        if conteo is None:
+            conteo = cls.objects.filter(usuario_id=usuario_id, leida=False).count()
+            cache.add(clave, conteo, timeout=cls.VIGENCIA_CONTADOR)
+        return max(conteo, 0)
+
+    @classmethod
+    def ajustar_no_leidas(cls, deltas):
+        """
+        Aplica {usuario_id: delta} a los contadores cacheados. Los que no
+        están en caché se dejan así (se contarán al leerlos); con muchos
+        usuarios a la vez se descartan en una sola llamada en lugar de
+        incrementarlos uno a uno.
+        """
+        if len(deltas) > cls.MAX_INCREMENTOS:
+            cache.delete_many([cls._clave_no_leidas(pk) for pk in deltas])
+            return
+        for usuario_id, delta in deltas.items():
+            if not delta:
+                continue
+            try:
+                cache.incr(cls._clave_no_leidas(usuario_id), delta)
+            except ValueError:
+                pass
+
+    @classmethod
+    def invalidar_no_leidas(cls, usuario_id):
+        cache.delete(cls._clave_no_leidas(usuario_id))
+
+    @classmethod
+    def marcar_leidas(cls, usuario_id, ids=None):
+        """
+        Marca como leídas todas las notificaciones del usuario, o solo las
+        de `ids`, con un único UPDATE. Devuelve cuántas cambiaron.
+        """
+        pendientes = cls.objects.filter(usuario_id=usuario_id, leida=False)
+        if ids is not None:
+            pendientes = pendientes.filter(pk__in=ids)
+        marcadas = pendientes.update(leida=True)
+        if ids is None:
+            # Se descarta en lugar de poner 0: una notificación creada en
+            # paralelo no se pierde, y el próximo conteo es un COUNT vacío
+            transaction.on_commit(lambda: cls.invalidar_no_leidas(usuario_id))
+        elif marcadas:
+            transaction.on_commit(lambda: cls.ajustar_no_leidas({usuario_id: -marcadas}))
+        return marcadas
+
+    @staticmethod
+    def _nombres_usuarios(objetos, *campos):
+        """
+        {usuario_id: username} de las relaciones `campos` de los objetos,
+        consultando solo los usuarios que no estén ya cargados
+        """
+        nombres, faltan = {}, set()
+        for objeto in objetos:
+            for campo in campos:
+                pk = getattr(objeto, f"{campo}_id")
+                if getattr(type(objeto), campo).is_cached(objeto):
+                    nombres[pk] = getattr(objeto, campo).username
+                elif pk:
+                    faltan.add(pk)
+        faltan -= nombres.keys()
+        if faltan:
+            nombres.update(User.objects.filter(pk__in=faltan).values_list('pk', 'username'))
+        return nombres
+
     @classmethod
     def notificar_reporte(cls, reporte, usuario):
         """Notifica cuando un reporte está listo"""
@@ -995,6 +2622,7 @@ class Transaccion(models.Model):
             models.Index(fields=['usuario', 'tipo']),
             models.Index(fields=['referencia']),
             models.Index(fields=['relacion_contenido', 'relacion_id']),
+            models.Index(fields=['usuario', 'creado_en', 'id'], name='idx_transaccion_cursor'),
         ]
 
     def __str__(self):
@@ -1013,6 +2641,9 @@ class TransaccionRetenida(models.Model):
         LIBERADA = 'LIBERADA', _('Liberada')
         APLICADA = 'APLICADA', _('Aplicada')
         CANCELADA = 'CANCELADA', _('Cancelada')
+
+    # Espera antes de volver a intentar expirar una retención cuyo monedero no cuadra
+    ESPERA_REINTENTO_EXPIRACION = timedelta(hours=1)
     
     referencia = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     usuario = models.ForeignKey(
@@ -1033,6 +2664,8 @@ class TransaccionRetenida(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
     fecha_expiracion = models.DateTimeField()
+    # Aplazamiento del barrido de expiradas tras un fallo (ver expirar_vencidas)
+    reintentar_expiracion = models.DateTimeField(null=True, blank=True, editable=False)
     motivo = models.CharField(max_length=255)
     
     # Relación genérica con el modelo que originó la retención (ej. Pedido)
@@ -1056,6 +2689,12 @@ class TransaccionRetenida(models.Model):
             models.Index(fields=['referencia']),
             models.Index(fields=['fecha_expiracion']),
             models.Index(fields=['relacion_contenido', 'relacion_id']),
+            # Barrido de expiradas: solo las activas
+            models.Index(
+                fields=['fecha_expiracion'],
+                condition=Q(estado='ACTIVA'),
+                name='idx_retencion_activa_expira'
+            ),
         ]
     
     def __str__(self):
@@ -1068,92 +2707,188 @@ class TransaccionRetenida(models.Model):
         if self.monto <= Decimal('0.00'):
             raise ValidationError("El monto debe ser positivo")
     
-    @transaction.atomic
-    def liberar(self):
-        """Libera los fondos retenidos sin aplicar la transacción"""
-        if self.estado != self.Estados.ACTIVA:
-            raise ValidationError("Solo se pueden liberar retenciones activas")
-        
-        monedero = self.usuario.monedero
-        monedero.actualizar_saldo(
-            self.monto,
-            motivo=f"Liberación retención {self.referencia}",
-            retener=True  # Se libera de saldo_retenido
+    def _contabilizar(self, monedero, origen, destino, accion):
+        """Registra en el libro mayor el paso de self.monto de origen a destino"""
+        cuentas_monedero = MovimientoMonedero.CUENTAS_MONEDERO
+        MovimientoMonedero.contabilizar(
+            concepto=f"RETENCION_{accion}",
+            referencia=self.referencia,
+            partidas=[
+                Partida(origen, MovimientoMonedero.Tipos.DEBITO, self.monto,
+                        monedero if origen in cuentas_monedero else None),
+                Partida(destino, MovimientoMonedero.Tipos.CREDITO, self.monto,
+                        monedero if destino in cuentas_monedero else None),
+            ]
         )
-        
-        self.estado = self.Estados.LIBERADA
-        self.save()
-        
+
+    def _cerrar(self, estado, destino, accion, error):
+        """
+        Pasa la retención de ACTIVA a `estado` y mueve su monto de RETENIDO
+        a `destino`. El cambio de estado es un UPDATE condicional: si otra
+        petición ya la cerró no se actualiza ninguna fila y no se mueven
+        fondos dos veces.
+        """
+        ahora = timezone.now()
+        cerrada = TransaccionRetenida.objects.filter(pk=self.pk, estado=self.Estados.ACTIVA).update(
+            estado=estado,
+            fecha_actualizacion=ahora
+        )
+        if not cerrada:
+            raise ValidationError(error)
+
+        monedero = Monedero.objects.get(usuario_id=self.usuario_id)
+        self._contabilizar(monedero, MovimientoMonedero.Cuentas.RETENIDO, destino, accion)
+        self.estado = estado
+        self.fecha_actualizacion = ahora
+
+        if destino == MovimientoMonedero.Cuentas.DISPONIBLE:
+            EventoMonedero.publicar(
+                EventoMonedero.Tipos.RETENCION_LIBERADA,
+                **self._datos_evento(self.pk, self.usuario_id, self.monto, monedero, accion)
+            )
+
         AuditoriaRetencion.registrar(
             retencion=self,
-            accion='LIBERACION',
+            accion=accion,
             detalles={
                 'monto': float(self.monto),
                 'saldo_actual': float(monedero.saldo),
                 'saldo_retenido_actual': float(monedero.saldo_retenido)
             }
         )
+
+    @RecolectorAuditoria()
+    def liberar(self):
+        """Libera los fondos retenidos sin aplicar la transacción"""
+        self._cerrar(self.Estados.LIBERADA, MovimientoMonedero.Cuentas.DISPONIBLE, 'LIBERACION',
+                    "Solo se pueden liberar retenciones activas")
     
-    @transaction.atomic
+    @RecolectorAuditoria()
     def aplicar(self):
         """Aplica la retención, debitando definitivamente los fondos"""
-        if self.estado != self.Estados.ACTIVA:
-            raise ValidationError("Solo se pueden aplicar retenciones activas")
-        
-        monedero = self.usuario.monedero
-        monedero.actualizar_saldo(
-            -self.monto,
-            motivo=f"Aplicación retención {self.referencia}",
-            retener=True  # Se descuenta de saldo_retenido
-        )
-        
-        self.estado = self.Estados.APLICADA
-        self.save()
-        
-        AuditoriaRetencion.registrar(
-            retencion=self,
-            accion='APLICACION',
-            detalles={
-                'monto': float(self.monto),
-                'saldo_actual': float(monedero.saldo),
-                'saldo_retenido_actual': float(monedero.saldo_retenido)
-            }
-        )
+        self._cerrar(self.Estados.APLICADA, MovimientoMonedero.Cuentas.LIQUIDACIONES, 'APLICACION',
+                    "Solo se pueden aplicar retenciones activas")
     
-    @transaction.atomic
+    @RecolectorAuditoria()
     def cancelar(self):
         """Cancela la retención y devuelve los fondos al saldo disponible"""
-        if self.estado != self.Estados.ACTIVA:
-            raise ValidationError("Solo se pueden cancelar retenciones activas")
-        
-        monedero = self.usuario.monedero
-        # Primero libera de saldo_retenido
-        monedero.actualizar_saldo(
-            self.monto,
-            motivo=f"Liberación por cancelación retención {self.referencia}",
-            retener=True
-        )
-        # Luego acredita al saldo disponible
-        monedero.actualizar_saldo(
-            self.monto,
-            motivo=f"Cancelación retención {self.referencia}"
+        self._cerrar(self.Estados.CANCELADA, MovimientoMonedero.Cuentas.DISPONIBLE, 'CANCELACION',
+                    "Solo se pueden cancelar retenciones activas")
+    
+    @classmethod
+    @RecolectorAuditoria()
+    def expirar_vencidas(cls, tamano_lote=1000):
+        """
+        Libera un lote de retenciones ACTIVA ya expiradas. Las filas se
+        reclaman con SKIP LOCKED (varios barridos pueden convivir), todas
+        entran en un único asiento que actualiza cada monedero una sola vez
+        y las auditorías se insertan en bloque al confirmar. Las de un
+        monedero que no cuadra se aplazan ESPERA_REINTENTO_EXPIRACION para
+        que no ocupen el lote de los barridos siguientes.
+
+        Returns:
+            (reclamadas, liberadas): retenciones tomadas en el lote y
+            cuántas de ellas se liberaron; la diferencia quedó aplazada
+        """
+        ahora = timezone.now()
+        vencidas = list(
+            cls.objects.select_for_update(skip_locked=True)
+            .filter(estado=cls.Estados.ACTIVA, fecha_expiracion__lte=ahora)
+            .filter(Q(reintentar_expiracion__isnull=True) | Q(reintentar_expiracion__lte=ahora))
+            .order_by('fecha_expiracion')
+            .values_list('pk', 'usuario_id', 'monto')[:tamano_lote]
         )
-        
-        self.estado = self.Estados.CANCELADA
-        self.save()
-        
-        AuditoriaRetencion.registrar(
-            retencion=self,
-            accion='CANCELACION',
-            detalles={
-                'monto': float(self.monto),
-                'saldo_actual': float(monedero.saldo),
-                'saldo_retenido_actual': float(monedero.saldo_retenido)
-            }
+        if not vencidas:
+            return 0, 0
+
+        por_usuario = {}
+        for pk, usuario_id, monto in vencidas:
+            por_usuario.setdefault(usuario_id, []).append((pk, monto))
+        monederos = {
+            m.usuario_id: m for m in Monedero.objects.filter(usuario_id__in=por_usuario)
+        }
+
+        asiento = uuid.uuid4()
+        try:
+            with transaction.atomic():
+                cls._liberar_expiradas(asiento, por_usuario, monederos)
+            liberadas = por_usuario
+        except SaldoInsuficienteError:
+            # Algún monedero no cuadra: se reintenta monedero a monedero para
+            # no bloquear el resto del lote
+            liberadas = {}
+            for usuario_id, retenciones in por_usuario.items():
+                try:
+                    with transaction.atomic():
+                        cls._liberar_expiradas(asiento, {usuario_id: retenciones}, monederos)
+                    liberadas[usuario_id] = retenciones
+                except SaldoInsuficienteError:
+                    logger.error(
+                        f"Retenciones expiradas del usuario {usuario_id} sin saldo retenido suficiente: "
+                        f"{[pk for pk, _ in retenciones]}"
+                    )
+            aplazadas = [
+                pk
+                for usuario_id, retenciones in por_usuario.items() if usuario_id not in liberadas
+                for pk, _ in retenciones
+            ]
+            cls.objects.filter(pk__in=aplazadas).update(
+                reintentar_expiracion=ahora + cls.ESPERA_REINTENTO_EXPIRACION
+            )
+
+        pks = [pk for retenciones in liberadas.values() for pk, _ in retenciones]
+        cls.objects.filter(pk__in=pks).update(estado=cls.Estados.LIBERADA, fecha_actualizacion=timezone.now())
+        EventoMonedero.publicar_lote(EventoMonedero.Tipos.RETENCION_LIBERADA, [
+            cls._datos_evento(pk, usuario_id, monto, monederos[usuario_id], 'EXPIRACION')
+            for usuario_id, retenciones in liberadas.items()
+            for pk, monto in retenciones
+        ])
+
+        for usuario_id, retenciones in liberadas.items():
+            monedero = monederos[usuario_id]
+            for pk, monto in retenciones:
+                RecolectorAuditoria.agregar(AuditoriaRetencion(
+                    retencion_id=pk,
+                    accion='EXPIRACION',
+                    detalles={
+                        'monto': float(monto),
+                        'asiento': str(asiento),
+                        'saldo_actual': float(monedero.saldo),
+                        'saldo_retenido_actual': float(monedero.saldo_retenido)
+                    }
+                ))
+
+        return len(vencidas), len(pks)
+
+    @staticmethod
+    def _datos_evento(pk, usuario_id, monto, monedero, accion):
+        return {
+            'retencion': pk,
+            'usuario': usuario_id,
+            'monto': str(monto),
+            'accion': accion,
+            'monederos': [monedero.pk]
+        }
+
+    @staticmethod
+    def _liberar_expiradas(asiento, por_usuario, monederos):
+        partidas = []
+        for usuario_id, retenciones in por_usuario.items():
+            for _, monto in retenciones:
+                partidas += [
+                    Partida(MovimientoMonedero.Cuentas.RETENIDO, MovimientoMonedero.Tipos.DEBITO,
+                            monto, monederos[usuario_id]),
+                    Partida(MovimientoMonedero.Cuentas.DISPONIBLE, MovimientoMonedero.Tipos.CREDITO,
+                            monto, monederos[usuario_id]),
+                ]
+        MovimientoMonedero.contabilizar(
+            concepto='RETENCION_EXPIRACION',
+            referencia=asiento,
+            partidas=partidas
         )
-    
+
     @classmethod
-    @transaction.atomic
+    @RecolectorAuditoria()
     def crear_retencion(cls, usuario, monto, motivo, relacion_obj=None, dias_expiracion=3):
         """
         Crea una nueva retención de fondos de forma segura.
@@ -1168,11 +2903,7 @@ class TransaccionRetenida(models.Model):
         Returns:
             TransaccionRetenida creada
         """
-        monedero = usuario.monedero
-        
-        # Verificar saldo disponible
-        if monedero.saldo_disponible < monto:
-            raise ValidationError("Saldo insuficiente para la retención")
+        monedero = Monedero.objects.get(usuario_id=usuario.pk)
         
         # Crear la retención
         retencion = cls(
@@ -1189,12 +2920,14 @@ class TransaccionRetenida(models.Model):
         retencion.full_clean()
         retencion.save()
         
-        # Actualizar el monedero (retener fondos)
-        monedero.actualizar_saldo(
-            -monto,
-            motivo=f"Retención {retencion.referencia}: {motivo}",
-            retener=False  # Se descuenta de saldo y suma a saldo_retenido
-        )
+        # Mover los fondos de saldo disponible a saldo_retenido: el asiento
+        # aplica un único UPDATE ... WHERE saldo - saldo_retenido >= monto, así
+        # que la comprobación de saldo y la reserva son atómicas sin bloqueo previo
+        try:
+            retencion._contabilizar(monedero, MovimientoMonedero.Cuentas.DISPONIBLE,
+                                    MovimientoMonedero.Cuentas.RETENIDO, 'CREACION')
+        except SaldoInsuficienteError:
+            raise ValidationError("Saldo insuficiente para la retención")
         
         AuditoriaRetencion.registrar(
             retencion=retencion,
@@ -1218,9 +2951,11 @@ class AuditoriaRetencion(models.Model):
         related_name='auditorias'
     )
     accion = models.CharField(max_length=50)
-    fecha = models.DateTimeField(auto_now_add=True)
+    fecha = models.DateTimeField(default=timezone.now, editable=False)
     detalles = models.JSONField(default=dict)
     error = models.TextField(null=True, blank=True)
+
+    objects = AuditoriaQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Auditoría de Retención'
@@ -1233,9 +2968,139 @@ class AuditoriaRetencion(models.Model):
     
     @classmethod
     def registrar(cls, retencion, accion, detalles=None, error=None):
-        return cls.objects.create(
+        return RecolectorAuditoria.agregar(cls(
             retencion=retencion,
             accion=accion,
             detalles=detalles or {},
             error=error
-        )
\ No newline at end of file
+        ))
+
+## ----------------------------
+## 8. BANDEJA DE SALIDA DE EVENTOS
+## ----------------------------
+
+class EventoMonedero(models.Model):
+    """
+    Bandeja de salida (outbox) de los eventos del monedero. Las operaciones
+    escriben una fila compacta en la misma transacción que el movimiento de
+    fondos; la tarea despachar_eventos_monedero las consume por lotes y
+    hace el trabajo derivado (notificaciones, invalidación de estadísticas
+    y contadores del dashboard) fuera de la sección crítica.
+    """
+    MAX_INTENTOS = 5
+
+    class Tipos(models.TextChoices):
+        TRANSFERENCIA_COMPLETADA = "TRANSFERENCIA_COMPLETADA", _("Transferencia completada")
+        RECARGA_COMPLETADA = "RECARGA_COMPLETADA", _("Recarga completada")
+        RETENCION_LIBERADA = "RETENCION_LIBERADA", _("Retención liberada")
+
+    tipo = models.CharField(max_length=30, choices=Tipos.choices)
+    datos = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    procesado = models.BooleanField(default=False)
+    fecha_procesado = models.DateTimeField(null=True, blank=True)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Evento de Monedero'
+        verbose_name_plural = 'Eventos de Monedero'
+        indexes = [
+            models.Index(fields=['id'], condition=Q(procesado=False), name='idx_evento_pendiente'),
+            models.Index(fields=['fecha_procesado'], condition=Q(procesado=True), name='idx_evento_procesado'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.pk}"
+
+    @classmethod
+    def publicar(cls, tipo, **datos):
+        """Registra un evento dentro de la transacción en curso"""
+        return cls.objects.create(tipo=tipo, datos=datos)
+
+    @classmethod
+    def publicar_lote(cls, tipo, lista_datos):
+        """Registra varios eventos del mismo tipo con un solo INSERT"""
+        return cls.objects.bulk_create([cls(tipo=tipo, datos=datos) for datos in lista_datos], batch_size=1000)
+
+    @classmethod
+    def despachar(cls, tamano_lote=500):
+        """
+        Procesa un lote de eventos pendientes reclamados con SKIP LOCKED.
+        Los efectos en base de datos y la marca de procesado se confirman
+        juntos, así que reintentar un lote no duplica notificaciones. Si el
+        lote falla se reintenta evento a evento para aislar el que falla,
+        que se descarta tras MAX_INTENTOS.
+
+        Returns:
+            Número de eventos reclamados
+        """
+        with transaction.atomic():
+            eventos = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(procesado=False, intentos__lt=cls.MAX_INTENTOS)
+                .order_by('id')[:tamano_lote]
+            )
+            if not eventos:
+                return 0
+            try:
+                with transaction.atomic():
+                    cls._aplicar(eventos)
+                procesados = eventos
+            except Exception as e:
+                logger.warning(f"Lote de {len(eventos)} eventos fallido, se reintenta uno a uno: {str(e)}")
+                procesados = []
+                for evento in eventos:
+                    try:
+                        with transaction.atomic():
+                            cls._aplicar([evento])
+                        procesados.append(evento)
+                    except Exception as error:
+                        logger.error(f"Evento {evento.pk} ({evento.tipo}) fallido: {str(error)}")
+                        cls.objects.filter(pk=evento.pk).update(
+                            intentos=F('intentos') + 1,
+                            error=str(error)
+                        )
+
+            cls.objects.filter(pk__in=[evento.pk for evento in procesados]).update(
+                procesado=True,
+                fecha_procesado=timezone.now(),
+                error=None
+            )
+        return len(eventos)
+
+    @classmethod
+    def _aplicar(cls, eventos):
+        por_tipo = {}
+        for evento in eventos:
+            por_tipo.setdefault(evento.tipo, []).append(evento.datos)
+
+        notificaciones = []
+        monederos = set()
+        for datos in por_tipo.values():
+            for dato in datos:
+                monederos.update(dato.get('monederos', ()))
+
+        transferencias = list(Transferencia.objects.select_related('emisor', 'receptor').filter(
+            pk__in=[d['transferencia'] for d in por_tipo.get(cls.Tipos.TRANSFERENCIA_COMPLETADA, ())]
+        ))
+        notificaciones += Notificacion.construir_notificaciones_transferencias(transferencias)
+
+        recargas = list(Recarga.objects.select_related('usuario', 'agente').filter(
+            pk__in=[d['recarga'] for d in por_tipo.get(cls.Tipos.RECARGA_COMPLETADA, ())]
+        ))
+        notificaciones += Notificacion.construir_notificaciones_recargas(recargas)
+        comisiones = sum((recarga.comision_agente or 0 for recarga in recargas), Decimal('0.00'))
+
+        for datos in por_tipo.get(cls.Tipos.RETENCION_LIBERADA, ()):
+            notificaciones.append(Notificacion(
+                usuario_id=datos['usuario'],
+                tipo=Notificacion.Tipos.SISTEMA,
+                titulo="Fondos liberados",
+                mensaje=f"Se han devuelto {datos['monto']} XOF retenidos a tu saldo disponible",
+                metadata={'retencion': datos['retencion'], 'motivo': datos['accion']}
+            ))
+
+        Notificacion.guardar_lote(notificaciones)
+        MetricaDashboard.incrementar(MetricaDashboard.Claves.COMISIONES, comisiones)
+        transaction.on_commit(lambda: invalidar_estadisticas(monederos=monederos))
@@ -1,7 +1,107 @@
 # monedero/pagination.py
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 
 class OptimizedPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Paginación por cursor sobre la tupla (campo, id): el cursor guarda los
+    dos valores de la última fila y la página siguiente es
+    WHERE campo < v OR (campo = v AND id < i), un rango del índice del mismo
+    coste sin importar lo profunda que sea ni cuántas filas compartan valor.
+    No se calcula el total.
+
+    Se ordena por `campo_cursor` de la vista (por defecto 'fecha'),
+    descendente. ?ordering= admite ese campo o cualquiera de los
+    ordering_fields de la vista, con '-' para descendente; otro criterio se
+    rechaza con 400.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    campo_cursor = 'fecha'
+
+    def get_ordering(self, request, queryset, view):
+        campo_cursor = getattr(view, 'campo_cursor', self.campo_cursor)
+        permitidos = {campo_cursor, *getattr(view, 'ordering_fields', ())}
+        criterio = request.query_params.get('ordering') or f'-{campo_cursor}'
+        if criterio.lstrip('-') not in permitidos:
+            raise ValidationError({'ordering': f"Solo se admite ordenar por: {', '.join(sorted(permitidos))}"})
+        if criterio.startswith('-'):
+            return (criterio, '-id')
+        return (criterio, 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.reverse, self.posicion = self.decode_cursor(request)
+
+        # Al retroceder se recorre el orden inverso y se da la vuelta a la página
+        campo = self.ordering[0].lstrip('-')
+        descendente = self.ordering[0].startswith('-') != self.reverse
+        queryset = queryset.order_by(*(f'-{c}' if descendente else c for c in (campo, 'id')))
+        if self.posicion is not None:
+            valor, pk = self.posicion
+            operador = 'lt' if descendente else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{campo}__{operador}': valor}) | Q(**{campo: valor, f'id__{operador}': pk})
+            )
+
+        filas = list(queryset[:self.page_size + 1])
+        hay_mas = len(filas) > self.page_size
+        self.page = filas[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = self.posicion is not None, hay_mas
+        else:
+            self.has_next, self.has_previous = hay_mas, self.posicion is not None
+        return self.page
+
+    def _posicion(self, fila):
+        return str(getattr(fila, self.ordering[0].lstrip('-'))), fila.pk
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        posicion = self._posicion(self.page[-1]) if self.page else self.posicion
+        return self.encode_cursor((False, posicion))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        posicion = self._posicion(self.page[0]) if self.page else self.posicion
+        return self.encode_cursor((True, posicion))
+
+    def encode_cursor(self, cursor):
+        reverse, (valor, pk) = cursor
+        tokens = {'v': valor, 'i': pk}
+        if reverse:
+            tokens['r'] = '1'
+        codificado = b64encode(parse.urlencode(tokens, doseq=True).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, codificado)
+
+    def decode_cursor(self, request):
+        """Devuelve (reverse, (valor, id)) o (False, None) sin cursor"""
+        codificado = request.query_params.get(self.cursor_query_param)
+        if codificado is None:
+            return False, None
+        try:
+            tokens = parse.parse_qs(b64decode(codificado.encode('ascii')).decode('ascii'), keep_blank_values=True)
+            return bool(int(tokens.get('r', ['0'])[0])), (tokens['v'][0], int(tokens['i'][0]))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
@@ -1,4 +1,7 @@
+import csv
+import io
 from rest_framework import serializers
+from django.db import models
 from decimal import Decimal
 from django.contrib.auth import get_user_model
 from .models import (
@@ -44,6 +47,18 @@ class ConfiguracionSistemaSerializer(serializers.ModelSerializer):
 ## 2. SERIALIZERS DE AGENCIAS Y AGENTES
 ## ----------------------------
 
+class EstadisticasLoteListSerializer(serializers.ListSerializer):
+    """
+    Calcula las estadísticas de todos los elementos de la lista con
+    Modelo.estadisticas_lote antes de serializarlos uno a uno
+    """
+    def to_representation(self, data):
+        elementos = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if elementos:
+            self.child.Meta.model.estadisticas_lote(elementos)
+        return super().to_representation(elementos)
+
+
 class AgenciaSerializer(serializers.ModelSerializer):
     agentes_activos = serializers.SerializerMethodField()
     url_dashboard = serializers.SerializerMethodField()
@@ -58,9 +73,10 @@ class AgenciaSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'clave_encripcion': {'write_only': True}
         }
+        list_serializer_class = EstadisticasLoteListSerializer
 
     def get_agentes_activos(self, obj):
-        return obj.agentes_activos().count()
+        return obj.estadisticas['agentes_activos']
 
     def get_url_dashboard(self, obj):
         return obj.get_absolute_url()
@@ -87,6 +103,7 @@ class AgenteSerializer(serializers.ModelSerializer):
             'usuario': {'required': True},
             'agencia': {'required': True}
         }
+        list_serializer_class = EstadisticasLoteListSerializer
 
     def get_usuario_info(self, obj):
         """Información básica del usuario asociado"""
@@ -110,7 +127,7 @@ class AgenteSerializer(serializers.ModelSerializer):
         }
 
     def get_estadisticas(self, obj):
-        """Obtiene estadísticas del agente usando el property del modelo"""
+        """Estadísticas del agente; en listas ya vienen calculadas por lote"""
         return obj.estadisticas
 
     def validate_codigo_agente(self, value):
@@ -137,12 +154,14 @@ class MonederoSerializer(serializers.ModelSerializer):
         model = Monedero
         fields = [
             'id', 'usuario', 'usuario_info', 'saldo', 'saldo_disponible', 'saldo_retenido',
-            'limite_credito', 'nivel_verificacion', 'fecha_actualizacion', 'estadisticas'
+            'limite_credito', 'nivel_verificacion', 'fecha_actualizacion', 'ultimo_movimiento',
+            'ultimo_concepto', 'ultimo_monto', 'estadisticas'
         ]
         read_only_fields = (
             'id', 'usuario_info', 'saldo', 'saldo_disponible', 'saldo_retenido',
-            'fecha_actualizacion', 'estadisticas'
+            'fecha_actualizacion', 'ultimo_movimiento', 'ultimo_concepto', 'ultimo_monto', 'estadisticas'
         )
+        list_serializer_class = EstadisticasLoteListSerializer
 
     def get_usuario_info(self, obj):
         return {
@@ -154,6 +173,7 @@ class MonederoSerializer(serializers.ModelSerializer):
         return float(obj.saldo_disponible)
 
     def get_estadisticas(self, obj):
+        # En listados ya vienen calculadas por Monedero.estadisticas_lote
         return obj.estadisticas
 
 ## ----------------------------
@@ -302,6 +322,7 @@ class ReporteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reporte
         fields = '__all__'
+        read_only_fields = ('archivo', 'tarea_celery', 'estado', 'registros_procesados', 'error')
 
     def get_creado_por_info(self, obj):
         if not obj.creado_por:
@@ -372,6 +393,49 @@ class TransferenciaCreateSerializer(serializers.Serializer):
         except User.DoesNotExist:
             raise serializers.ValidationError("Usuario receptor no encontrado")
 
+class TransferenciaLoteItemSerializer(serializers.Serializer):
+    receptor = serializers.CharField()
+    cantidad = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+class TransferenciaMasivaSerializer(serializers.Serializer):
+    """Pago masivo: lista JSON 'transferencias' o archivo CSV con columnas receptor,cantidad"""
+    transferencias = TransferenciaLoteItemSerializer(many=True, required=False)
+    archivo = serializers.FileField(required=False)
+
+    def validate(self, data):
+        transferencias = data.get('transferencias')
+        archivo = data.get('archivo')
+
+        if bool(transferencias) == bool(archivo):
+            raise serializers.ValidationError(
+                "Envía una lista de 'transferencias' o un 'archivo' CSV (solo uno de los dos)"
+            )
+
+        if archivo:
+            transferencias = self._leer_csv(archivo)
+
+        if len(transferencias) > Transferencia.MAX_LOTE:
+            raise serializers.ValidationError(
+                f"Un lote admite como máximo {Transferencia.MAX_LOTE} transferencias"
+            )
+
+        data['transferencias'] = transferencias
+        return data
+
+    def _leer_csv(self, archivo):
+        try:
+            lector = csv.DictReader(io.TextIOWrapper(archivo, encoding='utf-8-sig'))
+            filas = list(lector)
+        except (UnicodeDecodeError, csv.Error):
+            raise serializers.ValidationError("El archivo CSV no es válido")
+
+        if not {'receptor', 'cantidad'} <= set(lector.fieldnames or []):
+            raise serializers.ValidationError("El CSV debe tener las columnas 'receptor' y 'cantidad'")
+
+        items = TransferenciaLoteItemSerializer(data=filas, many=True)
+        items.is_valid(raise_exception=True)
+        return items.validated_data
+
 class RecargaCreateSerializer(serializers.Serializer):
     monto = serializers.DecimalField(max_digits=12, decimal_places=2)
     metodo_pago = serializers.CharField(max_length=50)
@@ -1,7 +1,10 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.db import transaction
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import Monedero, User, Agente, Transferencia, Recarga
+from .asignacion import AsignadorAgentes
+from .tiempo_real import publicar_notificaciones
+from .models import Monedero, User, Agencia, Agente, Transferencia, Recarga, MetricaDashboard, Notificacion, invalidar_estadisticas
 import logging
 
 logger = logging.getLogger(__name__)
@@ -65,4 +68,131 @@ def programar_transferencia(sender, instance, created, **kwargs):
     """
     if created and instance.estado == Transferencia.Estados.PROGRAMADA:
         instance.programar(instance.fecha_programada)
-        logger.info(f"Transferencia {instance.referencia} programada para {instance.fecha_programada}")
\ No newline at end of file
+        logger.info(f"Transferencia {instance.referencia} programada para {instance.fecha_programada}")
+
+
+## Métricas del dashboard
+
+Claves = MetricaDashboard.Claves
+
+
+@receiver(post_save, sender=User)
+def contar_usuario(sender, instance, created, **kwargs):
+    if created:
+        MetricaDashboard.incrementar(Claves.USUARIOS, diaria=True)
+
+
+@receiver(post_delete, sender=User)
+def descontar_usuario(sender, instance, **kwargs):
+    MetricaDashboard.incrementar(Claves.USUARIOS, -1)
+
+
+@receiver(post_save, sender=Transferencia)
+def contar_transferencia(sender, instance, created, **kwargs):
+    if created:
+        MetricaDashboard.incrementar(Claves.TRANSFERENCIAS, diaria=True)
+
+
+@receiver(post_save, sender=Recarga)
+def contar_recarga(sender, instance, created, **kwargs):
+    if created:
+        MetricaDashboard.incrementar(Claves.RECARGAS, diaria=True)
+        # Las comisiones se cuentan al completarse, desde EventoMonedero
+
+
+def seguir_activos(modelo, campo, clave):
+    """
+    Mantiene el contador `clave` con las filas de `modelo` cuyo `campo`
+    booleano es verdadero. El valor anterior es el que tenía la instancia
+    al cargarse (post_init), así que guardar no vuelve a leer la fila; la
+    deriva de instancias desfasadas la corrige conciliar_metricas_dashboard.
+    """
+    def al_cargar(sender, instance, **kwargs):
+        # Un campo diferido no está en __dict__ y leerlo lanzaría una consulta
+        if campo in instance.__dict__:
+            instance._activo_cargado = bool(instance.__dict__[campo])
+
+    def antes_de_guardar(sender, instance, update_fields=None, **kwargs):
+        if instance._state.adding:
+            anterior = False
+        elif update_fields is not None and campo not in update_fields:
+            anterior = None  # El guardado no toca el campo
+        elif hasattr(instance, '_activo_cargado'):
+            anterior = instance._activo_cargado
+        else:
+            anterior = sender.objects.filter(pk=instance.pk).values_list(campo, flat=True).first() or False
+        instance._activo_anterior = anterior
+
+    def despues_de_guardar(sender, instance, **kwargs):
+        anterior = getattr(instance, '_activo_anterior', None)
+        if anterior is None:
+            return
+        actual = bool(getattr(instance, campo))
+        instance._activo_cargado = actual
+        if actual != anterior:
+            MetricaDashboard.incrementar(clave, 1 if actual else -1)
+
+    def despues_de_borrar(sender, instance, **kwargs):
+        if getattr(instance, campo):
+            MetricaDashboard.incrementar(clave, -1)
+
+    uid = f"metricas_{modelo._meta.label_lower}_{campo}"
+    post_init.connect(al_cargar, sender=modelo, weak=False, dispatch_uid=f"{uid}_init")
+    pre_save.connect(antes_de_guardar, sender=modelo, weak=False, dispatch_uid=f"{uid}_pre")
+    post_save.connect(despues_de_guardar, sender=modelo, weak=False, dispatch_uid=f"{uid}_post")
+    post_delete.connect(despues_de_borrar, sender=modelo, weak=False, dispatch_uid=f"{uid}_delete")
+
+
+seguir_activos(Agente, 'activo', Claves.AGENTES_ACTIVOS)
+seguir_activos(Agencia, 'activa', Claves.AGENCIAS_ACTIVAS)
+
+
+## Estadísticas de agentes y agencias
+
+@receiver(post_save, sender=Recarga)
+@receiver(post_delete, sender=Recarga)
+def invalidar_estadisticas_recarga(sender, instance, **kwargs):
+    if not instance.agente_id:
+        return
+    if Recarga.agente.is_cached(instance):
+        agencia_id = instance.agente.agencia_id
+    else:
+        agencia_id = Agente.objects.filter(pk=instance.agente_id).values_list('agencia_id', flat=True).first()
+    transaction.on_commit(
+        lambda: invalidar_estadisticas(agentes=[instance.agente_id], agencias=[agencia_id])
+    )
+
+
+@receiver(post_save, sender=Agente)
+@receiver(post_delete, sender=Agente)
+def invalidar_estadisticas_agente(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: invalidar_estadisticas(agentes=[instance.pk], agencias=[instance.agencia_id])
+    )
+
+
+@receiver(post_save, sender=Agente)
+@receiver(post_delete, sender=Agente)
+def invalidar_rotacion_agentes(sender, instance, created=False, **kwargs):
+    """Las rotaciones de AsignadorAgentes cambian con altas, bajas y cambios de activo"""
+    anterior = getattr(instance, '_activo_anterior', None)
+    if created or kwargs.get('signal') is post_delete or (anterior is not None and instance.activo != anterior):
+        transaction.on_commit(AsignadorAgentes.invalidar)
+
+
+## Contador de notificaciones no leídas y canal en tiempo real
+
+@receiver(post_save, sender=Notificacion)
+def contar_notificacion(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publicar_notificaciones([instance]))
+    if created and not instance.leida:
+        transaction.on_commit(lambda: Notificacion.ajustar_no_leidas({instance.usuario_id: 1}))
+    elif not created:
+        # Un guardado completo puede haber cambiado `leida`
+        transaction.on_commit(lambda: Notificacion.invalidar_no_leidas(instance.usuario_id))
+
+
+@receiver(post_delete, sender=Notificacion)
+def descontar_notificacion(sender, instance, **kwargs):
+    transaction.on_commit(lambda: Notificacion.invalidar_no_leidas(instance.usuario_id))
@@ -1,6 +1,14 @@
+from datetime import date, datetime, timedelta
 from celery import shared_task
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils import timezone
-from .models import Transferencia, Recarga, Agente
+from .asignacion import AsignadorAgentes
+from .idempotencia import VIGENCIA as VIGENCIA_IDEMPOTENCIA
+from .tiempo_real import publicar_aviso_global
+from .models import Transferencia, Recarga, Reporte, ClaveIdempotencia, TransaccionRetenida, ArchivoAuditoria, MetricaDashboard, SaldoDiario, ConciliacionLibro, RangoConciliacion, EventoMonedero, Notificacion, inicio_mes
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,30 +19,337 @@ def ejecutar_transferencia_programada(self, transferencia_id):
     Tarea Celery para ejecutar transferencias programadas
     """
     try:
-        transferencia = Transferencia.objects.get(pk=transferencia_id)
-        if transferencia.estado == Transferencia.Estados.PROGRAMADA:
-            if transferencia.fecha_programada <= timezone.now():
+        with transaction.atomic():
+            # Si otro worker ya la tiene (reintento del despachador) se omite
+            transferencia = Transferencia.objects.select_for_update(skip_locked=True).filter(
+                pk=transferencia_id,
+                estado__in=Transferencia.ESTADOS_DESPACHO,
+                fecha_programada__lte=timezone.now()
+            ).first()
+            if transferencia:
                 transferencia.procesar()
                 logger.info(f"Transferencia programada {transferencia.referencia} procesada")
                 return True
+    except ValidationError as e:
+        # procesar revierte su transacción al fallar; sin marcarla aquí el
+        # despachador la volvería a reclamar indefinidamente
+        Transferencia.objects.filter(
+            pk=transferencia_id,
+            estado__in=Transferencia.ESTADOS_DESPACHO
+        ).update(estado=Transferencia.Estados.FALLIDA)
+        logger.warning(f"Transferencia programada {transferencia_id} fallida: {str(e)}")
+        return False
     except Exception as e:
         logger.error(f"Error procesando transferencia programada {transferencia_id}: {str(e)}")
         self.retry(exc=e, countdown=60)
 
+
 @shared_task(bind=True, max_retries=3)
-def procesar_recarga_async(self, recarga_id):
+def despachar_transferencias_programadas(self, tamano_lote=500, max_lotes=20):
     """
-    Tarea Celery para procesar recargas de forma asíncrona
+    Única tarea periódica para todas las transferencias programadas:
+    reclama por lotes las vencidas (SKIP LOCKED) y encola una ejecución
+    por transferencia al confirmar cada lote. El coste para beat es
+    constante sin importar cuántas haya programadas.
+    """
+    total = 0
+    try:
+        for _ in range(max_lotes):
+            with transaction.atomic():
+                pks = Transferencia.reclamar_vencidas(tamano_lote)
+                transaction.on_commit(
+                    lambda pks=pks: [ejecutar_transferencia_programada.delay(pk) for pk in pks]
+                )
+            total += len(pks)
+            if len(pks) < tamano_lote:
+                break
+        if total:
+            logger.info(f"Despachadas {total} transferencias programadas")
+        return total
+    except Exception as e:
+        logger.error(f"Error despachando transferencias programadas: {str(e)}")
+        self.retry(exc=e, countdown=30)
+
+@shared_task(bind=True, max_retries=3)
+def procesar_recarga_async(self, recarga_id, agencia_id=None, ciudad=None):
+    """
+    Tarea Celery para procesar recargas de forma asíncrona. El agente se
+    reparte con AsignadorAgentes, opcionalmente dentro de una agencia o
+    ciudad (por defecto las de datos_pago, si vienen).
     """
     try:
         recarga = Recarga.objects.get(pk=recarga_id)
         if recarga.estado == Recarga.Estados.PENDIENTE:
-            # Lógica para encontrar agente disponible
-            agente = Agente.objects.filter(activo=True).first()
+            agente = AsignadorAgentes().siguiente(
+                agencia_id=agencia_id or recarga.datos_pago.get('agencia'),
+                ciudad=ciudad or recarga.datos_pago.get('ciudad')
+            )
             if agente:
                 recarga.procesar(agente)
                 logger.info(f"Recarga {recarga.referencia} procesada por agente {agente.codigo_agente}")
                 return True
     except Exception as e:
         logger.error(f"Error procesando recarga {recarga_id}: {str(e)}")
-        self.retry(exc=e, countdown=60)
\ No newline at end of file
+        self.retry(exc=e, countdown=60)
+
+@shared_task(bind=True, max_retries=5)
+def guardar_auditorias(self, modelo, registros):
+    """
+    Inserta en bloque registros de auditoría recolectados por
+    RecolectorAuditoria en modo asíncrono
+    """
+    try:
+        Modelo = apps.get_model(modelo)
+        Modelo.objects.bulk_create([Modelo(**registro) for registro in registros], batch_size=500)
+        return len(registros)
+    except Exception as e:
+        logger.error(f"Error guardando {len(registros)} auditorías de {modelo}: {str(e)}")
+        self.retry(exc=e, countdown=30)
+
+
+@shared_task(bind=True, max_retries=3)
+def archivar_auditorias(self, meses_activos=3, tamano_bloque=5000):
+    """
+    Mueve a ArchivoAuditoria, en bloques comprimidos, los registros de
+    auditoría de meses cerrados anteriores a los últimos meses_activos.
+    Cada bloque se archiva y se borra de la tabla activa en su propia
+    transacción, así que la tarea puede interrumpirse y reanudarse.
+    Desde entonces esos registros solo se leen con ArchivoAuditoria.leer().
+    """
+    limite_fecha = inicio_mes(timezone.localdate(), -meses_activos)
+    limite = timezone.make_aware(datetime.combine(limite_fecha, datetime.min.time()))
+    archivados = 0
+
+    try:
+        for etiqueta in ArchivoAuditoria.MODELOS:
+            Modelo = apps.get_model(etiqueta)
+            while True:
+                with transaction.atomic():
+                    primera = Modelo.objects.filter(fecha__lt=limite).order_by('fecha').values_list('fecha', flat=True).first()
+                    if primera is None:
+                        break
+
+                    mes = inicio_mes(timezone.localtime(primera).date())
+                    fin_mes = min(
+                        timezone.make_aware(datetime.combine(inicio_mes(mes, 1), datetime.min.time())),
+                        limite
+                    )
+                    ids = list(
+                        Modelo.objects.select_for_update(skip_locked=True)
+                        .filter(fecha__lt=fin_mes)
+                        .order_by('id')
+                        .values_list('id', flat=True)[:tamano_bloque]
+                    )
+                    if not ids:
+                        break
+
+                    filas = list(Modelo.objects.filter(id__in=ids).order_by('id').values())
+                    ArchivoAuditoria.archivar(etiqueta, mes, filas)
+                    Modelo.objects.filter(id__in=ids).delete()
+                    archivados += len(filas)
+
+        logger.info(f"Archivados {archivados} registros de auditoría anteriores a {limite_fecha}")
+        return archivados
+    except Exception as e:
+        logger.error(f"Error archivando auditorías: {str(e)}")
+        self.retry(exc=e, countdown=300)
+
+
+@shared_task(bind=True, max_retries=3)
+def consolidar_saldos_diarios(self, fecha=None, dias=1):
+    """
+    Genera las fotos de SaldoDiario de los `dias` días que terminan en
+    `fecha` (ISO, por defecto ayer). Recalcular un día ya consolidado
+    sobrescribe sus filas, así que sirve también para rellenar huecos.
+    """
+    ultimo = date.fromisoformat(fecha) if fecha else timezone.localdate() - timedelta(days=1)
+    try:
+        total = 0
+        for desplazamiento in range(dias - 1, -1, -1):
+            total += SaldoDiario.consolidar(ultimo - timedelta(days=desplazamiento))
+        logger.info(f"Consolidadas {total} fotos de saldo hasta {ultimo}")
+        return total
+    except Exception as e:
+        logger.error(f"Error consolidando saldos diarios: {str(e)}")
+        self.retry(exc=e, countdown=300)
+
+
+@shared_task(bind=True, max_retries=3)
+def conciliar_metricas_dashboard(self, dias_diarios=7):
+    """
+    Corrige la deriva de MetricaDashboard frente a las tablas de origen y
+    elimina los contadores diarios de más de `dias_diarios` días
+    """
+    try:
+        derivas = MetricaDashboard.conciliar()
+        for (clave, fecha), deriva in derivas.items():
+            logger.warning(f"Métrica {clave} {fecha or ''} corregida en {deriva}")
+
+        MetricaDashboard.objects.filter(
+            fecha__lt=timezone.localdate() - timedelta(days=dias_diarios)
+        ).delete()
+        return len(derivas)
+    except Exception as e:
+        logger.error(f"Error conciliando métricas del dashboard: {str(e)}")
+        self.retry(exc=e, countdown=300)
+
+
+@shared_task
+def conciliar_libro_mayor(tamano_rango=10000):
+    """
+    Concilia los saldos con el libro mayor repartiendo los rangos de ids
+    entre los workers (una tarea conciliar_rango_libro por rango). Si la
+    ejecución anterior no terminó se reanudan solo sus rangos pendientes.
+    """
+    conciliacion = ConciliacionLibro.reanudar_o_iniciar(tamano_rango)
+    pendientes = list(conciliacion.rangos_pendientes())
+    for pk in pendientes:
+        conciliar_rango_libro.delay(pk)
+    logger.info(f"Conciliación {conciliacion.pk}: encolados {len(pendientes)} rangos")
+    return len(pendientes)
+
+
+@shared_task(bind=True, max_retries=3)
+def conciliar_rango_libro(self, rango_id):
+    """Concilia un rango de monederos (ver RangoConciliacion.conciliar)"""
+    try:
+        encontradas = RangoConciliacion(pk=rango_id).conciliar()
+        if encontradas:
+            logger.warning(f"Rango de conciliación {rango_id}: {encontradas} discrepancias")
+        return encontradas
+    except Exception as e:
+        logger.error(f"Error conciliando rango {rango_id}: {str(e)}")
+        self.retry(exc=e, countdown=60)
+
+
+@shared_task(bind=True, max_retries=3)
+def despachar_eventos_monedero(self, tamano_lote=500, max_lotes=20):
+    """
+    Relay de la bandeja de salida: consume EventoMonedero por lotes (ver
+    EventoMonedero.despachar) hasta vaciarla o agotar max_lotes
+    """
+    total = 0
+    try:
+        for _ in range(max_lotes):
+            reclamados = EventoMonedero.despachar(tamano_lote)
+            total += reclamados
+            if reclamados < tamano_lote:
+                break
+        return total
+    except Exception as e:
+        logger.error(f"Error despachando eventos del monedero: {str(e)}")
+        self.retry(exc=e, countdown=30)
+
+
+@shared_task
+def purgar_eventos_monedero(dias=7):
+    """Elimina los eventos ya procesados de más de `dias` días"""
+    borrados, _ = EventoMonedero.objects.filter(
+        procesado=True,
+        fecha_procesado__lt=timezone.now() - timedelta(days=dias)
+    ).delete()
+    logger.info(f"Purgados {borrados} eventos del monedero")
+    return borrados
+
+
+@shared_task(bind=True, max_retries=3)
+def notificar_masivo_async(self, titulo, mensaje, tipo, importante=False, metadata=None, solo_activos=True,
+                           desde_id=0, tamano_bloque=5000, bloques_por_tarea=50):
+    """
+    Inserta un aviso para cada usuario recorriendo sus ids por bloques;
+    cada bloque es un INSERT en su propia transacción. Tras
+    bloques_por_tarea bloques se encola la continuación para no ocupar un
+    worker durante todo el envío, y los reintentos siguen desde el último
+    bloque confirmado.
+    """
+    usuarios = get_user_model().objects.order_by('pk')
+    if solo_activos:
+        usuarios = usuarios.filter(is_active=True)
+    argumentos = {
+        'titulo': titulo, 'mensaje': mensaje, 'tipo': tipo, 'importante': importante,
+        'metadata': metadata or {}, 'solo_activos': solo_activos,
+        'tamano_bloque': tamano_bloque, 'bloques_por_tarea': bloques_por_tarea
+    }
+
+    ultimo = desde_id
+    try:
+        for _ in range(bloques_por_tarea):
+            ids = list(usuarios.filter(pk__gt=ultimo).values_list('pk', flat=True)[:tamano_bloque])
+            if not ids:
+                break
+            with transaction.atomic():
+                # 'masivo' deja estas filas fuera de la reposición del canal SSE
+                Notificacion.insertar_bloque(
+                    ids, tipo=tipo, titulo=titulo, mensaje=mensaje,
+                    metadata={**(metadata or {}), 'masivo': True}, importante=importante,
+                    tarea_celery=self.request.id
+                )
+            if not ultimo:
+                # Un único mensaje en el canal global tras confirmar el primer bloque
+                publicar_aviso_global({
+                    'tipo': tipo, 'titulo': titulo, 'mensaje': mensaje,
+                    'importante': importante, 'metadata': metadata or {}
+                })
+            ultimo = ids[-1]
+            if len(ids) < tamano_bloque:
+                break
+        else:
+            notificar_masivo_async.delay(desde_id=ultimo, **argumentos)
+        logger.info(f"Aviso masivo '{titulo}' enviado hasta el usuario {ultimo}")
+        return ultimo
+    except Exception as e:
+        logger.error(f"Error en aviso masivo '{titulo}' tras el usuario {ultimo}: {str(e)}")
+        self.retry(exc=e, countdown=60, args=(), kwargs={**argumentos, 'desde_id': ultimo})
+
+
+@shared_task
+def purgar_claves_idempotencia():
+    """Elimina las claves de idempotencia cuya respuesta ya no se conserva"""
+    borradas, _ = ClaveIdempotencia.objects.filter(
+        fecha_creacion__lt=timezone.now() - VIGENCIA_IDEMPOTENCIA
+    ).delete()
+    logger.info(f"Purgadas {borradas} claves de idempotencia")
+    return borradas
+
+
+@shared_task(bind=True, max_retries=3)
+def expirar_retenciones(self, tamano_lote=1000, max_lotes=200):
+    """
+    Libera las retenciones ACTIVA expiradas por lotes; cada lote es una
+    transacción independiente (ver TransaccionRetenida.expirar_vencidas).
+    Se sigue mientras los lotes salgan llenos, aunque parte de ellos quede
+    aplazada en lugar de liberada.
+    """
+    total = 0
+    try:
+        for _ in range(max_lotes):
+            reclamadas, liberadas = TransaccionRetenida.expirar_vencidas(tamano_lote)
+            total += liberadas
+            if reclamadas < tamano_lote:
+                break
+        if total:
+            logger.info(f"Liberadas {total} retenciones expiradas")
+        return total
+    except Exception as e:
+        logger.error(f"Error liberando retenciones expiradas: {str(e)}")
+        self.retry(exc=e, countdown=60)
+
+
+@shared_task(bind=True)
+def generar_reporte_async(self, reporte_id):
+    """
+    Genera el archivo de un Reporte en streaming (ver Reporte.generar) e
+    informa del avance como estado PROGRESS de la tarea
+    """
+    reporte = Reporte.objects.get(pk=reporte_id)
+
+    def progreso(filas):
+        self.update_state(state='PROGRESS', meta={'reporte': reporte_id, 'registros': filas})
+
+    try:
+        reporte.generar(progreso=progreso)
+        logger.info(f"Reporte {reporte_id} generado con {reporte.registros_procesados} registros")
+        return reporte.registros_procesados
+    except Exception as e:
+        logger.error(f"Error generando reporte {reporte_id}: {str(e)}", exc_info=True)
+        raise
@@ -1,3 +1,589 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.db.models.signals import post_init
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .admin import MonederoAdmin
+from .exceptions import LimiteDiarioExcedidoError, SaldoInsuficienteError
+from .models import (
+    ClaveIdempotencia, ConfiguracionSistema, ConsumoDiario, DashboardAdmin, EventoMonedero, MetricaDashboard,
+    Monedero, MovimientoMonedero, Notificacion, Partida, TransaccionRetenida, Transferencia
+)
+from .tasks import expirar_retenciones
+from .tiempo_real import flujo_notificaciones, publicar_notificaciones
+
+User = get_user_model()
+
+
+@skipUnless(connection.vendor == 'postgresql', "Requiere bloqueos de fila de PostgreSQL")
+class TransferenciasCruzadasTests(TransactionTestCase):
+    """
+    Lanza miles de transferencias A→B y B→A en paralelo y comprueba que
+    ninguna falla por interbloqueo y que el dinero se conserva.
+    """
+    TOTAL_TRANSFERENCIAS = 2000
+    HILOS = 8
+
+    def setUp(self):
+        config = ConfiguracionSistema.cargar()
+        config.limite_transferencia_diaria = Decimal('9999999999.99')
+        config.max_operaciones_diarias = 1000000
+        config.save()
+
+        self.usuario_a = User.objects.create_user(username='cruce_a', password='x')
+        self.usuario_b = User.objects.create_user(username='cruce_b', password='x')
+        for usuario in (self.usuario_a, self.usuario_b):
+            Monedero.objects.get(usuario=usuario).actualizar_saldo(Decimal('50000000.00'), motivo='Fondos de prueba')
+
+    def test_transferencias_cruzadas_sin_interbloqueos(self):
+        pares = [(self.usuario_a, self.usuario_b), (self.usuario_b, self.usuario_a)]
+        ids = [
+            Transferencia.objects.create(
+                emisor=pares[i % 2][0],
+                receptor=pares[i % 2][1],
+                cantidad=Decimal('5000.00')
+            ).pk
+            for i in range(self.TOTAL_TRANSFERENCIAS)
+        ]
+        errores = []
+
+        def procesar_lote(lote):
+            try:
+                for pk in lote:
+                    try:
+                        Transferencia.objects.get(pk=pk).procesar()
+                    except Exception as e:
+                        errores.append(str(e))
+            finally:
+                connections.close_all()
+
+        hilos = [
+            threading.Thread(target=procesar_lote, args=(ids[i::self.HILOS],))
+            for i in range(self.HILOS)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        self.assertEqual(
+            Transferencia.objects.filter(estado=Transferencia.Estados.COMPLETADA).count(),
+            self.TOTAL_TRANSFERENCIAS
+        )
+
+        saldos = Monedero.objects.filter(
+            usuario__in=[self.usuario_a, self.usuario_b]
+        ).values_list('saldo', flat=True)
+        comisiones = sum(
+            MovimientoMonedero.objects.filter(
+                cuenta=MovimientoMonedero.Cuentas.COMISIONES
+            ).values_list('monto', flat=True)
+        )
+        self.assertEqual(sum(saldos) + comisiones, Decimal('100000000.00'))
+
+
+def _usuario(nombre, saldo=None):
+    usuario = User.objects.create_user(username=nombre, password='x')
+    if saldo:
+        Monedero.objects.get(usuario=usuario).actualizar_saldo(Decimal(saldo), motivo='Fondos de prueba')
+    return usuario
+
+
+def _saldo(usuario):
+    return Monedero.objects.get(usuario=usuario).saldo
+
+
+class LibroMayorTests(TestCase):
+    """Asientos de MovimientoMonedero.contabilizar y su efecto en los saldos"""
+
+    def setUp(self):
+        self.monedero = Monedero.objects.get(usuario=_usuario('libro'))
+
+    def test_asiento_descuadrado_se_rechaza(self):
+        with self.assertRaises(ValidationError):
+            MovimientoMonedero.contabilizar('PRUEBA', [
+                Partida(MovimientoMonedero.Cuentas.AJUSTES, MovimientoMonedero.Tipos.DEBITO, Decimal('10.00')),
+                Partida(MovimientoMonedero.Cuentas.DISPONIBLE, MovimientoMonedero.Tipos.CREDITO,
+                        Decimal('5.00'), self.monedero),
+            ])
+        self.assertFalse(MovimientoMonedero.objects.exists())
+
+    def test_saldos_se_derivan_del_libro(self):
+        self.monedero.actualizar_saldo(Decimal('1000.00'))
+        self.monedero.actualizar_saldo(Decimal('300.00'), retener=True)
+        self.monedero.refresh_from_db()
+        self.assertEqual(self.monedero.saldo, Decimal('1000.00'))
+        self.assertEqual(self.monedero.saldo_retenido, Decimal('300.00'))
+
+        def neto(movimientos):
+            return sum(m.monto if m.tipo == MovimientoMonedero.Tipos.CREDITO else -m.monto for m in movimientos)
+
+        movimientos = list(MovimientoMonedero.objects.all())
+        propios = [m for m in movimientos if m.monedero_id == self.monedero.pk]
+        self.assertEqual(neto(propios), self.monedero.saldo)
+        self.assertEqual(
+            neto(m for m in propios if m.cuenta == MovimientoMonedero.Cuentas.RETENIDO),
+            self.monedero.saldo_retenido
+        )
+        for asiento in {m.asiento for m in movimientos}:
+            self.assertEqual(neto(m for m in movimientos if m.asiento == asiento), 0)
+
+    def test_debito_sin_saldo_no_toca_el_monedero(self):
+        self.monedero.actualizar_saldo(Decimal('100.00'))
+        with self.assertRaises(SaldoInsuficienteError):
+            self.monedero.actualizar_saldo(Decimal('-150.00'))
+        self.monedero.refresh_from_db()
+        self.assertEqual(self.monedero.saldo, Decimal('100.00'))
+        self.assertEqual(MovimientoMonedero.objects.count(), 2)
+
+    def test_admin_ajusta_el_saldo_con_un_asiento(self):
+        modelo_admin = MonederoAdmin(Monedero, admin.site)
+        request = RequestFactory().post('/', {'action': 'ajustar_saldo', 'monto': '250.00', 'motivo': 'Compensación'})
+        request.user = User.objects.create_superuser('admin', password='x')
+        request._messages = CookieStorage(request)
+        self.assertIn('saldo', modelo_admin.get_readonly_fields(request, self.monedero))
+        self.assertIn('saldo_retenido', modelo_admin.get_readonly_fields(request, self.monedero))
+
+        modelo_admin.ajustar_saldo(request, Monedero.objects.filter(pk=self.monedero.pk))
+        self.monedero.refresh_from_db()
+        self.assertEqual(self.monedero.saldo, Decimal('250.00'))
+        self.assertEqual(
+            MovimientoMonedero.objects.get(monedero=self.monedero).referencia, 'Compensación'
+        )
+
+
+class ConsumoDiarioTests(TestCase):
+    """Límites diarios comprobados contra el acumulado de ConsumoDiario"""
+
+    def setUp(self):
+        self.usuario = _usuario('consumo')
+
+    def consumir(self, monto, limite_monto=Decimal('500.00'), limite_operaciones=10,
+                 operacion=ConsumoDiario.Operaciones.TRANSFERENCIA):
+        ConsumoDiario.consumir(self.usuario.pk, operacion, Decimal(monto), limite_monto, limite_operaciones)
+
+    def test_acumula_el_dia_en_una_fila(self):
+        self.consumir('100.00')
+        self.consumir('150.00')
+        consumo = ConsumoDiario.objects.get(usuario=self.usuario)
+        self.assertEqual(consumo.total_transferido, Decimal('250.00'))
+        self.assertEqual((consumo.transferencias, consumo.recargas), (2, 0))
+
+    def test_limite_de_monto(self):
+        self.consumir('400.00')
+        with self.assertRaisesMessage(LimiteDiarioExcedidoError, "Límite diario de transferencias excedido"):
+            self.consumir('200.00')
+        self.assertEqual(ConsumoDiario.objects.get(usuario=self.usuario).total_transferido, Decimal('400.00'))
+
+    def test_limite_de_operaciones(self):
+        self.consumir('10.00', limite_operaciones=1)
+        with self.assertRaisesMessage(LimiteDiarioExcedidoError, "Número máximo de operaciones diarias excedido"):
+            self.consumir('10.00', limite_operaciones=1)
+
+    def test_recargas_no_consumen_operaciones_de_transferencia(self):
+        self.consumir('10.00', limite_operaciones=1, operacion=ConsumoDiario.Operaciones.RECARGA)
+        self.consumir('10.00', limite_operaciones=1)
+        consumo = ConsumoDiario.objects.get(usuario=self.usuario)
+        self.assertEqual((consumo.transferencias, consumo.recargas), (1, 1))
+        self.assertEqual((consumo.total_transferido, consumo.total_recargado), (Decimal('10.00'), Decimal('10.00')))
+
+    @override_settings(TIME_ZONE='Pacific/Kiritimati')
+    def test_dia_en_hora_local(self):
+        self.consumir('10.00')
+        self.assertEqual(ConsumoDiario.objects.get(usuario=self.usuario).fecha, timezone.localdate())
+
+
+class PagoMasivoBase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.emisor = _usuario('pagador', saldo='100000.00')
+        self.receptores = [_usuario('cobrador1'), _usuario('cobrador2')]
+        self.client = APIClient()
+        self.client.force_authenticate(self.emisor)
+        self.url = reverse('transferencias-masiva')
+
+    def csv(self, contenido, nombre='pagos.csv'):
+        return SimpleUploadedFile(nombre, contenido.encode(), content_type='text/csv')
+
+
+class PagoMasivoTests(PagoMasivoBase):
+    """Transferencia.procesar_lote y la carga del lote por CSV"""
+
+    def test_cada_item_se_acepta_o_rechaza_por_separado(self):
+        lote, resultados = Transferencia.procesar_lote(self.emisor, [
+            {'receptor': 'cobrador1', 'cantidad': '10000'},
+            {'receptor': 'nadie', 'cantidad': '10000'},
+            {'receptor': 'pagador', 'cantidad': '10000'},
+            {'receptor': 'cobrador2', 'cantidad': '500'},
+            {'receptor': 'cobrador2', 'cantidad': '95000'},
+        ])
+
+        self.assertEqual([r['estado'] for r in resultados], [
+            Transferencia.Estados.COMPLETADA, 'RECHAZADA', 'RECHAZADA', 'RECHAZADA', Transferencia.Estados.FALLIDA
+        ])
+        # 10000 más la comisión mínima de 100
+        self.assertEqual(_saldo(self.emisor), Decimal('89900.00'))
+        self.assertEqual(_saldo(self.receptores[0]), Decimal('10000.00'))
+        self.assertEqual(_saldo(self.receptores[1]), Decimal('0.00'))
+        self.assertEqual(Transferencia.objects.filter(metadata__lote=str(lote)).count(), 2)
+        consumo = ConsumoDiario.objects.get(usuario=self.emisor)
+        self.assertEqual((consumo.total_transferido, consumo.transferencias), (Decimal('10000.00'), 1))
+
+    def test_csv_por_api(self):
+        respuesta = self.client.post(
+            self.url, {'archivo': self.csv("receptor,cantidad\ncobrador1,6000\ncobrador2,7000\n")},
+            format='multipart'
+        )
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual((respuesta.data['total'], respuesta.data['completadas']), (2, 2))
+        self.assertEqual(_saldo(self.receptores[1]), Decimal('7000.00'))
+
+    def test_csv_sin_columnas_obligatorias(self):
+        respuesta = self.client.post(self.url, {'archivo': self.csv("usuario,monto\ncobrador1,6000\n")}, format='multipart')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(Transferencia.objects.exists())
+
+
+class PaginacionCursorTests(TestCase):
+    """KeysetPagination sobre el historial de notificaciones"""
+
+    def setUp(self):
+        self.usuario = _usuario('lector')
+        for i in range(25):
+            Notificacion.objects.create(
+                usuario=self.usuario, tipo=Notificacion.Tipos.SISTEMA, titulo=f"Aviso {i}", mensaje="x"
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        self.url = reverse('notificaciones-list')
+
+    def ids(self, respuesta):
+        return [n['id'] for n in respuesta.data['results']]
+
+    def test_recorre_todas_las_paginas_sin_repetir(self):
+        ids, url = [], f"{self.url}?page_size=10"
+        while url:
+            respuesta = self.client.get(url)
+            self.assertEqual(respuesta.status_code, 200)
+            ids += self.ids(respuesta)
+            url = respuesta.data['next']
+
+        esperados = list(
+            Notificacion.objects.filter(usuario=self.usuario).order_by('-fecha', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, esperados)
+
+    def test_enlace_anterior_devuelve_la_misma_pagina(self):
+        primera = self.client.get(f"{self.url}?page_size=10&ordering=fecha")
+        segunda = self.client.get(primera.data['next'])
+        anterior = self.client.get(segunda.data['previous'])
+        self.assertEqual(self.ids(anterior), self.ids(primera))
+        self.assertEqual(self.ids(primera), sorted(self.ids(primera)))
+
+    def test_orden_no_admitido(self):
+        self.assertEqual(self.client.get(f"{self.url}?ordering=titulo").status_code, 400)
+
+    def test_filas_con_la_misma_fecha(self):
+        # El cursor lleva (fecha, id): los empates se resuelven por id, sin desplazamiento
+        Notificacion.objects.filter(usuario=self.usuario).update(fecha=timezone.now())
+        ids, url = [], f"{self.url}?page_size=7"
+        while url:
+            respuesta = self.client.get(url)
+            ids += self.ids(respuesta)
+            url = respuesta.data['next']
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(len(ids), 25)
+
+    def test_cursor_invalido(self):
+        self.assertEqual(self.client.get(f"{self.url}?cursor=no-es-un-cursor").status_code, 404)
+
+    def test_orden_por_cantidad(self):
+        emisor = _usuario('ordenado', saldo='100000.00')
+        for cantidad in ('9000', '6000', '7000', '6000'):
+            Transferencia.procesar_lote(emisor, [{'receptor': 'lector', 'cantidad': cantidad}])
+        self.client.force_authenticate(emisor)
+
+        primera = self.client.get(f"{reverse('transferencias-list')}?ordering=cantidad&page_size=3")
+        self.assertEqual(primera.status_code, 200)
+        segunda = self.client.get(primera.data['next'])
+        cantidades = [Decimal(t['cantidad']) for t in primera.data['results'] + segunda.data['results']]
+        self.assertEqual(cantidades, [Decimal(c) for c in ('6000', '6000', '7000', '9000')])
+        anterior = self.client.get(segunda.data['previous'])
+        self.assertEqual(anterior.data['results'], primera.data['results'])
+
+
+class DespachoProgramadasTests(TestCase):
+    """Transferencia.reclamar_vencidas: margen de reintento y tope de reclamos"""
+
+    def setUp(self):
+        self.transferencia = Transferencia.objects.create(
+            emisor=_usuario('programa'), receptor=_usuario('espera'), cantidad=Decimal('5000.00'),
+            estado=Transferencia.Estados.PROGRAMADA, fecha_programada=timezone.now() - timedelta(days=1)
+        )
+
+    def test_reintenta_solo_tras_el_margen_desde_el_reclamo(self):
+        self.assertEqual(Transferencia.reclamar_vencidas(), [self.transferencia.pk])
+        self.assertEqual(Transferencia.reclamar_vencidas(), [])
+
+        for _ in range(Transferencia.MAX_INTENTOS_DESPACHO - 1):
+            Transferencia.objects.filter(pk=self.transferencia.pk).update(
+                fecha_reclamo=timezone.now() - timedelta(minutes=11)
+            )
+            self.assertEqual(Transferencia.reclamar_vencidas(), [self.transferencia.pk])
+
+        Transferencia.objects.filter(pk=self.transferencia.pk).update(
+            fecha_reclamo=timezone.now() - timedelta(minutes=11)
+        )
+        self.assertEqual(Transferencia.reclamar_vencidas(), [])
+        self.transferencia.refresh_from_db()
+        self.assertEqual(self.transferencia.estado, Transferencia.Estados.FALLIDA)
+        self.assertEqual(self.transferencia.intentos_despacho, Transferencia.MAX_INTENTOS_DESPACHO)
+
+
+class IdempotenciaTests(PagoMasivoBase):
+    """Cabecera Idempotency-Key en el pago masivo"""
+
+    def pagar(self, clave, cantidad='6000'):
+        return self.client.post(
+            self.url, {'transferencias': [{'receptor': 'cobrador1', 'cantidad': cantidad}]},
+            format='json', HTTP_IDEMPOTENCY_KEY=clave
+        )
+
+    def test_repeticion_devuelve_la_respuesta_guardada(self):
+        primera = self.pagar('clave-1')
+        segunda = self.pagar('clave-1')
+        self.assertEqual(primera.status_code, 201)
+        self.assertEqual(segunda.status_code, 201)
+        self.assertEqual(segunda['Idempotent-Replayed'], 'true')
+        self.assertEqual(segunda.data['lote'], primera.data['lote'])
+        self.assertEqual(Transferencia.objects.count(), 1)
+
+    def test_repeticion_tras_expirar_la_cache(self):
+        primera = self.pagar('clave-1')
+        cache.clear()
+        segunda = self.pagar('clave-1')
+        self.assertEqual(segunda.data['lote'], primera.data['lote'])
+        self.assertEqual(Transferencia.objects.count(), 1)
+
+    def test_misma_clave_con_otro_contenido(self):
+        self.pagar('clave-1')
+        self.assertEqual(self.pagar('clave-1', cantidad='7000').status_code, 422)
+        self.assertEqual(Transferencia.objects.count(), 1)
+
+    def test_misma_clave_con_otro_csv_del_mismo_nombre(self):
+        def pagar_csv(contenido):
+            return self.client.post(
+                self.url, {'archivo': self.csv(contenido)}, format='multipart', HTTP_IDEMPOTENCY_KEY='clave-csv'
+            )
+
+        self.assertEqual(pagar_csv("receptor,cantidad\ncobrador1,6000\n").status_code, 201)
+        self.assertEqual(pagar_csv("receptor,cantidad\ncobrador2,9000\n").status_code, 422)
+        self.assertEqual(_saldo(self.receptores[1]), Decimal('0.00'))
+
+    def test_clave_en_curso(self):
+        ClaveIdempotencia.objects.create(
+            usuario=self.emisor, endpoint='transferencias_masiva', clave='clave-1', huella='otra'
+        )
+        respuesta = self.pagar('clave-1')
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertFalse(Transferencia.objects.exists())
+
+
+class BandejaEventosTests(TestCase):
+    """Despacho de EventoMonedero: efectos derivados y reintentos"""
+
+    def setUp(self):
+        self.emisor = _usuario('origen', saldo='50000.00')
+        self.receptor = _usuario('destino')
+
+    def test_despacho_notifica_y_marca_procesado(self):
+        transferencia = Transferencia.objects.create(
+            emisor=self.emisor, receptor=self.receptor, cantidad=Decimal('5000.00')
+        )
+        transferencia.procesar()
+        self.assertFalse(Notificacion.objects.exists())
+
+        self.assertEqual(EventoMonedero.despachar(), 1)
+        self.assertTrue(EventoMonedero.objects.get().procesado)
+        self.assertEqual(
+            set(Notificacion.objects.values_list('usuario_id', flat=True)),
+            {self.emisor.pk, self.receptor.pk}
+        )
+        self.assertEqual(EventoMonedero.despachar(), 0)
+
+    def test_evento_fallido_se_reintenta_y_se_descarta(self):
+        monedero = Monedero.objects.get(usuario=self.receptor)
+        correcto = EventoMonedero.publicar(
+            EventoMonedero.Tipos.RETENCION_LIBERADA, retencion=1, usuario=self.receptor.pk,
+            monto='10.00', accion='EXPIRACION', monederos=[monedero.pk]
+        )
+        # Sin monto: _aplicar falla con este evento
+        roto = EventoMonedero.publicar(EventoMonedero.Tipos.RETENCION_LIBERADA, usuario=self.receptor.pk)
+
+        EventoMonedero.despachar()
+        correcto.refresh_from_db()
+        roto.refresh_from_db()
+        self.assertTrue(correcto.procesado)
+        self.assertEqual(Notificacion.objects.filter(usuario=self.receptor).count(), 1)
+        self.assertFalse(roto.procesado)
+        self.assertEqual(roto.intentos, 1)
+        self.assertTrue(roto.error)
+
+        for _ in range(EventoMonedero.MAX_INTENTOS - 1):
+            EventoMonedero.despachar()
+        roto.refresh_from_db()
+        self.assertEqual(roto.intentos, EventoMonedero.MAX_INTENTOS)
+        self.assertEqual(EventoMonedero.despachar(), 0)
+
+
+class ContadorNoLeidasTests(TestCase):
+    """El contador cacheado de no leídas sigue a la tabla sin recontar"""
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = _usuario('avisado')
+
+    def nueva(self, **campos):
+        return Notificacion(usuario=self.usuario, tipo=Notificacion.Tipos.SISTEMA, titulo="Aviso", mensaje="x", **campos)
+
+    def assertContador(self, esperado):
+        self.assertEqual(Notificacion.objects.filter(usuario=self.usuario, leida=False).count(), esperado)
+        self.assertEqual(Notificacion.contar_no_leidas(self.usuario.pk), esperado)
+
+    def test_contador_no_deriva(self):
+        self.assertContador(0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            primera = self.nueva()
+            primera.save()
+            self.nueva(leida=True).save()
+        # Incrementado en caché, no recontado
+        self.assertEqual(cache.get(Notificacion._clave_no_leidas(self.usuario.pk)), 1)
+        self.assertContador(1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notificacion.guardar_lote([self.nueva() for _ in range(3)])
+        self.assertContador(4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Notificacion.marcar_leidas(self.usuario.pk, ids=[primera.pk]), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Notificacion.marcar_leidas(self.usuario.pk, ids=[primera.pk]), 0)
+        self.assertContador(3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ultima = Notificacion.objects.filter(usuario=self.usuario, leida=False).last()
+            ultima.leida = True
+            ultima.save()
+        self.assertContador(2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notificacion.marcar_leidas(self.usuario.pk)
+        self.assertContador(0)
+
+
+@override_settings(MONEDERO_SSE_DURACION=5, MONEDERO_SSE_LATIDO=0.05)
+class CanalNotificacionesTests(TransactionTestCase):
+    """Generador SSE de tiempo_real sobre BrokerMemoria y la vista stream"""
+
+    def setUp(self):
+        self.usuario = _usuario('suscrito')
+
+    def crear(self, **campos):
+        return Notificacion.objects.create(
+            usuario=self.usuario, tipo=Notificacion.Tipos.SISTEMA, titulo="Aviso", mensaje="x", **campos
+        )
+
+    def test_reenvia_pendientes_y_recibe_publicaciones(self):
+        pendiente = self.crear()
+        flujo = flujo_notificaciones(
+            self.usuario.pk, lambda: Notificacion.objects.filter(usuario=self.usuario).order_by('pk')
+        )
+        try:
+            self.assertTrue(next(flujo).startswith('retry:'))
+            self.assertIn(f"id: {pendiente.pk}\n", next(flujo))
+
+            nueva = self.crear()
+            evento = next(flujo)
+            self.assertIn(f"id: {nueva.pk}\n", evento)
+            self.assertIn("event: notificacion", evento)
+
+            publicar_notificaciones([Notificacion(pk=0, usuario_id=self.usuario.pk + 1, tipo='SISTEMA',
+                                                  titulo="Ajena", mensaje="x", fecha=timezone.now())])
+            self.assertEqual(next(flujo), ": latido\n\n")
+        finally:
+            flujo.close()
+
+    def test_vista_desactivada_por_defecto(self):
+        cliente = APIClient()
+        cliente.force_authenticate(self.usuario)
+        self.assertEqual(cliente.get(reverse('notificaciones-stream')).status_code, 404)
+
+    @override_settings(MONEDERO_SSE_ACTIVO=True, MONEDERO_SSE_DURACION=0)
+    def test_reconexion_no_repite_avisos_masivos(self):
+        vista = self.crear()
+        normal = self.crear()
+        masiva = self.crear(metadata={'masivo': True})
+        cliente = APIClient()
+        cliente.force_authenticate(self.usuario)
+
+        respuesta = cliente.get(reverse('notificaciones-stream'), HTTP_LAST_EVENT_ID=str(vista.pk))
+        self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+        contenido = b''.join(respuesta.streaming_content).decode()
+        self.assertIn(f"id: {normal.pk}\n", contenido)
+        self.assertNotIn(f"id: {masiva.pk}\n", contenido)
+        self.assertNotIn(f"id: {vista.pk}\n", contenido)
+
+
+class RetencionesExpiradasTests(TestCase):
+    """Barrido de retenciones expiradas con monederos que no cuadran"""
+
+    def setUp(self):
+        self.usuarios = [_usuario('retenido1', saldo='1000.00'), _usuario('retenido2', saldo='1000.00')]
+        for i, usuario in enumerate(self.usuarios):
+            Monedero.objects.get(usuario=usuario).actualizar_saldo(Decimal('100.00'), retener=True)
+            TransaccionRetenida.objects.create(
+                usuario=usuario, monto=Decimal('100.00'), motivo="Pedido",
+                fecha_expiracion=timezone.now() - timedelta(hours=2 - i)
+            )
+
+    def test_aplazada_no_corta_el_barrido(self):
+        # La primera en expirar es de un monedero sin saldo retenido
+        Monedero.objects.filter(usuario=self.usuarios[0]).update(saldo_retenido=Decimal('0.00'))
+
+        self.assertEqual(expirar_retenciones(tamano_lote=1), 1)
+        aplazada, liberada = TransaccionRetenida.objects.order_by('fecha_expiracion')
+        self.assertEqual(aplazada.estado, TransaccionRetenida.Estados.ACTIVA)
+        self.assertIsNotNone(aplazada.reintentar_expiracion)
+        self.assertEqual(liberada.estado, TransaccionRetenida.Estados.LIBERADA)
+        self.assertEqual(Monedero.objects.get(usuario=self.usuarios[1]).saldo_retenido, Decimal('0.00'))
+
+
+class MetricasDashboardTests(TestCase):
+    """Contadores de MetricaDashboard derivados en la conciliación"""
+
+    def test_usuarios_activos_se_fijan_al_conciliar(self):
+        self.assertFalse(post_init.has_listeners(User))
+        usuarios = [_usuario(f'metrica{i}') for i in range(3)]
+        usuarios[0].is_active = False
+        usuarios[0].save()
+
+        derivas = MetricaDashboard.conciliar()
+        self.assertNotIn((MetricaDashboard.Claves.USUARIOS_ACTIVOS, None), derivas)
+        estadisticas = DashboardAdmin.obtener_estadisticas()
+        self.assertEqual(estadisticas['usuarios_activos'], 2)
+        self.assertEqual(estadisticas['total_usuarios'], 3)
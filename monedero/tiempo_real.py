@@ -0,0 +1,214 @@
+# monedero/tiempo_real.py
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+CANAL_GLOBAL = "monedero:notificaciones:todos"
+# Mensajes pendientes por suscriptor en el broker en memoria antes de descartar
+MAX_PENDIENTES = 1000
+# Espera que EventSource aplica antes de reconectar
+REINTENTO_MS = 3000
+
+
+def canal_usuario(usuario_id):
+    return f"monedero:notificaciones:{usuario_id}"
+
+
+class BrokerMemoria:
+    """
+    Pub/sub dentro del proceso, para pruebas y desarrollo: solo reciben los
+    suscriptores del mismo proceso. Usa queue.Queue, que bajo eventlet
+    (monkey patching) cede el control en lugar de bloquear el worker.
+    """
+    def __init__(self):
+        self._suscriptores = {}
+        self._cerrojo = threading.Lock()
+
+    def publicar(self, canal, mensaje):
+        with self._cerrojo:
+            colas = list(self._suscriptores.get(canal, ()))
+        for cola in colas:
+            try:
+                cola.put_nowait(mensaje)
+            except queue.Full:
+                logger.warning(f"Suscriptor de {canal} saturado; mensaje descartado")
+
+    def publicar_lote(self, mensajes):
+        for canal, mensaje in mensajes:
+            self.publicar(canal, mensaje)
+
+    @contextmanager
+    def suscribir(self, *canales):
+        cola = queue.Queue(maxsize=MAX_PENDIENTES)
+        with self._cerrojo:
+            for canal in canales:
+                self._suscriptores.setdefault(canal, set()).add(cola)
+        try:
+            yield _SuscripcionMemoria(cola)
+        finally:
+            with self._cerrojo:
+                for canal in canales:
+                    suscriptores = self._suscriptores.get(canal)
+                    if suscriptores is not None:
+                        suscriptores.discard(cola)
+                        if not suscriptores:
+                            del self._suscriptores[canal]
+
+
+class _SuscripcionMemoria:
+    def __init__(self, cola):
+        self.cola = cola
+
+    def recibir(self, timeout):
+        try:
+            return self.cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class BrokerRedis:
+    """
+    Pub/sub sobre Redis (MONEDERO_PUBSUB_URL), compartido por todos los
+    procesos web y workers. redis-py usa sockets normales, así que bajo
+    eventlet la espera de mensajes también es cooperativa.
+    """
+    def __init__(self, url):
+        import redis
+
+        self.cliente = redis.Redis.from_url(url)
+
+    def publicar(self, canal, mensaje):
+        self.cliente.publish(canal, json.dumps(mensaje, cls=DjangoJSONEncoder))
+
+    def publicar_lote(self, mensajes):
+        pipeline = self.cliente.pipeline(transaction=False)
+        for canal, mensaje in mensajes:
+            pipeline.publish(canal, json.dumps(mensaje, cls=DjangoJSONEncoder))
+        pipeline.execute()
+
+    @contextmanager
+    def suscribir(self, *canales):
+        pubsub = self.cliente.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(*canales)
+        try:
+            yield _SuscripcionRedis(pubsub)
+        finally:
+            pubsub.close()
+
+
+class _SuscripcionRedis:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def recibir(self, timeout):
+        limite = time.monotonic() + timeout
+        while True:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return None
+            # get_message devuelve None también con los mensajes de control
+            mensaje = self.pubsub.get_message(timeout=restante)
+            if mensaje and mensaje['type'] == 'message':
+                return json.loads(mensaje['data'])
+
+
+def _evento(mensaje):
+    # Los avisos globales no tienen id: no alteran el Last-Event-ID del cliente
+    lineas = [f"id: {mensaje['id']}"] if mensaje.get('id') else []
+    lineas.append(f"event: {'notificacion' if mensaje.get('id') else 'aviso'}")
+    lineas.append("data: " + json.dumps(mensaje, cls=DjangoJSONEncoder))
+    return "\n".join(lineas) + "\n\n"
+
+
+def flujo_notificaciones(usuario_id, cargar_pendientes=None):
+    """
+    Generador de Server-Sent Events con las notificaciones del usuario y
+    los avisos globales. Se suscribe antes de leer las pendientes
+    (cargar_pendientes, p. ej. las posteriores a Last-Event-ID) para no
+    perder ninguna entre medias; el cliente descarta los ids repetidos.
+
+    Después de esa lectura suelta la conexión a la base de datos: la
+    espera es solo sobre el broker. Envía un comentario de latido cada
+    MONEDERO_SSE_LATIDO segundos y cierra tras MONEDERO_SSE_DURACION para
+    que el cliente reconecte (EventSource lo hace solo) y los workers se
+    repartan. Pensado para gunicorn con -k eventlet, donde cada conexión
+    abierta es un green thread y no ocupa un worker.
+    """
+    from django.db import connection
+
+    latido = getattr(settings, 'MONEDERO_SSE_LATIDO', 15)
+    duracion = getattr(settings, 'MONEDERO_SSE_DURACION', 300)
+
+    with obtener_broker().suscribir(canal_usuario(usuario_id), CANAL_GLOBAL) as suscripcion:
+        yield f"retry: {REINTENTO_MS}\n\n"
+        if cargar_pendientes is not None:
+            pendientes = list(cargar_pendientes())
+            connection.close()
+            for notificacion in pendientes:
+                yield _evento(mensaje_notificacion(notificacion))
+
+        fin = time.monotonic() + duracion
+        while (restante := fin - time.monotonic()) > 0:
+            mensaje = suscripcion.recibir(min(latido, restante))
+            yield _evento(mensaje) if mensaje else ": latido\n\n"
+
+
+_broker = None
+_cerrojo_broker = threading.Lock()
+
+
+def obtener_broker():
+    """
+    Broker del proceso: Redis si hay MONEDERO_PUBSUB_URL, si no el broker
+    en memoria (válido solo con un único proceso, p. ej. en pruebas)
+    """
+    global _broker
+    if _broker is None:
+        with _cerrojo_broker:
+            if _broker is None:
+                url = getattr(settings, 'MONEDERO_PUBSUB_URL', None)
+                _broker = BrokerRedis(url) if url else BrokerMemoria()
+    return _broker
+
+
+def mensaje_notificacion(notificacion):
+    return {
+        'id': notificacion.pk,
+        'tipo': notificacion.tipo,
+        'titulo': notificacion.titulo,
+        'mensaje': notificacion.mensaje,
+        'importante': notificacion.importante,
+        'metadata': notificacion.metadata,
+        'fecha': notificacion.fecha,
+    }
+
+
+def publicar_notificaciones(notificaciones):
+    """
+    Publica las notificaciones en el canal de cada usuario. Se llama al
+    confirmar la transacción; un fallo del broker no afecta a la operación
+    (el cliente las verá al reconectar con Last-Event-ID o al listar).
+    """
+    try:
+        obtener_broker().publicar_lote(
+            (canal_usuario(notificacion.usuario_id), mensaje_notificacion(notificacion))
+            for notificacion in notificaciones
+        )
+    except Exception as e:
+        logger.error(f"Error publicando {len(notificaciones)} notificaciones: {str(e)}")
+
+
+def publicar_aviso_global(mensaje):
+    """Publica un aviso masivo una sola vez para todas las conexiones abiertas"""
+    try:
+        obtener_broker().publicar(CANAL_GLOBAL, mensaje)
+    except Exception as e:
+        logger.error(f"Error publicando aviso global: {str(e)}")
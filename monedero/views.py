@@ -4,22 +4,29 @@ from multiprocessing import Value
 from django.forms import FloatField
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.response import Response
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.db.models import Q, F
 from decimal import Decimal
 from django.db.models import Sum
 from django.db.models.functions import Cast
 from django.db.models import FloatField, IntegerField, CharField
 from django.core.exceptions import SuspiciousOperation
-from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.core.exceptions import ValidationError
 from django.db.models import Func
 
 from rest_framework.pagination import PageNumberPagination
+from .pagination import KeysetPagination
+from .idempotencia import idempotente
+from .tiempo_real import flujo_notificaciones
 from .models import (
     ConfiguracionSistema,
     Agencia,
@@ -34,6 +41,7 @@ from .models import (
     DashboardAdmin,
     Reporte,
     Notificacion,
+    SaldoDiario,
     Transaccion
 )
 from .serializers import (
@@ -52,6 +60,7 @@ from .serializers import (
     NotificacionSerializer,
     TransaccionSerializer,
     TransferenciaCreateSerializer,
+    TransferenciaMasivaSerializer,
     RecargaCreateSerializer,
     PinOperacionesSerializer,
     CodigoVerificacionSerializer
@@ -78,7 +87,8 @@ class ConfiguracionSistemaViewSet(viewsets.ModelViewSet):
     http_method_names = ['get', 'put', 'patch', 'head', 'options']
 
     def get_object(self):
-        return ConfiguracionSistema.cargar()
+        # Siempre desde la base de datos: la copia en caché es compartida
+        return ConfiguracionSistema.cargar(usar_cache=False)
 
     def list(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -166,19 +176,6 @@ class AgenteViewSet(viewsets.ModelViewSet):
                 {'detail': 'Error interno del servidor'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-class SafeJsonbExtractor(Func):
-    """
-    Función segura para extraer valores numéricos de campos JSONB
-    """
-    function = 'jsonb_extract_path_text'
-    template = "CAST(%(function)s(%(expressions)s::jsonb, '%(key)s') AS numeric)"
-    output_field = FloatField()
-
-    def __init__(self, expression, key, **extra):
-        if not isinstance(key, str):
-            raise SuspiciousOperation("Key must be a string")
-        super().__init__(expression, key=key, **extra)
-
 class MonederoPagination(PageNumberPagination):
     """
     Paginación personalizada con ordenamiento por defecto
@@ -205,24 +202,6 @@ class MonederoViewSet(viewsets.ModelViewSet):
     pagination_class = MonederoPagination
     http_method_names = ['get', 'head', 'options']
 
-    def get_queryset(self):
-        """
-        Queryset con anotaciones seguras para campos JSONB
-        """
-        queryset = super().get_queryset()
-        
-        if self.request.user.is_staff:
-            try:
-                queryset = queryset.annotate(
-                    saldo_actual=SafeJsonbExtractor('auditorias__estado_posterior', 'saldo')
-                )
-            except Exception as e:
-                logger.error(f"Error en annotate: {str(e)}")
-                queryset = queryset.annotate(
-                    saldo_actual=Value(0.0, output_field=FloatField())
-                )
-        return queryset
-
     @action(detail=False, methods=['get'])
     def mi_monedero(self, request):
         """
@@ -242,66 +221,82 @@ class MonederoViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'], permission_classes=[IsAdminUser])
     def estadisticas(self, request, pk=None):
         """
-        Endpoint para estadísticas con procesamiento en Python
+        Estadísticas del saldo entre ?desde=AAAA-MM-DD y ?hasta=AAAA-MM-DD
+        (ver SaldoDiario.serie): fotos consolidadas más los días aún sin
+        consolidar calculados al vuelo, con un valor por cada día del rango.
+        El histórico se reduce a un máximo de ?puntos= tramos.
         """
         monedero = self.get_object()
-        
+
         try:
-            registros = list(AuditoriaMonedero.objects.filter(
-                monedero=monedero,
-                estado_posterior__has_key='saldo'
-            ).order_by('fecha').values('fecha', 'estado_posterior'))
-            
-            saldos = []
-            for reg in registros:
-                try:
-                    estado = reg['estado_posterior']
-                    if isinstance(estado, str):
-                        estado = json.loads(estado)
-                    saldo = float(estado.get('saldo', 0))
-                    saldos.append({
-                        'fecha': reg['fecha'].isoformat(),
-                        'saldo': saldo
-                    })
-                except (ValueError, TypeError, KeyError, json.JSONDecodeError) as e:
-                    logger.warning(f"Registro con saldo inválido: {e}")
-                    continue
-            
-            if not saldos:
+            parametro_desde = request.query_params.get('desde')
+            desde = parse_date(parametro_desde) if parametro_desde else None
+            parametro_hasta = request.query_params.get('hasta')
+            hasta = parse_date(parametro_hasta) if parametro_hasta else None
+            puntos = min(max(int(request.query_params.get('puntos', 100)), 1), 1000)
+            if ((parametro_desde and desde is None) or (parametro_hasta and hasta is None)
+                    or (desde and hasta and desde > hasta)):
+                raise ValueError
+        except ValueError:
+            return Response(
+                {'error': 'Parámetros desde, hasta o puntos no válidos'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            dias = SaldoDiario.serie(monedero, desde, hasta)
+
+            if not dias:
                 return Response({
                     'monedero_id': monedero.id,
                     'mensaje': 'No hay datos suficientes'
                 }, status=status.HTTP_404_NOT_FOUND)
-            
-            valores = [item['saldo'] for item in saldos]
+
+            # Cada tramo agrupa `paso` días: cierre del último, extremos del tramo
+            paso = -(-len(dias) // puntos)
+            historico = []
+            for inicio in range(0, len(dias), paso):
+                tramo = dias[inicio:inicio + paso]
+                historico.append({
+                    'fecha': tramo[-1][0].isoformat(),
+                    'saldo': float(tramo[-1][1]),
+                    'minimo': float(min(dia[2] for dia in tramo)),
+                    'maximo': float(max(dia[3] for dia in tramo)),
+                })
+
             response_data = {
                 'monedero_id': monedero.id,
-                'saldo_maximo': max(valores),
-                'saldo_minimo': min(valores),
-                'saldo_promedio': sum(valores) / len(valores),
-                'total_registros': len(valores),
-                'historico': saldos[-100:]  # Últimos 100 registros
+                'desde': dias[0][0].isoformat(),
+                'hasta': dias[-1][0].isoformat(),
+                'saldo_maximo': float(max(dia[3] for dia in dias)),
+                'saldo_minimo': float(min(dia[2] for dia in dias)),
+                'saldo_promedio': float(sum(dia[1] for dia in dias) / len(dias)),
+                'dias': len(dias),
+                'total_registros': sum(dia[4] for dia in dias),
+                'historico': historico
             }
-            
+
             return Response(response_data)
-        
+
         except Exception as e:
             logger.error(f"Error en estadisticas: {str(e)}", exc_info=True)
             return Response(
                 {'error': 'Error al procesar estadísticas'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            
             )
+
 class TransferenciaViewSet(viewsets.ModelViewSet):
     queryset = Transferencia.objects.select_related('emisor', 'receptor')
     serializer_class = TransferenciaSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['estado', 'emisor', 'receptor']
     ordering_fields = ['fecha_creacion', 'cantidad']
+    pagination_class = KeysetPagination
+    campo_cursor = 'fecha_creacion'
     http_method_names = ['get', 'post', 'head', 'options']
 
     def get_permissions(self):
-        if self.action == 'create':
+        if self.action in ['create', 'masiva']:
             return [IsAuthenticated()]
         elif self.action in ['retrieve', 'list']:
             return [IsTransferenciaParticipant()]
@@ -313,6 +308,7 @@ class TransferenciaViewSet(viewsets.ModelViewSet):
             return self.queryset.none()
         return self.queryset.filter(Q(emisor=user) | Q(receptor=user))
 
+    @idempotente('transferencias')
     def create(self, request, *args, **kwargs):
         serializer = TransferenciaCreateSerializer(
             data=request.data,
@@ -348,6 +344,42 @@ class TransferenciaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, MultiPartParser])
+    @idempotente('transferencias_masiva')
+    def masiva(self, request):
+        """Pago masivo: valida todo el lote y lo procesa en una sola transacción"""
+        serializer = TransferenciaMasivaSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            lote, resultados = Transferencia.procesar_lote(
+                request.user,
+                serializer.validated_data['transferencias']
+            )
+        except Exception as e:
+            logger.error(
+                f"Error al procesar pago masivo: {str(e)}",
+                exc_info=True,
+                extra={'user': request.user.id}
+            )
+            return Response(
+                {'error': 'Ocurrió un error al procesar el pago masivo'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        completadas = sum(1 for r in resultados if r['estado'] == Transferencia.Estados.COMPLETADA)
+        logger.info(
+            f"Pago masivo {lote}: {completadas}/{len(resultados)} transferencias completadas",
+            extra={'user': request.user.id}
+        )
+        return Response({
+            'lote': str(lote),
+            'total': len(resultados),
+            'completadas': completadas,
+            'fallidas': len(resultados) - completadas,
+            'resultados': resultados
+        }, status=status.HTTP_201_CREATED if completadas else status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def verificar(self, request, pk=None):
         transferencia = self.get_object()
@@ -410,6 +442,7 @@ class RecargaViewSet(viewsets.ModelViewSet):
         except Agente.DoesNotExist:
             return self.queryset.filter(usuario=user)
 
+    @idempotente('recargas')
     def create(self, request, *args, **kwargs):
         serializer = RecargaCreateSerializer(
             data=request.data,
@@ -450,10 +483,13 @@ class RecargaViewSet(viewsets.ModelViewSet):
 ## ----------------------------
 
 class AuditoriaBaseViewSet(viewsets.ReadOnlyModelViewSet):
+    # Solo los meses activos: lo archivado está en ArchivoAuditoria
     permission_classes = [IsAdminUser]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     ordering_fields = ['fecha']
-    
+    pagination_class = KeysetPagination
+    campo_cursor = 'fecha'
+
     def get_queryset(self):
         return super().get_queryset().select_related('usuario')
 
@@ -521,14 +557,24 @@ class ReporteViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'], permission_classes=[IsAdminUser])
     def generar(self, request, pk=None):
+        """Encola la generación en streaming; el avance se consulta en el propio reporte"""
         reporte = self.get_object()
+        if reporte.estado == Reporte.Estados.EN_PROCESO:
+            return Response(
+                {'error': 'El reporte ya se está generando'},
+                status=status.HTTP_409_CONFLICT
+            )
         try:
-            reporte.generar()
+            reporte.consulta()  # valida tipo y fechas antes de encolar
+            tarea = reporte.generar_async()
             logger.info(
-                f"Reporte {reporte.id} generado",
+                f"Reporte {reporte.id} enviado a generación",
                 extra={'user': request.user.id}
             )
-            return Response({'status': 'Reporte generado'})
+            return Response(
+                {'status': 'Reporte en generación', 'tarea': tarea},
+                status=status.HTTP_202_ACCEPTED
+            )
         except Exception as e:
             logger.error(
                 f"Error al generar reporte {reporte.id}: {str(e)}",
@@ -544,12 +590,24 @@ class ReporteViewSet(viewsets.ModelViewSet):
 ## 7. VISTAS DE NOTIFICACIONES
 ## ----------------------------
 
+class EventStreamRenderer(BaseRenderer):
+    """Permite negociar text/event-stream; el cuerpo lo genera la propia vista"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode(self.charset)
+
+
 class NotificacionViewSet(viewsets.ModelViewSet):
     serializer_class = NotificacionSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['tipo', 'leida']
     ordering_fields = ['fecha']
-    http_method_names = ['get', 'patch', 'head', 'options']
+    pagination_class = KeysetPagination
+    campo_cursor = 'fecha'
+    http_method_names = ['get', 'post', 'patch', 'head', 'options']
 
     def get_queryset(self):
         user = self.request.user
@@ -558,7 +616,8 @@ class NotificacionViewSet(viewsets.ModelViewSet):
         return Notificacion.objects.none()
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'partial_update']:
+        if self.action in ['list', 'retrieve', 'partial_update', 'no_leidas', 'conteo', 'stream',
+                           'marcar_leida', 'marcar_leidas', 'marcar_todas_leidas']:
             return [IsAuthenticated()]
         return [IsAdminUser()]
 
@@ -573,27 +632,90 @@ class NotificacionViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(notificaciones, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def conteo(self, request):
+        """
+        Número de notificaciones sin leer, servido desde la caché; pensado
+        para el sondeo frecuente de las apps en lugar de listar no_leidas
+        """
+        return Response({'no_leidas': Notificacion.contar_no_leidas(request.user.pk)})
+
+    @action(detail=False, methods=['get'], renderer_classes=[EventStreamRenderer, JSONRenderer])
+    def stream(self, request):
+        """
+        Canal Server-Sent Events con las notificaciones nuevas del usuario
+        (ver tiempo_real.flujo_notificaciones). Al reconectar, la cabecera
+        Last-Event-ID (o ?ultimo_id=) devuelve primero las creadas después;
+        los avisos masivos no se repiten ahí porque ya llegan por el canal
+        global.
+
+        Desactivado salvo con MONEDERO_SSE_ACTIVO = True: cada conexión
+        abierta ocupa un worker síncrono de gunicorn, así que solo debe
+        activarse con workers eventlet (ver Procfile).
+        """
+        if not getattr(settings, 'MONEDERO_SSE_ACTIVO', False):
+            return Response({'error': 'Canal en tiempo real no disponible'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            ultimo_id = int(request.headers.get('Last-Event-ID') or request.query_params.get('ultimo_id') or 0)
+        except ValueError:
+            ultimo_id = 0
+
+        cargar_pendientes = None
+        if ultimo_id:
+            queryset = self.get_queryset()
+
+            def cargar_pendientes():
+                return (queryset.filter(pk__gt=ultimo_id)
+                        .exclude(metadata__has_key='masivo')
+                        .order_by('pk')[:self.paginator.max_page_size])
+
+        respuesta = StreamingHttpResponse(
+            flujo_notificaciones(request.user.pk, cargar_pendientes),
+            content_type='text/event-stream'
+        )
+        respuesta['Cache-Control'] = 'no-cache'
+        # Sin buffer en nginx para que cada evento salga al momento
+        respuesta['X-Accel-Buffering'] = 'no'
+        return respuesta
+
     @action(detail=True, methods=['post'])
     def marcar_leida(self, request, pk=None):
-        notificacion = self.get_object()
         try:
-            notificacion.leida = True
-            notificacion.save()
-            logger.info(
-                f"Notificación {notificacion.id} marcada como leída",
-                extra={'user': request.user.id}
-            )
-            return Response({'status': 'Notificación marcada como leída'})
-        except Exception as e:
-            logger.error(
-                f"Error al marcar notificación como leída: {str(e)}",
-                exc_info=True,
-                extra={'user': request.user.id}
-            )
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return Response({'error': 'Notificación no encontrada'}, status=status.HTTP_404_NOT_FOUND)
+        # Un UPDATE condicional en lugar de cargar y guardar la fila completa
+        if not Notificacion.marcar_leidas(request.user.pk, ids=[pk]):
+            if not self.get_queryset().filter(pk=pk).exists():
+                return Response({'error': 'Notificación no encontrada'}, status=status.HTTP_404_NOT_FOUND)
+        logger.info(
+            f"Notificación {pk} marcada como leída",
+            extra={'user': request.user.id}
+        )
+        return Response({'status': 'Notificación marcada como leída'})
+
+    @action(detail=False, methods=['post'])
+    def marcar_leidas(self, request):
+        """Marca como leídas las notificaciones de {"ids": [...]} con un único UPDATE"""
+        ids = request.data.get('ids')
+        if (not isinstance(ids, list) or not ids or len(ids) > 1000
+                or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids)):
             return Response(
-                {'error': 'Error al actualizar notificación'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'ids debe ser una lista de 1 a 1000 identificadores'},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        marcadas = Notificacion.marcar_leidas(request.user.pk, ids=ids)
+        return Response({'marcadas': marcadas, 'no_leidas': Notificacion.contar_no_leidas(request.user.pk)})
+
+    @action(detail=False, methods=['post'])
+    def marcar_todas_leidas(self, request):
+        marcadas = Notificacion.marcar_leidas(request.user.pk)
+        logger.info(
+            f"{marcadas} notificaciones marcadas como leídas",
+            extra={'user': request.user.id}
+        )
+        return Response({'marcadas': marcadas, 'no_leidas': 0})
 
 ## ----------------------------
 ## 8. VISTAS DE TRANSACCIONES
@@ -603,7 +725,9 @@ class TransaccionViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TransaccionSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['tipo', 'estado', 'usuario']
-    ordering_fields = ['creado_en', 'cantidad']
+    ordering_fields = ['creado_en']
+    pagination_class = KeysetPagination
+    campo_cursor = 'creado_en'
 
     def get_queryset(self):
         user = self.request.user